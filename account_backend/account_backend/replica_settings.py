@@ -0,0 +1,11 @@
+"""Settings for running the read replica tests against a local SQLite replica of "default".
+
+    python manage.py test accounts.tests.ReplicaRoutingTests --settings=account_backend.replica_settings
+
+In tests the replica mirrors "default", so it sees the rows the tests commit.
+"""
+import os
+
+os.environ.setdefault("DATABASE_REPLICA_URLS", "default=sqlite:///replica.sqlite3")
+
+from .settings import *
@@ -1,5 +1,7 @@
 import os
 from pathlib import Path
+
+import dj_database_url
 from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -30,6 +32,7 @@ INSTALLED_APPS = [
     "corsheaders",
     "accounts",
     "rest_framework",
+    "service_common",
 ]
 
 # password hashers
@@ -41,7 +44,11 @@ PASSWORD_HASHERS = [
 ]
 
 MIDDLEWARE = [
+    "service_common.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    # After CorsMiddleware, so the browser can read a shed 503
+    "service_common.admission.LoadShedMiddleware",
+    "service_common.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -49,6 +56,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "service_common.replicas.ReplicaMiddleware",
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -98,6 +106,51 @@ DATABASES = {
         "PORT": "5432",
     }
 }
+# e.g. sqlite:///bench.sqlite3 to benchmark locally against the seeded data
+if os.environ.get("DATABASE_URL"):
+    DATABASES = {"default": dj_database_url.parse(os.environ["DATABASE_URL"], conn_max_age=600)}
+
+# Read replicas (service_common.replicas): DATABASE_REPLICA_URLS lists
+# whitespace-separated "default=url" pairs. Requests read from a replica
+# unless they write, or the profile they read was written within
+# DATABASE_REPLICA_STICKY_SECONDS. A replica more than DATABASE_REPLICA_MAX_LAG
+# seconds behind, checked every DATABASE_REPLICA_CHECK_INTERVAL, takes no
+# reads; keep the lag limit below the sticky window.
+DATABASE_REPLICAS = {}
+for spec in os.environ.get("DATABASE_REPLICA_URLS", "").split():
+    primary, _, url = spec.partition("=")
+    aliases = DATABASE_REPLICAS.setdefault(primary, [])
+    aliases.append(f"{primary}_replica{len(aliases) + 1}")
+    DATABASES[aliases[-1]] = dj_database_url.parse(url, conn_max_age=600)
+    DATABASES[aliases[-1]]["TEST"] = {"MIRROR": primary}
+DATABASE_ROUTERS = ["service_common.replicas.ReplicaRouter"]
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get("DATABASE_REPLICA_STICKY_SECONDS", "10"))
+DATABASE_REPLICA_MAX_LAG = float(os.environ.get("DATABASE_REPLICA_MAX_LAG", "5"))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.environ.get("DATABASE_REPLICA_CHECK_INTERVAL", "2"))
+# Cache holding the recent-writer markers: the shared profile cache below
+# (ACCOUNTS_CACHE_ALIAS), so set REDIS_URL when using replicas
+DATABASE_REPLICA_CACHE_ALIAS = "accounts"
+
+# Connection pool (service_common.pooled_postgresql): each worker process keeps
+# DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE connections per database, replicas
+# included, and a request waits up to DB_POOL_TIMEOUT seconds for one. Idle
+# connections are closed after DB_POOL_MAX_IDLE seconds and all are replaced
+# after DB_POOL_MAX_LIFETIME; with DB_POOL_CHECK each checkout is tested first.
+DB_POOL_ENABLED = os.environ.get("DB_POOL_ENABLED", "True") == "True"
+for database in DATABASES.values():
+    if DB_POOL_ENABLED and database["ENGINE"] == "django.db.backends.postgresql":
+        database.update(
+            ENGINE="service_common.pooled_postgresql",
+            CONN_MAX_AGE=0,
+            POOL={
+                "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", "2")),
+                "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", "10")),
+                "timeout": float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+                "max_idle": float(os.environ.get("DB_POOL_MAX_IDLE", "600")),
+                "max_lifetime": float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600")),
+                "check": os.environ.get("DB_POOL_CHECK", "True") == "True",
+            },
+        )
 
 
 # Password validation
@@ -123,6 +176,77 @@ MINIO_ENDPOINT = os.environ.get("MINIO_ENDPOINT", "localhost:9000")
 MINIO_ACCESS_KEY = os.environ.get("MINIO_ROOT_USER")
 MINIO_SECRET_KEY = os.environ.get("MINIO_ROOT_PASSWORD")
 MINIO_USE_SSL = os.environ.get("MINIO_USE_SSL", "False") == "True"
+# Signing needs no network call when the region is known (MinIO's default is us-east-1)
+MINIO_REGION = os.environ.get("MINIO_REGION", "us-east-1") or None
+# Download URLs are signed per window of this many seconds and reused within
+# it; must stay well below their 60-minute expiry.
+MINIO_PRESIGN_WINDOW = int(os.environ.get("MINIO_PRESIGN_WINDOW", "600"))
+MINIO_PRESIGN_CACHE_SIZE = int(os.environ.get("MINIO_PRESIGN_CACHE_SIZE", "10000"))
+
+# Cache shared by every worker and pod (ACCOUNTS_CACHE_ALIAS), for profiles
+# and the replicas' recent-writer markers: Redis at REDIS_URL. Without it
+# nothing is cached there, since copies kept per process would go stale when
+# another worker updates a profile.
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "accounts": (
+        {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL, "KEY_PREFIX": "accounts"}
+        if REDIS_URL
+        else {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    ),
+}
+ACCOUNTS_CACHE_ALIAS = "accounts"
+
+# Batch profile lookups (accounts.profiles): most ids per request, and how
+# long found and unknown ids are cached.
+PROFILE_BATCH_MAX_IDS = int(os.environ.get("PROFILE_BATCH_MAX_IDS", "500"))
+PROFILE_CACHE_TIMEOUT = int(os.environ.get("PROFILE_CACHE_TIMEOUT", "60"))
+PROFILE_CACHE_NOT_FOUND_TIMEOUT = int(os.environ.get("PROFILE_CACHE_NOT_FOUND_TIMEOUT", "30"))
+
+# Password verification pool (accounts.service.password_verifier): threads
+# are limited to what the memory budget allows at 32 MiB per scrypt call. At
+# most PASSWORD_VERIFY_QUEUE_SIZE more calls wait, each for up to
+# PASSWORD_VERIFY_QUEUE_TIMEOUT seconds, before failing fast.
+PASSWORD_VERIFY_MEMORY_BUDGET_MB = int(os.environ.get("PASSWORD_VERIFY_MEMORY_BUDGET_MB", "256"))
+PASSWORD_VERIFY_MAX_WORKERS = int(os.environ.get("PASSWORD_VERIFY_MAX_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_VERIFY_QUEUE_SIZE = int(os.environ.get("PASSWORD_VERIFY_QUEUE_SIZE", "64"))
+PASSWORD_VERIFY_QUEUE_TIMEOUT = float(os.environ.get("PASSWORD_VERIFY_QUEUE_TIMEOUT", "2"))
+
+# Prometheus metrics (service_common.metrics): METRICS_TOKEN, if set, must be sent
+# as a bearer token to read /metrics. Requests slower than SLOW_REQUEST_MS are
+# logged with their slowest queries.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True") == "True"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", "500"))
+
+# On-demand profiling (service_common.profiling): requests with an X-Profile-Token
+# signed with PROFILING_SECRET (see `manage.py profile_token`), plus a random
+# PROFILING_SAMPLE_RATE share, are sampled every PROFILING_INTERVAL_MS. The
+# last PROFILING_MAX_PROFILES are kept in PROFILING_DIR, or in memory.
+PROFILING_SECRET = os.environ.get("PROFILING_SECRET")
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = int(os.environ.get("PROFILING_INTERVAL_MS", "5"))
+PROFILING_DIR = os.environ.get("PROFILING_DIR")
+PROFILING_MAX_PROFILES = int(os.environ.get("PROFILING_MAX_PROFILES", "50"))
+
+# Load shedding (service_common.admission): each worker process serves at most an
+# adaptive number of requests at once, between LOAD_SHED_MIN_LIMIT and
+# LOAD_SHED_MAX_LIMIT. Every LOAD_SHED_INTERVAL_MS the limit is cut when the
+# median latency is over LOAD_SHED_LATENCY_TOLERANCE times the unloaded one,
+# or when requests keep waiting longer than LOAD_SHED_QUEUE_TARGET_MS before
+# reaching the worker (from the proxy's X-Request-Start). It grows by one
+# while it is reached. Writes may use LOAD_SHED_WRITE_SHARE of it. Shed
+# requests get 503 with Retry-After: LOAD_SHED_RETRY_AFTER.
+LOAD_SHED_ENABLED = os.environ.get("LOAD_SHED_ENABLED", "True") == "True"
+LOAD_SHED_INITIAL_LIMIT = int(os.environ.get("LOAD_SHED_INITIAL_LIMIT", "20"))
+LOAD_SHED_MIN_LIMIT = int(os.environ.get("LOAD_SHED_MIN_LIMIT", "2"))
+LOAD_SHED_MAX_LIMIT = int(os.environ.get("LOAD_SHED_MAX_LIMIT", "200"))
+LOAD_SHED_LATENCY_TOLERANCE = float(os.environ.get("LOAD_SHED_LATENCY_TOLERANCE", "2"))
+LOAD_SHED_QUEUE_TARGET_MS = int(os.environ.get("LOAD_SHED_QUEUE_TARGET_MS", "100"))
+LOAD_SHED_INTERVAL_MS = int(os.environ.get("LOAD_SHED_INTERVAL_MS", "500"))
+LOAD_SHED_WRITE_SHARE = float(os.environ.get("LOAD_SHED_WRITE_SHARE", "0.75"))
+LOAD_SHED_RETRY_AFTER = int(os.environ.get("LOAD_SHED_RETRY_AFTER", "2"))
 
 
 # Internationalization
@@ -17,7 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from service_common.metrics import metrics_view
+from service_common.profiling import profile_view, profiles_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/accounts/', include('accounts.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', profiles_view, name='profiles'),
+    path('profiles/<str:profile_id>/', profile_view, name='profile'),
 ]
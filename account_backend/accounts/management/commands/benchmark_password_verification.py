@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from accounts.service import (
+    SCRYPT_DKLEN,
+    SCRYPT_MAXMEM,
+    SCRYPT_N,
+    SCRYPT_P,
+    SCRYPT_R,
+    VerifierOverloaded,
+    password_verifier,
+    verify_better_auth_password,
+)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class PeakRSS(threading.Thread):
+    """Polls the resident set size until stopped and keeps the maximum."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = rss_bytes()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(0.005):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        return self.peak
+
+
+class Command(BaseCommand):
+    help = (
+        "Login throughput, latency and peak RSS of concurrent scrypt verifications: "
+        "inline in every request thread vs the bounded password_verifier pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=32, help="Simultaneous logins.")
+
+    def handle(self, *args, **options):
+        salt = os.urandom(16)
+        digest = hashlib.scrypt(
+            b"benchmark-password", salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, maxmem=SCRYPT_MAXMEM, dklen=SCRYPT_DKLEN
+        )
+        stored = f"{salt.hex()}:{digest.hex()}"
+        if not verify_better_auth_password("benchmark-password", stored):
+            raise AssertionError("scrypt parameters do not round-trip")
+
+        self.stdout.write(
+            f"pool: {password_verifier.workers} workers, queue {password_verifier.queue_size}, "
+            f"timeout {password_verifier.queue_timeout}s"
+        )
+        total, concurrency = options["requests"], options["concurrency"]
+        self.report("inline", *self.threads(verify_better_auth_password, stored, total, concurrency))
+        self.report("pool", *self.threads(password_verifier.verify, stored, total, concurrency))
+        self.report("pool async", *asyncio.run(self.coroutines(stored, total, concurrency)))
+
+    def threads(self, verify, stored, total, concurrency):
+        def one(_):
+            started = time.perf_counter()
+            try:
+                verify("benchmark-password", stored)
+            except VerifierOverloaded:
+                return None
+            return time.perf_counter() - started
+
+        monitor = PeakRSS()
+        monitor.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = list(executor.map(one, range(total)))
+        return time.perf_counter() - started, latencies, monitor.stop()
+
+    async def coroutines(self, stored, total, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await password_verifier.averify("benchmark-password", stored)
+                except VerifierOverloaded:
+                    return None
+                return time.perf_counter() - started
+
+        monitor = PeakRSS()
+        monitor.start()
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(total)))
+        return time.perf_counter() - started, latencies, monitor.stop()
+
+    def report(self, name, elapsed, latencies, peak):
+        accepted = sorted(latency for latency in latencies if latency is not None)
+        rejected = len(latencies) - len(accepted)
+        if not accepted:
+            self.stdout.write(f"{name:>10}: all {rejected} rejected")
+            return
+        self.stdout.write(
+            f"{name:>10}: {len(accepted) / elapsed:6.1f} logins/s  "
+            f"p50={accepted[len(accepted) // 2] * 1000:.0f}ms  "
+            f"p99={accepted[max(0, int(len(accepted) * 0.99) - 1)] * 1000:.0f}ms  "
+            f"rejected={rejected}  peak RSS={peak / 2**20:.0f} MiB"
+        )
@@ -0,0 +1,109 @@
+import json
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from service_common.benchmarks import (
+    SEED_PREFIX,
+    client_host,
+    compare,
+    format_table,
+    run_scenario,
+    write_results,
+    zipf_weights,
+)
+from accounts.models import User
+
+SCENARIOS = ["profile", "batch_profiles", "upload_intent", "update_profile"]
+# Users looked up per batch_profiles request, about one page of comments
+BATCH_SIZE = 50
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay profile fetch, batch profile lookup, upload intent and profile update requests through the full "
+        "middleware stack against users seeded by seed_users, and report throughput, "
+        "p50/p95/p99 and queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=50, help="Untimed requests before each scenario.")
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+        parser.add_argument("--users", type=int, default=1000, help="Seeded users requests are spread over.")
+        parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of user activity.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--compare", help="Results JSON of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        scenarios = options["scenarios"].split(",")
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        users = list(
+            User.objects.filter(id__startswith=SEED_PREFIX).order_by("id").values_list("id", flat=True)[: options["users"]]
+        )
+        if not users:
+            raise CommandError("No seeded users; run seed_users first.")
+
+        rng = random.Random(options["seed"])
+        weights = zipf_weights(len(users), options["skew"])
+        picks = [rng.choices(users, cum_weights=weights)[0] for _ in range(options["warmup"] + options["requests"])]
+        client = Client(HTTP_HOST=client_host(settings.ALLOWED_HOSTS))
+
+        def prepare_user(i):
+            return (picks[i],)
+
+        def call_profile(user_id):
+            return client.get(f"/api/accounts/{user_id}/profile/")
+
+        def prepare_batch(i):
+            return ({"ids": [rng.choices(users, cum_weights=weights)[0] for _ in range(BATCH_SIZE)]},)
+
+        def call_batch(body):
+            return client.post("/api/accounts/batch_profiles/", json.dumps(body), content_type="application/json")
+
+        def prepare_upload(i):
+            return ({"file_name": rng.choice(["avatar.png", "avatar.jpg", "photo.webp"])},)
+
+        def call_upload(body):
+            return client.post("/api/accounts/upload_image/", json.dumps(body), content_type="application/json")
+
+        def prepare_update(i):
+            return picks[i], {"name": f"Seed User {rng.randrange(1_000_000)}"}
+
+        def call_update(user_id, body):
+            return client.put(
+                f"/api/accounts/{user_id}/update_profile/", json.dumps(body), content_type="application/json"
+            )
+
+        def check_ok(response):
+            return response.status_code == 200
+
+        def check_upload(response):
+            # The view answers 200 with a null URL when presigning fails
+            return response.status_code == 200 and response.json()["uploadUrl"] is not None
+
+        plans = {
+            "profile": (prepare_user, call_profile, check_ok),
+            "batch_profiles": (prepare_batch, call_batch, check_ok),
+            "upload_intent": (prepare_upload, call_upload, check_upload),
+            "update_profile": (prepare_update, call_update, check_ok),
+        }
+        results = []
+        for name in scenarios:
+            prepare, call, check = plans[name]
+            results.append(run_scenario(name, options["requests"], prepare, call, check, options["warmup"]))
+
+        self.stdout.write(format_table(results))
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as previous:
+                self.stdout.write(compare(json.load(previous), results))
+        if options["output"]:
+            recorded = {key: options[key] for key in ("requests", "warmup", "scenarios", "users", "skew", "seed")}
+            write_results(options["output"], recorded, results)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,65 @@
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from service_common.benchmarks import SEED_PREFIX, seed_user_id
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        f"Seed synthetic '{SEED_PREFIX}*' users for benchmarks, with the same ids "
+        "the watchlist service's seed_watchlists uses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100000)
+        parser.add_argument("--image-ratio", type=float, default=0.6, help="Share of users with a profile image.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=1, help="Random seed; the same seed gives the same data.")
+        parser.add_argument("--clear", action="store_true", help="Delete previously seeded users first.")
+
+    def handle(self, *args, **options):
+        # The table belongs to the web app's schema (managed=False); create
+        # it for a standalone benchmark database such as SQLite.
+        if User._meta.db_table not in connection.introspection.table_names():
+            with connection.schema_editor() as editor:
+                editor.create_model(User)
+            self.stdout.write(f"Created table {User._meta.db_table!r}")
+
+        if options["clear"]:
+            User.objects.filter(id__startswith=SEED_PREFIX).delete()
+
+        rng = random.Random(options["seed"])
+        batch_size = options["batch_size"]
+        started = time.perf_counter()
+        users = []
+        for index in range(options["users"]):
+            user_id = seed_user_id(index)
+            has_image = rng.random() < options["image_ratio"]
+            users.append(
+                User(
+                    id=user_id,
+                    name=f"Seed User {index}",
+                    email=f"{user_id}@example.com",
+                    emailVerified=rng.random() < 0.8,
+                    image=f"images/{uuid.UUID(int=rng.getrandbits(128))}.jpg" if has_image else None,
+                    role="admin" if rng.random() < 0.001 else "user",
+                )
+            )
+            if len(users) == batch_size:
+                self.flush(users, batch_size)
+                self.stdout.write(f"{index + 1} users")
+        self.flush(users, batch_size)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Seeded {options['users']} users in {elapsed:.1f}s ({options['users'] / elapsed:.0f} rows/s)")
+        )
+
+    def flush(self, users, batch_size):
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=batch_size, ignore_conflicts=True)
+        users.clear()
@@ -0,0 +1,10 @@
+from prometheus_client import Counter, Histogram
+from service_common.metrics import LATENCY_BUCKETS
+
+# Account-only metrics; the request, database and load-shedding ones are in
+# service_common.metrics.
+
+MINIO_DURATION = Histogram(
+    "minio_request_duration_seconds", "Latency of MinIO client calls.", ["operation"], buckets=LATENCY_BUCKETS
+)
+MINIO_ERRORS = Counter("minio_errors_total", "MinIO client calls that raised.", ["operation"])
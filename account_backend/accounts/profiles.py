@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connections, router
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from rest_framework import exceptions, serializers, status
+
+from service_common import replicas
+from .models import User
+from .services.minio_client import generate_presigned_download_urls
+
+AVATAR_BUCKET = "userasset"
+# Cached for ids that match no user, so repeated lookups skip the database
+NOT_FOUND = False
+# Columns UpdateUserProfileView responds with, plus what the ETag needs
+UPDATE_RETURNING = ["id", "name", "email", "image", "updatedAt"]
+
+
+class PreconditionFailed(exceptions.APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = "The profile was changed by another request; fetch it again and retry."
+    default_code = "precondition_failed"
+
+
+def profile_cache_key(user_id):
+    return f"profile:{user_id}"
+
+
+def profile_cache():
+    return caches[settings.ACCOUNTS_CACHE_ALIAS]
+
+
+def forget_profile(user_id):
+    profile_cache().delete(profile_cache_key(user_id))
+
+
+def get_profiles(user_ids):
+    """Public profiles (`id`, `name`, `image`, `image_url`) by id, None for unknown ids.
+
+    One cache get_many, one `id__in` query for the ids it missed and one
+    signing pass over the avatars, however many ids are asked for. Rows are
+    cached without `image_url`, which is signed per window when served.
+    """
+    cache = profile_cache()
+    ids = list(dict.fromkeys(user_ids))
+    keys = {profile_cache_key(user_id): user_id for user_id in ids}
+    rows = {keys[key]: row for key, row in cache.get_many(keys).items()}
+
+    missing = [user_id for user_id in ids if user_id not in rows]
+    if missing:
+        users = User.objects.all()
+        # A replica could still have the old row and put it back in the cache
+        if replicas.written(missing):
+            users = users.using(router.db_for_write(User))
+        found = {
+            user_id: {"id": user_id, "name": name, "image": image}
+            for user_id, name, image in users.filter(id__in=missing).values_list("id", "name", "image")
+        }
+        unknown = dict.fromkeys((user_id for user_id in missing if user_id not in found), NOT_FOUND)
+        cache.set_many(
+            {profile_cache_key(user_id): row for user_id, row in found.items()}, timeout=settings.PROFILE_CACHE_TIMEOUT
+        )
+        cache.set_many(
+            {profile_cache_key(user_id): row for user_id, row in unknown.items()},
+            timeout=settings.PROFILE_CACHE_NOT_FOUND_TIMEOUT,
+        )
+        rows.update(found)
+        rows.update(unknown)
+
+    urls = generate_presigned_download_urls(AVATAR_BUCKET, [row["image"] for row in rows.values() if row and row["image"]])
+    return {
+        user_id: {**rows[user_id], "image_url": urls.get(rows[user_id]["image"])} if rows[user_id] else None
+        for user_id in ids
+    }
+
+
+def profile_etag(updated_at):
+    return f'"{updated_at.isoformat()}"'
+
+
+def if_match_versions(request):
+    """`updatedAt` values the If-Match header accepts; None when any version is acceptable."""
+    tags = parse_etags(request.headers.get("If-Match", ""))
+    if not tags or tags == ["*"]:
+        return None
+    # If-Match compares strongly, so weak tags (W/"...") never match
+    versions = [parse_datetime(tag.strip('"')) for tag in tags if tag.startswith('"')]
+    if not versions or not all(versions):
+        raise PreconditionFailed()
+    return versions
+
+
+def update_profile(user_id, changes, versions=None):
+    """Write only the `changes` columns with one conditional UPDATE ... RETURNING.
+
+    With `versions`, the row is updated only while its `updatedAt` is one of
+    them. Raises Http404 or PreconditionFailed (412) when nothing was
+    updated, and a 400 ValidationError when the email is taken; the unique
+    constraint does that check instead of a separate query.
+    """
+    db = router.db_for_write(User)
+    connection = connections[db]
+    meta = User._meta
+    quote = connection.ops.quote_name
+    assignments = {**changes, "updatedAt": timezone.now()}
+    fields = [meta.get_field(name) for name in assignments]
+    params = [field.get_db_prep_save(assignments[field.name], connection) for field in fields]
+    where = f"{quote(meta.pk.column)} = %s"
+    params.append(user_id)
+    if versions:
+        updated_at = meta.get_field("updatedAt")
+        where += f" AND {quote(updated_at.column)} IN ({', '.join(['%s'] * len(versions))})"
+        params += [updated_at.get_db_prep_value(version, connection) for version in versions]
+    sql = (
+        f"UPDATE {quote(meta.db_table)} SET {', '.join(f'{quote(field.column)} = %s' for field in fields)} "
+        f"WHERE {where} RETURNING {', '.join(quote(meta.get_field(name).column) for name in UPDATE_RETURNING)}"
+    )
+    try:
+        user = next(iter(User.objects.db_manager(db).raw(sql, params)), None)
+    except IntegrityError:
+        raise serializers.ValidationError({"email": ["Email already in use"]})
+    if user is None:
+        # Only failed updates pay for telling the two cases apart
+        if versions and User.objects.using(db).filter(id=user_id).exists():
+            raise PreconditionFailed()
+        raise Http404("No User matches the given query.")
+    forget_profile(user_id)
+    return user
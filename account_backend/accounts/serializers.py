@@ -1,4 +1,5 @@
 # serializers.py
+from django.conf import settings
 from rest_framework import serializers
 from .models import User
 from .services.minio_client import generate_presigned_download_url
@@ -8,12 +9,8 @@ class UserUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["name", "email", "image"]
-
-    def validate_email(self, value):
-        user_id = self.instance.id
-        if User.objects.exclude(id=user_id).filter(email=value).exists():
-            raise serializers.ValidationError("Email already in use")
-        return value
+        # Uniqueness is left to the database constraint; see accounts.profiles.update_profile
+        extra_kwargs = {"email": {"validators": []}}
 
 
 class UserProfileDetailSerializer(serializers.ModelSerializer):
@@ -29,3 +26,9 @@ class UserProfileDetailSerializer(serializers.ModelSerializer):
                 return generate_presigned_download_url("userasset", obj.image)
             except Exception:
                 return "/images/avatar.png"
+
+
+class UserProfileBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.CharField(max_length=255), min_length=1, max_length=settings.PROFILE_BATCH_MAX_IDS
+    )
@@ -1,8 +1,34 @@
+import asyncio
 import hashlib
 import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# Better Auth's scrypt parameters: N (cost) 16384, r (block size) 16,
+# p (parallelization) 1, 64-byte key (128 hex characters)
+SCRYPT_N = 16384
+SCRYPT_R = 16
+SCRYPT_P = 1
+SCRYPT_DKLEN = 64
+# Working memory of one derivation (128 * N * r * p = 32 MiB). OpenSSL's
+# default limit is exactly 32 MiB, which these parameters just exceed.
+SCRYPT_MEMORY = 128 * SCRYPT_N * SCRYPT_R * SCRYPT_P
+SCRYPT_MAXMEM = SCRYPT_MEMORY + 1024 * 1024
+
+
+class VerifierOverloaded(Exception):
+    """Too many verifications are queued, or this one waited too long to start."""
 
 
 def verify_better_auth_password(plain_password, stored_password):
+    """Check `plain_password` against a Better Auth `salt:hash` in the calling thread.
+
+    Takes about 32 MiB and tens of milliseconds of CPU; request code should
+    go through `password_verifier` instead.
+    """
     try:
         # Split the salt and the hash
         salt_hex, hash_hex = stored_password.split(':')
@@ -10,19 +36,89 @@ def verify_better_auth_password(plain_password, stored_password):
         salt = bytes.fromhex(salt_hex)
         stored_hash = bytes.fromhex(hash_hex)
 
-        # Better Auth / Scrypt default parameters:
-        # N (Cost): 16384, r (Block size): 8, p (Parallelization): 1
-        # Key length is 64 bytes (which results in 128 hex characters)
         derived_hash = hashlib.scrypt(
             plain_password.encode('utf-8'),
             salt=salt,
-            n=16384,
-            r=16,
-            p=1,
-            dklen=64
+            n=SCRYPT_N,
+            r=SCRYPT_R,
+            p=SCRYPT_P,
+            maxmem=SCRYPT_MAXMEM,
+            dklen=SCRYPT_DKLEN
         )
 
         # Use hmac.compare_digest for security against timing attacks
         return hmac.compare_digest(derived_hash, stored_hash)
     except (ValueError, AttributeError):
         return False
+
+
+class PasswordVerifier:
+    """Runs scrypt verifications on a bounded pool of threads.
+
+    hashlib.scrypt releases the GIL, so the pool uses several cores while
+    request threads and the event loop stay free. The pool has as many
+    threads as `memory_budget` allows derivations (capped at
+    `max_workers`), which bounds the memory scrypt can take. At most
+    `queue_size` further verifications wait; beyond that VerifierOverloaded
+    is raised straight away, and a caller whose verification has not
+    started within `queue_timeout` seconds gets it as soon as that time is
+    up, so an overloaded pod sheds logins instead of piling them up.
+    """
+
+    def __init__(self, memory_budget, max_workers, queue_size, queue_timeout):
+        self.workers = max(1, min(max_workers, memory_budget // SCRYPT_MEMORY))
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="scrypt")
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, plain_password, stored_password):
+        with self._lock:
+            if self.pending >= self.workers + self.queue_size:
+                raise VerifierOverloaded("Password verification queue is full")
+            self.pending += 1
+        try:
+            future = self.executor.submit(self._run, time.monotonic(), plain_password, stored_password)
+        except BaseException:
+            self._done()
+            raise
+        future.add_done_callback(lambda future: self._done())
+        return future
+
+    def _done(self):
+        with self._lock:
+            self.pending -= 1
+
+    def _run(self, queued_at, plain_password, stored_password):
+        if time.monotonic() - queued_at > self.queue_timeout:
+            raise VerifierOverloaded("Password verification waited too long to start")
+        return verify_better_auth_password(plain_password, stored_password)
+
+    def verify(self, plain_password, stored_password):
+        future = self.submit(plain_password, stored_password)
+        try:
+            return future.result(timeout=self.queue_timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise VerifierOverloaded("Password verification waited too long to start")
+            # Started in time; one derivation is short
+            return future.result()
+
+    async def averify(self, plain_password, stored_password):
+        future = self.submit(plain_password, stored_password)
+        result = asyncio.wrap_future(future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(result), self.queue_timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise VerifierOverloaded("Password verification waited too long to start")
+            return await result
+
+
+password_verifier = PasswordVerifier(
+    memory_budget=settings.PASSWORD_VERIFY_MEMORY_BUDGET_MB * 1024 * 1024,
+    max_workers=settings.PASSWORD_VERIFY_MAX_WORKERS,
+    queue_size=settings.PASSWORD_VERIFY_QUEUE_SIZE,
+    queue_timeout=settings.PASSWORD_VERIFY_QUEUE_TIMEOUT,
+)
@@ -1,41 +1,72 @@
+import logging
+import time
+from functools import lru_cache
 from minio import Minio
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from django.conf import settings
+from ..metrics import MINIO_DURATION, MINIO_ERRORS
+
+logger = logging.getLogger(__name__)
 
 
 minio_client = Minio(
     endpoint=settings.MINIO_ENDPOINT,
     access_key=settings.MINIO_ACCESS_KEY,
     secret_key=settings.MINIO_SECRET_KEY,
-    secure = False
+    secure = False,
+    # A known region lets the client sign URLs without a GetBucketLocation call
+    region=settings.MINIO_REGION
 )
 
+DOWNLOAD_URL_EXPIRY = timedelta(minutes=60)
+
 def generate_presigned_upload_url(bucket_name, object_name):
     if not object_name:
         return None
     try:
-        url = minio_client.presigned_put_object(
-            bucket_name,
-            object_name,
-            expires = timedelta(minutes=5)
-        )
+        with MINIO_DURATION.labels("presigned_put_object").time():
+            url = minio_client.presigned_put_object(
+                bucket_name,
+                object_name,
+                expires = timedelta(minutes=5)
+            )
 
         return url
     except Exception as e:
-        print(f"Error generating presigned_url: {e}")
+        MINIO_ERRORS.labels("presigned_put_object").inc()
+        logger.warning("Error generating presigned_url: %s", e)
         return None
     
 def generate_presigned_download_url(bucket_name, object_name):
     if not object_name:
         return None
-    try:
-        url = minio_client.presigned_get_object(
+    return generate_presigned_download_urls(bucket_name, [object_name])[object_name]
+
+
+def generate_presigned_download_urls(bucket_name, object_names):
+    """Download URLs by object name, all signed for the current window."""
+    # Signed as of the start of the current window, so every request in the
+    # window gets the same URL and browsers and CDNs can cache the object.
+    window = settings.MINIO_PRESIGN_WINDOW
+    window_start = int(time.time()) // window * window
+    urls = {}
+    for object_name in set(object_names):
+        try:
+            urls[object_name] = _presigned_download_url(bucket_name, object_name, window_start)
+        except Exception as e:
+            MINIO_ERRORS.labels("presigned_get_object").inc()
+            logger.warning("Error generating presigned_url: %s", e)
+            urls[object_name] = None
+    return urls
+
+
+@lru_cache(maxsize=settings.MINIO_PRESIGN_CACHE_SIZE)
+def _presigned_download_url(bucket_name, object_name, window_start):
+    # Failures raise instead of returning None so they are not cached
+    with MINIO_DURATION.labels("presigned_get_object").time():
+        return minio_client.presigned_get_object(
             bucket_name,
             object_name,
-            expires = timedelta(minutes=60)
+            expires = DOWNLOAD_URL_EXPIRY,
+            request_date = datetime.fromtimestamp(window_start, timezone.utc)
         )
-
-        return url
-    except Exception as e:
-        print(f"Error generating presigned_url: {e}")
-        return None
\ No newline at end of file
@@ -1,3 +1,386 @@
-from django.test import TestCase
+import asyncio
+import os
+import runpy
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from minio import Minio
+from prometheus_client import REGISTRY
+from psycopg_pool import PoolTimeout
+
+from service_common import replicas
+from service_common.pooled_postgresql import base as pooled_postgresql
+from .models import User
+from .profiles import forget_profile, get_profiles
+from .services import minio_client
+from .service import SCRYPT_MEMORY, PasswordVerifier, VerifierOverloaded
+
+# Stands in for the Redis instance every worker shares
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "accounts": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "accounts-tests"},
+}
+
+
+def create_user_table():
+    """User is unmanaged (the auth service owns the table), so test databases start without it."""
+    connection = connections[router.db_for_write(User)]
+    if User._meta.db_table not in connection.introspection.table_names():
+        with connection.schema_editor() as editor:
+            editor.create_model(User)
+
+
+class UserTableTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Before the class-wide transaction, which SQLite's schema editor refuses to run in
+        create_user_table()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(id="ada", name="Ada", email="ada@example.com")
+        User.objects.create(id="grace", name="Grace", email="grace@example.com")
+
+
+@override_settings(MINIO_PRESIGN_WINDOW=600)
+class PresignedDownloadTests(SimpleTestCase):
+    # At the start of a window
+    now = 1_800_000_000
+
+    def setUp(self):
+        minio_client._presigned_download_url.cache_clear()
+        self.addCleanup(minio_client._presigned_download_url.cache_clear)
+        client = Minio("localhost:9000", access_key="key", secret_key="secret", secure=False, region="us-east-1")
+        mock.patch.object(minio_client, "minio_client", client).start()
+        self.sign = mock.patch.object(client, "presigned_get_object", wraps=client.presigned_get_object).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def url(self, at, object_name="avatar.png"):
+        with mock.patch.object(minio_client.time, "time", return_value=at):
+            return minio_client.generate_presigned_download_url("avatars", object_name)
+
+    def test_same_url_within_a_window(self):
+        first = self.url(self.now)
+        self.assertIn("X-Amz-Signature=", first)
+        self.assertEqual(self.url(self.now + 599), first)
+        self.assertEqual(self.sign.call_count, 1)
+        self.assertNotEqual(self.url(self.now + 1, "other.png"), first)
+
+    def test_new_url_in_the_next_window(self):
+        first = self.url(self.now + 599)
+        second = self.url(self.now + 600)
+        self.assertNotEqual(second, first)
+        self.assertIn("X-Amz-Date=20270115T081000Z", second)
+        self.assertEqual(self.sign.call_count, 2)
+
+    def test_failures_are_not_cached(self):
+        self.sign.side_effect = [OSError("unreachable"), "http://localhost:9000/avatars/avatar.png?signed"]
+        with self.assertLogs(minio_client.logger, "WARNING"):
+            urls = minio_client.generate_presigned_download_urls("avatars", ["avatar.png"])
+        self.assertEqual(urls, {"avatar.png": None})
+        self.assertEqual(self.url(self.now), "http://localhost:9000/avatars/avatar.png?signed")
+        self.assertIsNone(minio_client.generate_presigned_download_url("avatars", ""))
+
+
+class PooledPostgresqlTests(SimpleTestCase):
+    def setUp(self):
+        self.pool_class = mock.patch.object(pooled_postgresql, "ConnectionPool").start()
+        self.pool = self.pool_class.return_value
+        self.pool.get_stats.return_value = {"pool_size": 1}
+        mock.patch.dict(pooled_postgresql._pools, clear=True).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def settings_module(self, **environ):
+        environ = {"DATABASE_URL": "postgres://accounts:secret@db:5432/accounts", **environ}
+        with mock.patch.dict(os.environ, environ):
+            return runpy.run_path(str(settings.BASE_DIR / "account_backend" / "settings.py"))
+
+    def wrapper(self, **overrides):
+        settings_dict = {
+            **connections["default"].settings_dict,
+            "ENGINE": "service_common.pooled_postgresql",
+            "NAME": "pool_tests",
+            "OPTIONS": {},
+            "CONN_MAX_AGE": 0,
+            **overrides,
+        }
+        return pooled_postgresql.DatabaseWrapper(settings_dict, alias="pool-tests")
+
+    def in_use(self):
+        return REGISTRY.get_sample_value("db_pool_connections_in_use", {"alias": "pool-tests"}) or 0
+
+    def test_pool_settings_are_read_from_the_environment(self):
+        environ = {"DB_POOL_MIN_SIZE": "1", "DB_POOL_MAX_SIZE": "4", "DB_POOL_TIMEOUT": "2.5", "DB_POOL_CHECK": "False"}
+        database = self.settings_module(**environ)["DATABASES"]["default"]
+        self.assertEqual((database["ENGINE"], database["CONN_MAX_AGE"]), ("service_common.pooled_postgresql", 0))
+        self.assertEqual(
+            database["POOL"],
+            {"min_size": 1, "max_size": 4, "timeout": 2.5, "max_idle": 600.0, "max_lifetime": 3600.0, "check": False},
+        )
+        database = self.settings_module(DB_POOL_ENABLED="False")["DATABASES"]["default"]
+        self.assertEqual(database["ENGINE"], "django.db.backends.postgresql")
+        self.assertNotIn("POOL", database)
+
+    def test_pool_is_built_from_the_pool_settings(self):
+        self.wrapper(POOL={"min_size": 1, "max_size": 4, "timeout": 2.5}).get_new_connection({"dbname": "pool_tests"})
+        self.pool_class.assert_called_once_with(
+            kwargs={"dbname": "pool_tests"},
+            open=False,
+            check=self.pool_class.check_connection,
+            name="pool-tests",
+            min_size=1,
+            max_size=4,
+            timeout=2.5,
+            max_idle=600.0,
+            max_lifetime=3600.0,
+        )
+        self.pool.open.assert_called_once_with()
+
+        # One pool per process and database, whichever wrapper asks
+        pooled_postgresql._pools.clear()
+        self.pool_class.reset_mock()
+        for _ in range(2):
+            self.wrapper(POOL={"check": False}).get_new_connection({})
+        self.pool_class.assert_called_once()
+        self.assertIsNone(self.pool_class.call_args.kwargs["check"])
+
+    def test_conn_max_age_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.wrapper(CONN_MAX_AGE=60)
+
+    def test_close_returns_the_connection_to_the_pool(self):
+        wrapper = self.wrapper()
+        in_use = self.in_use()
+        connection = wrapper.connection = wrapper.get_new_connection({})
+        self.assertIs(connection, self.pool.getconn.return_value)
+        self.assertEqual(self.in_use(), in_use + 1)
+
+        wrapper.close()
+        self.pool.putconn.assert_called_once_with(connection)
+        connection.close.assert_not_called()
+        self.assertIsNone(wrapper.connection)
+        self.assertEqual(self.in_use(), in_use)
+
+    def test_connection_closed_inside_atomic_is_not_lent_out_again(self):
+        wrapper = self.wrapper()
+        connection = wrapper.connection = wrapper.get_new_connection({})
+        wrapper.in_atomic_block = True
+        wrapper.close()
+        # Closed, so the pool replaces it instead of handing it out
+        connection.close.assert_called_once_with()
+        self.pool.putconn.assert_called_once_with(connection)
+
+    def test_checkout_timeout_is_counted(self):
+        self.pool.getconn.side_effect = PoolTimeout("no connection")
+        timeouts = REGISTRY.get_sample_value("db_pool_timeouts_total", {"alias": "pool-tests"}) or 0
+        with self.assertRaises(PoolTimeout):
+            self.wrapper().get_new_connection({})
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_timeouts_total", {"alias": "pool-tests"}), timeouts + 1)
+
+
+class PasswordVerifierTests(SimpleTestCase):
+    def setUp(self):
+        # One worker that stays busy until `release` is set
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.verifier = PasswordVerifier(memory_budget=SCRYPT_MEMORY, max_workers=1, queue_size=4, queue_timeout=0.2)
+        patcher = mock.patch("accounts.service.verify_better_auth_password", side_effect=self.slow_verification)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.verifier.executor.shutdown)
+        self.addCleanup(self.release.set)
+
+    def slow_verification(self, plain_password, stored_password):
+        self.started.set()
+        self.release.wait(5)
+        return plain_password == stored_password
+
+    def occupy_worker(self):
+        busy = self.verifier.submit("busy", "busy")
+        self.assertTrue(self.started.wait(1))
+        return busy
+
+    def test_verifies_on_the_pool(self):
+        self.release.set()
+        self.assertTrue(self.verifier.verify("secret", "secret"))
+        self.assertFalse(self.verifier.verify("secret", "other"))
+
+    def test_verify_fails_fast_when_it_cannot_start(self):
+        busy = self.occupy_worker()
+        started = time.monotonic()
+        with self.assertRaises(VerifierOverloaded):
+            self.verifier.verify("secret", "secret")
+        # Raised at the queue timeout, not once the busy worker frees up
+        self.assertLess(time.monotonic() - started, 1)
+        self.release.set()
+        self.assertTrue(busy.result(1))
+        self.assertEqual(self.verifier.pending, 0)
+
+    def test_averify_fails_fast_when_it_cannot_start(self):
+        busy = self.occupy_worker()
+        started = time.monotonic()
+        with self.assertRaises(VerifierOverloaded):
+            asyncio.run(self.verifier.averify("secret", "secret"))
+        self.assertLess(time.monotonic() - started, 1)
+        self.release.set()
+        self.assertTrue(busy.result(1))
+        self.assertEqual(self.verifier.pending, 0)
+
+    def test_full_queue_is_rejected_at_submit(self):
+        self.occupy_worker()
+        for _ in range(self.verifier.queue_size):
+            self.verifier.submit("queued", "queued")
+        with self.assertRaisesMessage(VerifierOverloaded, "queue is full"):
+            self.verifier.submit("secret", "secret")
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class ProfileCacheTests(UserTableTestCase):
+    def setUp(self):
+        caches["accounts"].clear()
+
+    def test_profiles_are_served_from_the_shared_cache(self):
+        with self.assertNumQueries(1):
+            first = get_profiles(["ada", "grace", "nobody"])
+        self.assertEqual(first["ada"], {"id": "ada", "name": "Ada", "image": None, "image_url": None})
+        self.assertIsNone(first["nobody"])
+        # Unknown ids are cached too
+        with self.assertNumQueries(0):
+            self.assertEqual(get_profiles(["grace", "ada", "nobody"]), first)
+
+    def test_forget_profile_drops_the_cached_row(self):
+        get_profiles(["ada"])
+        User.objects.filter(id="ada").update(name="Ada Lovelace")
+        forget_profile("ada")
+        with self.assertNumQueries(1):
+            self.assertEqual(get_profiles(["ada"])["ada"]["name"], "Ada Lovelace")
+
+    @override_settings(CACHES={**SHARED_CACHES, "accounts": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+    def test_nothing_is_cached_without_a_shared_cache(self):
+        get_profiles(["ada"])
+        with self.assertNumQueries(1):
+            get_profiles(["ada"])
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class UpdateProfileTests(UserTableTestCase):
+    def put(self, user_id, data, **headers):
+        return self.client.put(f"/api/accounts/{user_id}/update_profile/", data, content_type="application/json", **headers)
+
+    def etag(self, user_id):
+        return self.client.get(f"/api/accounts/{user_id}/profile/")["ETag"]
+
+    def test_update_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.put("ada", {"name": "Ada Lovelace"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"name": "Ada Lovelace", "email": "ada@example.com", "image": None})
+        self.assertEqual(response["ETag"], self.etag("ada"))
+        self.assertEqual(User.objects.get(id="ada").name, "Ada Lovelace")
+
+    def test_update_clears_the_cached_profile(self):
+        get_profiles(["ada"])
+        self.put("ada", {"name": "Ada Lovelace"})
+        self.assertEqual(get_profiles(["ada"])["ada"]["name"], "Ada Lovelace")
+
+    def test_if_match_mismatch_is_rejected(self):
+        stale = self.etag("ada")
+        self.assertEqual(self.put("ada", {"name": "First"}, HTTP_IF_MATCH=stale).status_code, 200)
+
+        response = self.put("ada", {"name": "Second"}, HTTP_IF_MATCH=stale)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(User.objects.get(id="ada").name, "First")
+        self.assertEqual(self.put("ada", {"name": "Second"}, HTTP_IF_MATCH=self.etag("ada")).status_code, 200)
+
+    def test_weak_if_match_is_rejected(self):
+        # Even a weak tag for the current version fails the strong comparison
+        weak = f"W/{self.etag('ada')}"
+        response = self.put("ada", {"name": "Weak"}, HTTP_IF_MATCH=weak)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(User.objects.get(id="ada").name, "Ada")
+        self.assertEqual(self.put("ada", {"name": "Strong"}, HTTP_IF_MATCH=f"{weak}, {self.etag('ada')}").status_code, 200)
+
+    def test_unknown_user_is_not_found(self):
+        self.assertEqual(self.put("nobody", {"name": "Nobody"}).status_code, 404)
+        self.assertEqual(self.put("nobody", {"name": "Nobody"}, HTTP_IF_MATCH=self.etag("ada")).status_code, 404)
+
+    def test_duplicate_email_is_a_bad_request(self):
+        response = self.put("ada", {"email": "grace@example.com"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"email": ["Email already in use"]})
+
+
+@skipUnless(replicas.REPLICAS, "needs a replica; run with --settings=account_backend.replica_settings")
+@override_settings(CACHES=SHARED_CACHES)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Profile reads go to the replica, except for profiles updated within the sticky window."""
+
+    # Replicas only read what was committed
+    databases = "__all__"
+
+    def setUp(self):
+        create_user_table()
+        # Not flushed between tests, being unmanaged
+        User.objects.all().delete()
+        User.objects.create(id="ada", name="Ada", email="ada@example.com")
+        User.objects.create(id="grace", name="Grace", email="grace@example.com")
+        caches["accounts"].clear()
+        self.replica = replicas.REPLICAS["default"][0]
+        # Checked here instead of by the monitor's thread
+        for patcher in (mock.patch.object(replicas.monitor, "start"), mock.patch.object(replicas.monitor, "available")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        replicas.monitor.check()
+
+    def reads(self, request):
+        """`(response, queries on "default", queries on the replica)` of making `request`."""
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections[self.replica]) as replica:
+                response = request()
+        return response, len(primary), len(replica)
+
+    def get_profile(self, user_id):
+        return self.reads(lambda: self.client.get(f"/api/accounts/{user_id}/profile/"))
+
+    def get_batch(self, ids):
+        return self.reads(lambda: self.client.post("/api/accounts/batch_profiles/", {"ids": ids}, content_type="application/json"))
+
+    def update(self, user_id, name):
+        response = self.client.put(f"/api/accounts/{user_id}/update_profile/", {"name": name}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_reads_go_to_the_replica(self):
+        response, primary, replica = self.get_profile("ada")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((primary, replica), (0, 1))
+        self.assertEqual(self.get_batch(["ada", "grace"])[1:], (0, 1))
+
+    def test_updated_profile_is_read_from_the_primary(self):
+        self.update("ada", "Ada Lovelace")
+
+        response, primary, replica = self.get_profile("ada")
+        self.assertEqual(response.json()["name"], "Ada Lovelace")
+        self.assertEqual((primary, replica), (1, 0))
+        # Other profiles still read from the replica
+        self.assertEqual(self.get_profile("grace")[1:], (0, 1))
+
+    def test_batch_reads_updated_profiles_from_the_primary(self):
+        self.update("ada", "Ada Lovelace")
+
+        response, primary, replica = self.get_batch(["ada", "grace"])
+        self.assertEqual(response.json()["results"]["ada"]["name"], "Ada Lovelace")
+        self.assertEqual((primary, replica), (1, 0))
+
+    def test_check_warns_without_a_shared_cache(self):
+        self.assertEqual([warning.id for warning in replicas.check_marker_cache(None)], ["service_common.W001"])
+        redis = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://localhost:6379/2"}
+        with override_settings(CACHES={**SHARED_CACHES, "accounts": redis}):
+            self.assertEqual(replicas.check_marker_cache(None), [])
@@ -1,9 +1,10 @@
 # urls.py
 from django.urls import path
-from .views import ImageUploadIntentView, UpdateUserProfileView, UserProfileDetailView
+from .views import ImageUploadIntentView, UpdateUserProfileView, UserProfileBatchView, UserProfileDetailView
 
 urlpatterns = [
     path("<str:user_id>/profile/", UserProfileDetailView.as_view()),
     path("<str:user_id>/update_profile/", UpdateUserProfileView.as_view()),
-    path("upload_image/", ImageUploadIntentView.as_view())
+    path("upload_image/", ImageUploadIntentView.as_view()),
+    path("batch_profiles/", UserProfileBatchView.as_view())
 ]
@@ -3,45 +3,76 @@ import uuid
 from .models import User
 from rest_framework import status
 from rest_framework.views import APIView
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
-from .serializers import UserUpdateSerializer, UserProfileDetailSerializer
+from service_common import replicas
+from service_common.renderers import FastJSONRenderer
+from service_common.rows import RowSerializer
+from .profiles import get_profiles, if_match_versions, profile_etag, update_profile
+from .serializers import UserProfileBatchSerializer, UserUpdateSerializer, UserProfileDetailSerializer
 from django.shortcuts import get_object_or_404
 from .services.minio_client import generate_presigned_upload_url
 
 
 class UserProfileDetailView(APIView):
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    # Reads only the serialized columns, without building a User; None
+    # serializes a model instance with UserProfileDetailSerializer instead.
+    row_serializer = RowSerializer(UserProfileDetailSerializer, extra_columns=["updatedAt"])
+
     def get(self, request, user_id):
-        user = get_object_or_404(User, id=user_id)
+        # From the primary for a while after the profile was updated
+        replicas.select_user(user_id)
+        if self.row_serializer is None:
+            user = get_object_or_404(User, id=user_id)
+            serialize = lambda user: UserProfileDetailSerializer(user).data
+        else:
+            user = get_object_or_404(self.row_serializer.rows(User.objects.all()), id=user_id)
+            serialize = self.row_serializer.to_representation
         try:
-            serializer = UserProfileDetailSerializer(user)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # The ETag is what update_profile sends back in If-Match
+            return Response(serialize(user), status=status.HTTP_200_OK, headers={"ETag": profile_etag(user.updatedAt)})
         except Exception as e:
             return Response(f"Error fetching user detail, {e}")
 
 
+class UserProfileBatchView(APIView):
+    """Public profiles of up to PROFILE_BATCH_MAX_IDS users in one request, for rendering authors."""
+
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    @replicas.read_only
+    def post(self, request):
+        serializer = UserProfileBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({"results": get_profiles(serializer.validated_data["ids"])})
+
+
 class ImageUploadIntentView(APIView):
     def post(self, request):
         file_name = request.data.get("file_name")
-        print("file_name", file_name)
         extention = file_name.split(".")[-1]
 
         object_name = f"images/{uuid.uuid4()}.{extention}"
         url = generate_presigned_upload_url("userasset", object_name)
 
-        print("here is the url", url)
-
         return Response({"uploadUrl": url, "minioKey": object_name})
 
 
 class UpdateUserProfileView(APIView):
-    def put(self, request, user_id):
-        user = get_object_or_404(User, id=user_id)
+    """Update name, email or image in one query.
 
-        serializer = UserUpdateSerializer(user, data=request.data, partial=True)
+    Send the profile's ETag in If-Match to update only if nobody else has
+    changed it since (412 otherwise); without it the last write wins.
+    """
+
+    def put(self, request, user_id):
+        serializer = UserUpdateSerializer(data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
-            # Refresh from DB to ensure we are seeing the latest state
-            user.refresh_from_db()
-            return Response(UserUpdateSerializer(user).data, status=status.HTTP_200_OK)
+            replicas.select_user(user_id)
+            user = update_profile(user_id, serializer.validated_data, if_match_versions(request))
+            return Response(
+                UserUpdateSerializer(user).data, status=status.HTTP_200_OK, headers={"ETag": profile_etag(user.updatedAt)}
+            )
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
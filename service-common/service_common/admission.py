@@ -0,0 +1,215 @@
+import statistics
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from . import replicas
+from .metrics import CONCURRENCY_LIMIT, REQUEST_QUEUE_DELAY, REQUESTS_IN_FLIGHT, REQUESTS_SHED
+
+# Scrapes keep working while the worker is overloaded
+EXEMPT_PATHS = ("/metrics",)
+# Window medians kept; their BASELINE_PERCENTILE is the latency without load.
+# Not the lowest, which one lucky window would set.
+BASELINE_WINDOWS = 600
+BASELINE_PERCENTILE = 0.1
+# Finished requests a window needs before it can move the limit
+MIN_SAMPLES = 10
+# Share of the limit left after a congested window
+BACKOFF = 0.9
+# Reads are only shed by the queue check after waiting this many times the target
+READ_QUEUE_ALLOWANCE = 2
+
+
+def queue_delay(request, now):
+    """Seconds since the proxy received `request`, from X-Request-Start; None without the header.
+
+    Takes nginx's `t=<seconds.milliseconds>` and integer milliseconds or microseconds.
+    """
+    value = request.META.get("HTTP_X_REQUEST_START", "").removeprefix("t=")
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    while started > 1e11:
+        started /= 1000
+    # Clocks of the proxy and this host may disagree slightly
+    return max(0.0, now - started)
+
+
+def is_write(request):
+    """Whether `request` is shed before reads: any unsafe method, unless the view is `read_only`."""
+    if request.method in replicas.SAFE_METHODS:
+        return False
+    try:
+        match = resolve(request.path_info, getattr(request, "urlconf", None))
+    except Resolver404:
+        return False
+    return replicas.is_write(request, match)
+
+
+class AdaptiveLimit:
+    """AIMD limit on the requests one process serves at once.
+
+    Every `interval` seconds, the median latency of the requests that
+    finished is compared with a low percentile of the medians of the last
+    BASELINE_WINDOWS windows, the latency without load. The limit is cut by BACKOFF when the
+    median is more than `tolerance` times that, or when requests have waited
+    in front of the worker for longer than `queue_target` for a whole
+    interval, like CoDel's standing queue. Otherwise it grows by one when
+    in-flight requests reached it. Writes may use `write_share` of the limit,
+    so reads keep the rest.
+    """
+
+    def __init__(self, initial, minimum, maximum, tolerance, queue_target, interval, write_share):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.queue_target = queue_target
+        self.interval = interval
+        self.write_share = write_share
+        self.in_flight = 0
+        self.peak = 0
+        self.samples = []
+        self.baselines = deque(maxlen=BASELINE_WINDOWS)
+        now = time.monotonic()
+        self.window_end = now + interval
+        # Last time a request arrived without queueing for longer than the target
+        self.queue_ok_at = now
+        self._lock = threading.Lock()
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def standing_queue(self, now):
+        return now - self.queue_ok_at >= self.interval
+
+    def acquire(self, write, delay, now):
+        """Take a slot for a request that waited `delay` seconds, or return why it is shed."""
+        with self._lock:
+            if delay is None or delay < self.queue_target:
+                self.queue_ok_at = now
+            elif self.standing_queue(now) and delay >= self.queue_target * (1 if write else READ_QUEUE_ALLOWANCE):
+                return "queue"
+            capacity = max(1, self.limit * self.write_share) if write else self.limit
+            if self.in_flight >= capacity:
+                # Held back requests count as reaching the limit
+                self.peak = max(self.peak, self.limit)
+                return "limit"
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return None
+
+    def release(self, latency, now):
+        with self._lock:
+            self.in_flight -= 1
+            self.samples.append(latency)
+            if now >= self.window_end and len(self.samples) >= MIN_SAMPLES:
+                self.adjust(now)
+
+    def adjust(self, now):
+        median = statistics.median(self.samples)
+        self.baselines.append(median)
+        ordered = sorted(self.baselines)
+        baseline = ordered[int(len(ordered) * BASELINE_PERCENTILE)]
+        if median > baseline * self.tolerance or self.standing_queue(now):
+            self.limit = max(self.minimum, self.limit * BACKOFF)
+        elif self.peak >= self.limit - 1:
+            self.limit = min(self.maximum, self.limit + 1)
+        self.samples, self.peak = [], self.in_flight
+        self.window_end = now + self.interval
+        CONCURRENCY_LIMIT.set(self.limit)
+
+
+def configured_limit():
+    return AdaptiveLimit(
+        initial=settings.LOAD_SHED_INITIAL_LIMIT,
+        minimum=settings.LOAD_SHED_MIN_LIMIT,
+        maximum=settings.LOAD_SHED_MAX_LIMIT,
+        tolerance=settings.LOAD_SHED_LATENCY_TOLERANCE,
+        queue_target=settings.LOAD_SHED_QUEUE_TARGET_MS / 1000,
+        interval=settings.LOAD_SHED_INTERVAL_MS / 1000,
+        write_share=settings.LOAD_SHED_WRITE_SHARE,
+    )
+
+
+limiter = configured_limit()
+
+
+def overloaded():
+    response = JsonResponse({"detail": "The service is overloaded, try again shortly."}, status=503)
+    response["Retry-After"] = "%d" % settings.LOAD_SHED_RETRY_AFTER
+    # Counted in REQUESTS_SHED instead of logged (and mailed) as a server
+    # error one by one, which would add load exactly when there is too much
+    response._has_been_logged = True
+    return response
+
+
+class LoadShedMiddleware:
+    """Answers 503 with Retry-After straight away instead of queueing past what the process can serve.
+
+    Put it right after MetricsMiddleware and CorsMiddleware, so shed
+    requests are counted and readable by the browser but cost nothing else.
+    The queue check needs the proxy to set X-Request-Start, overwriting any
+    value the client sent; without it, only the in-flight limit applies,
+    which needs a worker serving several requests at once (ASGI or threads).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.LOAD_SHED_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def admit(self, request):
+        """None once the request has a slot, otherwise the response shedding it."""
+        delay = queue_delay(request, time.time())
+        if delay is not None:
+            REQUEST_QUEUE_DELAY.observe(delay)
+        write = is_write(request)
+        reason = limiter.acquire(write, delay, time.monotonic())
+        if reason is not None:
+            REQUESTS_SHED.labels("write" if write else "read", reason).inc()
+            return overloaded()
+        REQUESTS_IN_FLIGHT.inc()
+        return None
+
+    def release(self, started):
+        REQUESTS_IN_FLIGHT.dec()
+        now = time.monotonic()
+        limiter.release(now - started, now)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.path_info in EXEMPT_PATHS:
+            return self.get_response(request)
+        shed = self.admit(request)
+        if shed is not None:
+            return shed
+        started = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            self.release(started)
+
+    async def __acall__(self, request):
+        if request.path_info in EXEMPT_PATHS:
+            return await self.get_response(request)
+        shed = self.admit(request)
+        if shed is not None:
+            return shed
+        started = time.monotonic()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release(started)
@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+from django.db.backends.signals import connection_created
+
+
+class ServiceCommonConfig(AppConfig):
+    name = "service_common"
+    verbose_name = "Service common"
+
+    def ready(self):
+        from . import metrics, replicas
+
+        checks.register(replicas.check_marker_cache, checks.Tags.caches)
+        if settings.METRICS_ENABLED:
+            # Before any request, so connections opened in any thread count
+            # their queries; MetricsMiddleware may be built in another thread
+            connection_created.connect(metrics.install_query_recorder, dispatch_uid="service_common.metrics")
@@ -0,0 +1,139 @@
+import json
+import platform
+import subprocess
+import time
+from itertools import accumulate
+
+import django
+from django.db import connection
+from django.utils import timezone
+
+# Seeded users are "seed-u0000000", "seed-u0000001", ... with the heaviest
+# first, so a prefix of the ordering is also the hottest part of the skew.
+SEED_PREFIX = "seed-u"
+
+
+def seed_user_id(index):
+    return f"{SEED_PREFIX}{index:07d}"
+
+
+def zipf_weights(count, exponent):
+    """Cumulative Zipf weights for `count` ranks, for random.choices(cum_weights=...)."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+class QueryCounter:
+    """connection.execute_wrapper that counts statements without recording them."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def run_scenario(name, requests, prepare, call, check=None, warmup=0):
+    """Time `call(*prepare(i))` for i in range(requests); `prepare` is not timed.
+
+    The first `warmup` requests fill caches and connections and are not recorded.
+    """
+    for i in range(warmup):
+        response = call(*prepare(i))
+        if check is not None:
+            check(response)
+    latencies, queries, errors = [], [], 0
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        for i in range(warmup, warmup + requests):
+            args = prepare(i)
+            before = counter.count
+            start = time.perf_counter()
+            response = call(*args)
+            latencies.append(time.perf_counter() - start)
+            queries.append(counter.count - before)
+            if check is not None and not check(response):
+                errors += 1
+    return summarize(name, latencies, queries, errors)
+
+
+def summarize(name, latencies, queries, errors):
+    ordered = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / total, 1) if total else None,
+        "mean_ms": round(total / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "queries_per_request": round(sum(queries) / len(queries), 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": git_commit(),
+        "recorded_at": timezone.now().isoformat(),
+        "database": connection.vendor,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+    }
+
+
+def format_table(results):
+    lines = [f"{'scenario':<16}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}"]
+    for result in results:
+        lines.append(
+            f"{result['scenario']:<16}{result['throughput_rps']:>9}{result['p50_ms']:>9}{result['p95_ms']:>9}"
+            f"{result['p99_ms']:>9}{result['queries_per_request']:>9}{result['errors']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def compare(previous, results):
+    """Lines with the change of each scenario's p50/p99 and queries against `previous`."""
+    before = {result["scenario"]: result for result in previous["results"]}
+    lines = [f"Compared with {previous['environment'].get('commit') or 'previous run'}:"]
+    for result in results:
+        old = before.get(result["scenario"])
+        if old is None:
+            continue
+        changes = []
+        for key in ("p50_ms", "p99_ms", "queries_per_request"):
+            if old[key]:
+                changes.append(f"{key} {(result[key] - old[key]) / old[key] * 100:+.1f}%")
+            else:
+                changes.append(f"{key} {old[key]} -> {result[key]}")
+        lines.append(f"  {result['scenario']:<16}" + "  ".join(changes))
+    return "\n".join(lines)
+
+
+def write_results(path, options, results):
+    with open(path, "w", encoding="utf-8") as output:
+        json.dump({"environment": environment(), "options": options, "results": results}, output, indent=2)
+        output.write("\n")
+
+
+def client_host(allowed_hosts):
+    """A host the test client may send that ALLOWED_HOSTS accepts."""
+    for host in allowed_hosts:
+        if host != "*":
+            return host.lstrip(".") or "testserver"
+    return "testserver"
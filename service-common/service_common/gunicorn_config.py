@@ -0,0 +1,16 @@
+"""Gunicorn settings shared by the services: `gunicorn -c python:service_common.gunicorn_config ...`.
+
+Only hooks live here; bind address, worker count and class stay on each
+service's command line.
+"""
+
+import os
+
+
+def child_exit(server, worker):
+    # Drops the live gauges (multiprocess_mode="live*") of a worker that died or
+    # was replaced, which would otherwise be summed into /metrics until restart
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
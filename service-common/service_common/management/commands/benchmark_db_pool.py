@@ -0,0 +1,65 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from service_common.benchmarks import format_table, summarize, write_results
+
+BACKENDS = {"direct": "django.db.backends.postgresql", "pooled": "service_common.pooled_postgresql"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Per-request cost of the database connection: a new PostgreSQL connection for every "
+        "request (CONN_MAX_AGE=0) vs a checkout from the pooled_postgresql pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per backend.")
+        parser.add_argument("--warmup", type=int, default=50, help="Untimed requests before each backend.")
+        parser.add_argument("--queries", type=int, default=1, help="SELECT 1 round trips per request.")
+        parser.add_argument("--concurrency", type=int, default=1, help="Threads issuing requests.")
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options["database"]].settings_dict
+        if settings_dict["ENGINE"] not in BACKENDS.values():
+            raise CommandError(f"{options['database']!r} is not a PostgreSQL database.")
+        results = [self.run(name, engine, settings_dict, options) for name, engine in BACKENDS.items()]
+        self.stdout.write(format_table(results))
+        direct, pooled = results
+        self.stdout.write(
+            f"Saved per request by the pool: mean {direct['mean_ms'] - pooled['mean_ms']:.3f}ms, "
+            f"p50 {direct['p50_ms'] - pooled['p50_ms']:.3f}ms, p99 {direct['p99_ms'] - pooled['p99_ms']:.3f}ms"
+        )
+        if options["output"]:
+            write_results(options["output"], options, results)
+
+    def run(self, name, engine, settings_dict, options):
+        backend = load_backend(engine)
+        alias, queries, concurrency = options["database"], options["queries"], options["concurrency"]
+
+        def request(wrapper):
+            # What a request does with CONN_MAX_AGE=0: connect on first query,
+            # close when request_finished fires
+            started = time.perf_counter()
+            with wrapper.cursor() as cursor:
+                for _ in range(queries):
+                    cursor.execute("SELECT 1")
+                    cursor.fetchone()
+            wrapper.close()
+            return time.perf_counter() - started
+
+        def worker(index):
+            # Connection wrappers belong to the thread that made them
+            wrapper = backend.DatabaseWrapper({**settings_dict, "ENGINE": engine, "CONN_MAX_AGE": 0}, alias)
+            for _ in range(options["warmup"] // concurrency):
+                request(wrapper)
+            return [request(wrapper) for _ in range(index, options["requests"], concurrency)]
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = [latency for chunk in executor.map(worker, range(concurrency)) for latency in chunk]
+        return summarize(name, latencies, [queries] * len(latencies), 0)
@@ -0,0 +1,18 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from service_common.profiling import TOKEN_HEADER, sign_token
+
+
+class Command(BaseCommand):
+    help = f"Print an {TOKEN_HEADER} header value that profiles requests and reads /profiles/."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl", type=int, default=900, help="Seconds the token stays valid.")
+
+    def handle(self, *args, **options):
+        if not settings.PROFILING_SECRET:
+            raise CommandError("PROFILING_SECRET must be set to sign profiling tokens")
+        self.stdout.write(sign_token(int(time.time()) + options["ttl"]))
@@ -0,0 +1,201 @@
+import hmac
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Queries kept per request for the slow-request log
+MAX_RECORDED_QUERIES = 100
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency.", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of non-streaming response bodies.", ["method", "route"], buckets=SIZE_BUCKETS
+)
+DB_QUERIES = Histogram("db_queries_per_request", "Database queries per request.", ["route"], buckets=QUERY_COUNT_BUCKETS)
+DB_DURATION = Histogram(
+    "db_query_duration_seconds_per_request", "Database time per request.", ["route"], buckets=LATENCY_BUCKETS
+)
+
+# Connection pool (pooled_postgresql backend). Utilization is in_use / max.
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Time to check a connection out of the pool.", ["alias"], buckets=POOL_WAIT_BUCKETS
+)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that gave up waiting for a connection.", ["alias"])
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use", "Connections checked out of the pool.", ["alias"], multiprocess_mode="livesum"
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Connections held by the pool, in use or idle.", ["alias"], multiprocess_mode="livesum"
+)
+DB_POOL_MAX = Gauge(
+    "db_pool_max_connections", "Largest size the pool may grow to.", ["alias"], multiprocess_mode="livesum"
+)
+
+# Read replicas (service_common.replicas)
+DB_READS = Counter("db_reads_routed_total", "Model reads routed to each database.", ["alias"])
+DB_REPLICA_AVAILABLE = Gauge(
+    "db_replica_available", "1 while the replica takes reads, 0 while it is out of rotation.", ["alias"],
+    multiprocess_mode="livemin",
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds", "Replication lag at the last check.", ["alias"], multiprocess_mode="livemax"
+)
+
+# Load shedding (service_common.admission). The limits and in-flight counts are summed over workers.
+QUEUE_DELAY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+REQUEST_QUEUE_DELAY = Histogram(
+    "http_request_queue_delay_seconds", "Time from the proxy receiving a request to the worker taking it.",
+    buckets=QUEUE_DELAY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served.", multiprocess_mode="livesum")
+CONCURRENCY_LIMIT = Gauge(
+    "http_concurrency_limit", "Adaptive limit on requests served at once.", multiprocess_mode="livesum"
+)
+REQUESTS_SHED = Counter(
+    "http_requests_shed_total", "Requests answered 503 to shed load.", ["priority", "reason"]
+)
+
+_current = ContextVar("metrics_request", default=None)
+
+
+class RequestQueries:
+    """Queries run while serving the current request."""
+
+    __slots__ = ("count", "duration", "queries")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+
+def record_query(execute, sql, params, many, context):
+    queries = _current.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        queries.count += 1
+        queries.duration += elapsed
+        if len(queries.queries) < MAX_RECORDED_QUERIES:
+            queries.queries.append((elapsed, sql))
+
+
+def install_query_recorder(connection, **kwargs):
+    # Installed on the connection rather than per request with
+    # connection.execute_wrapper(): async views run their queries in
+    # sync_to_async threads, which the context variable follows but a
+    # wrapper pushed by the middleware on its own connection would not.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    """Latency, response size and DB query histograms per route, plus a slow-request log.
+
+    Put it first in MIDDLEWARE so the histograms cover the whole stack.
+    Routes are URL patterns (`api/watchlist/<str:pk>/`), not paths, to keep
+    label cardinality bounded. Requests slower than `SLOW_REQUEST_MS` are
+    logged with their slowest queries. Streaming responses are measured up
+    to the point the response starts, so their queries are not counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Connections opened later get it from ServiceCommonConfig.ready()
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        queries = RequestQueries()
+        token = _current.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, queries, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        queries = RequestQueries()
+        token = _current.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, queries, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, queries, duration):
+        route = getattr(request.resolver_match, "route", None) or "unmatched"
+        if route == "metrics":
+            return
+        REQUEST_DURATION.labels(request.method, route, str(response.status_code)).observe(duration)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(request.method, route).observe(len(response.content))
+        DB_QUERIES.labels(route).observe(queries.count)
+        DB_DURATION.labels(route).observe(queries.duration)
+        if duration * 1000 >= settings.SLOW_REQUEST_MS:
+            slowest = sorted(queries.queries, key=lambda query: query[0], reverse=True)[:10]
+            logger.warning(
+                "Slow request %s %s -> %s in %.0fms, %d queries in %.0fms%s",
+                request.method,
+                request.get_full_path(),
+                response.status_code,
+                duration * 1000,
+                queries.count,
+                queries.duration * 1000,
+                "".join(f"\n  {elapsed * 1000:.1f}ms {sql}" for elapsed, sql in slowest),
+            )
+
+
+def metrics_view(request):
+    """Prometheus exposition of this process, or of all workers in multiprocess mode."""
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return HttpResponseForbidden()
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
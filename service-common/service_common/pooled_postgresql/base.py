@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from django.utils.asyncio import async_unsafe
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+from ..metrics import DB_POOL_CONNECTIONS, DB_POOL_IN_USE, DB_POOL_MAX, DB_POOL_TIMEOUTS, DB_POOL_WAIT
+
+# DATABASES[alias]["POOL"] keys; all but `check` are psycopg_pool.ConnectionPool arguments
+POOL_DEFAULTS = {
+    "min_size": 2,
+    "max_size": 10,
+    "timeout": 10.0,
+    "max_idle": 600.0,
+    "max_lifetime": 3600.0,
+    "check": True,
+}
+
+# One pool per process and database; a forked worker builds its own
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def close_pools(name):
+    """Close this process's pools of database `name`, with their idle connections."""
+    with _pools_lock:
+        for key in [key for key in _pools if key[2] == name]:
+            _pools.pop(key).close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep PostgreSQL from dropping it
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL backend that checks connections out of a psycopg_pool.ConnectionPool.
+
+    Django opens a connection when a request first needs one and closes it
+    when the request finishes. Here opening is a checkout from a per-process
+    pool and closing hands the connection back, so requests skip the TCP,
+    TLS and authentication handshake unless the pool has to grow. This also
+    gives ASGI workers reuse: Django keeps connections per request context
+    there, so CONN_MAX_AGE > 0 only leaves idle connections behind.
+
+    The pool is configured by DATABASES[alias]["POOL"] (see POOL_DEFAULTS).
+    With `check`, a checked-out connection is tested first and replaced if
+    the server dropped it; `max_idle` and `max_lifetime` recycle the rest.
+    CONN_MAX_AGE must be 0 so every connection goes back when its request ends.
+    """
+
+    creation_class = DatabaseCreation
+
+    def __init__(self, settings_dict, alias=None):
+        super().__init__(settings_dict, alias)
+        if self.settings_dict.get("CONN_MAX_AGE"):
+            raise ImproperlyConfigured(
+                f"DATABASES[{self.alias!r}] uses a connection pool; set CONN_MAX_AGE to 0."
+            )
+        self.pool = None
+
+    def get_pool(self, conn_params):
+        key = (os.getpid(), self.alias, self.settings_dict["NAME"])
+        pool = _pools.get(key)
+        if pool is None:
+            with _pools_lock:
+                pool = _pools.get(key)
+                if pool is None:
+                    pool = _pools[key] = self.create_pool(conn_params)
+        return pool
+
+    def create_pool(self, conn_params):
+        options = {**POOL_DEFAULTS, **self.settings_dict.get("POOL", {})}
+        check = options.pop("check")
+        pool = ConnectionPool(
+            kwargs=conn_params,
+            open=False,
+            check=ConnectionPool.check_connection if check else None,
+            name=self.alias,
+            **options,
+        )
+        # Fills up to min_size in the background; the first checkout waits for one
+        pool.open()
+        DB_POOL_MAX.labels(self.alias).set(pool.max_size)
+        return pool
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        started = time.perf_counter()
+        try:
+            connection = pool.getconn()
+        except PoolTimeout:
+            DB_POOL_TIMEOUTS.labels(self.alias).inc()
+            raise
+        finally:
+            DB_POOL_WAIT.labels(self.alias).observe(time.perf_counter() - started)
+        self.pool = pool
+        DB_POOL_IN_USE.labels(self.alias).inc()
+        DB_POOL_CONNECTIONS.labels(self.alias).set(pool.get_stats()["pool_size"])
+
+        # The stock backend's isolation level handling, redone on every
+        # checkout since the previous borrower may have changed it
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = IsolationLevel.READ_COMMITTED
+        connection.isolation_level = None
+        if "isolation_level" in options:
+            try:
+                self.isolation_level = IsolationLevel(options["isolation_level"])
+            except ValueError:
+                self.put_back(connection)
+                raise ImproperlyConfigured(
+                    f"Invalid transaction isolation level {options['isolation_level']} "
+                    f"specified. Use one of the psycopg.IsolationLevel values."
+                )
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def put_back(self, connection):
+        pool, self.pool = self.pool, None
+        DB_POOL_IN_USE.labels(self.alias).dec()
+        pool.putconn(connection)
+        DB_POOL_CONNECTIONS.labels(self.alias).set(pool.get_stats()["pool_size"])
+
+    def _close(self):
+        # close() drops self.connection afterwards, except inside an atomic block
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # Django keeps using this wrapper's connection until the block
+                # exits, so it must not be lent out again; the pool discards
+                # a closed connection and opens a replacement.
+                self.connection.close()
+            self.put_back(self.connection)
@@ -0,0 +1,279 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter, deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils import timezone
+
+TOKEN_HEADER = "X-Profile-Token"
+PROFILE_ID = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{8}$")
+# Leaf frames of threads that are waiting, left out of async profiles
+IDLE_FRAMES = {("threading.py", "wait"), ("selectors.py", "select"), ("thread.py", "_worker")}
+PATH_PREFIXES = sorted(
+    {sysconfig.get_path(name) + os.sep for name in ("purelib", "platlib", "stdlib")} | {f"{settings.BASE_DIR}{os.sep}"},
+    key=len,
+    reverse=True,
+)
+
+_labels = {}
+
+
+def sign_token(expires):
+    """`<expires>.<signature>` for the X-Profile-Token header, valid until epoch `expires`."""
+    signature = hmac.new(settings.PROFILING_SECRET.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def valid_token(request):
+    token = request.headers.get(TOKEN_HEADER)
+    if not token or not settings.PROFILING_SECRET:
+        return False
+    expires, _, _ = token.partition(".")
+    try:
+        if int(expires) < time.time():
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(token, sign_token(int(expires)))
+
+
+def is_admin(request):
+    user = getattr(request, "user", None)
+    return valid_token(request) or bool(getattr(user, "is_staff", False))
+
+
+def frame_label(code):
+    try:
+        return _labels[code]
+    except KeyError:
+        pass
+    path = code.co_filename
+    for prefix in PATH_PREFIXES:
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+            break
+    label = f"{getattr(code, 'co_qualname', code.co_name)} ({path}:{code.co_firstlineno})".replace(";", ":")
+    _labels[code] = label
+    return label
+
+
+class Sampler(threading.Thread):
+    """Samples the stack of one thread (or all others) every `interval` seconds."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+    def sample(self):
+        frames = sys._current_frames()
+        if self.thread_id is not None:
+            frames = {self.thread_id: frames.get(self.thread_id)}
+        else:
+            frames.pop(threading.get_ident(), None)
+        for frame in frames.values():
+            if frame is None:
+                continue
+            code = frame.f_code
+            if self.thread_id is None and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """The most recent `max_profiles` profiles, in `directory` or in memory.
+
+    The in-memory ring buffer is per process; a directory on a shared
+    volume collects the profiles of every worker.
+    """
+
+    def __init__(self, directory, max_profiles):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.recent = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, info, collapsed):
+        if not self.directory:
+            with self._lock:
+                self.recent.append((info, collapsed))
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, info["id"])
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as output:
+            output.write(collapsed)
+        with open(f"{base}.json", "w", encoding="utf-8") as output:
+            json.dump(info, output)
+        for profile_id in self.ids()[self.max_profiles:]:
+            for suffix in (".json", ".collapsed"):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def ids(self):
+        # Newest first; ids start with their timestamp
+        names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        return sorted((name[:-5] for name in names if name.endswith(".json")), reverse=True)
+
+    def list(self):
+        if not self.directory:
+            with self._lock:
+                return [info for info, _ in reversed(self.recent)]
+        infos = []
+        for profile_id in self.ids()[: self.max_profiles]:
+            try:
+                with open(os.path.join(self.directory, f"{profile_id}.json"), encoding="utf-8") as source:
+                    infos.append(json.load(source))
+            except FileNotFoundError:
+                continue
+        return infos
+
+    def get(self, profile_id):
+        if not PROFILE_ID.match(profile_id):
+            return None
+        if not self.directory:
+            with self._lock:
+                return next((collapsed for info, collapsed in self.recent if info["id"] == profile_id), None)
+        try:
+            with open(os.path.join(self.directory, f"{profile_id}.collapsed"), encoding="utf-8") as source:
+                return source.read()
+        except FileNotFoundError:
+            return None
+
+
+profile_store = ProfileStore(settings.PROFILING_DIR, settings.PROFILING_MAX_PROFILES)
+
+
+class ProfilingMiddleware:
+    """Samples the stacks of requests that carry a valid X-Profile-Token, or of a random share.
+
+    Sync requests sample only their own thread. Async requests sample every
+    busy thread of the process, because their work moves between the event
+    loop and sync_to_async threads; concurrent requests can show up in their
+    profiles. Without `PROFILING_SECRET` and `PROFILING_SAMPLE_RATE` the
+    middleware removes itself. The profile id is returned in X-Profile-Id.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_SECRET and not settings.PROFILING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.interval = settings.PROFILING_INTERVAL_MS / 1000
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def trigger(self, request):
+        if TOKEN_HEADER in request.headers and valid_token(request):
+            return "token"
+        if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        trigger = self.trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        sampler = Sampler(threading.get_ident(), self.interval)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        return self.save(request, response, sampler, trigger, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        trigger = self.trigger(request)
+        if trigger is None:
+            return await self.get_response(request)
+        sampler = Sampler(None, self.interval)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            sampler.stop()
+        return self.save(request, response, sampler, trigger, time.perf_counter() - started)
+
+    def save(self, request, response, sampler, trigger, duration):
+        if getattr(getattr(request.resolver_match, "func", None), "profiling_exempt", False):
+            return response
+        now = timezone.now()
+        info = {
+            "id": f"{now:%Y%m%dT%H%M%S%f}-{secrets.token_hex(4)}",
+            "created_at": now.isoformat(),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 1),
+            "samples": sampler.samples,
+            "interval_ms": settings.PROFILING_INTERVAL_MS,
+            "trigger": trigger,
+        }
+        profile_store.add(info, sampler.collapsed())
+        response["X-Profile-Id"] = info["id"]
+        return response
+
+
+def profiles_view(request):
+    """Recent profiles, newest first. Admins only: a valid X-Profile-Token or a staff session."""
+    if not is_admin(request):
+        return HttpResponseForbidden()
+    return JsonResponse({"results": profile_store.list()})
+
+
+def profile_view(request, profile_id):
+    """One profile as collapsed stacks, for flamegraph.pl or speedscope."""
+    if not is_admin(request):
+        return HttpResponseForbidden()
+    collapsed = profile_store.get(profile_id)
+    if collapsed is None:
+        raise Http404("Profile not found")
+    return HttpResponse(
+        collapsed,
+        content_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed"'},
+    )
+
+
+# Reading profiles must not push real ones out of the store
+profiles_view.profiling_exempt = profile_view.profiling_exempt = True
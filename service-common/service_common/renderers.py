@@ -0,0 +1,34 @@
+import orjson
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson, producing the same bytes.
+
+    Compact output is encoded by orjson with datetimes and other types it
+    would format differently handed back to DRF's encoder. Indented output
+    (the browsable API, `Accept: application/json; indent=4`), non-compact
+    settings and anything orjson rejects (non-string keys, huge ints) go
+    through JSONRenderer unchanged. Floats are the known difference: orjson
+    writes 1e16 where json writes 1e+16, and NaN and infinities as null
+    where JSONRenderer refuses them. Only use it for views whose responses
+    carry no floats.
+    """
+
+    encoder = encoders.JSONEncoder()
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder.default, option=self.option)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            # Same strict-javascript-subset escaping as JSONRenderer
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
@@ -0,0 +1,320 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .metrics import DB_READS, DB_REPLICA_AVAILABLE, DB_REPLICA_LAG
+
+logger = logging.getLogger(__name__)
+
+# {primary alias: [replica aliases]}
+REPLICAS = settings.DATABASE_REPLICAS
+PRIMARY_OF = {replica: primary for primary, replicas in REPLICAS.items() for replica in replicas}
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# Backends other workers cannot see the recent-writer markers in
+LOCAL_CACHES = ("django.core.cache.backends.locmem.LocMemCache", "django.core.cache.backends.dummy.DummyCache")
+
+# Seconds the replica is behind. Zero when it has replayed everything it
+# received: an idle primary sends nothing, so the last replay gets old
+# without the replica falling behind.
+POSTGRES_LAG = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def primary_of(alias):
+    return PRIMARY_OF.get(alias, alias)
+
+
+def close_quietly(alias):
+    # Hands a pooled connection back, and drops a broken one
+    try:
+        connections[alias].close()
+    except Exception:
+        pass
+
+
+def measure_lag(alias):
+    connection = connections[alias]
+    # Other backends are local stand-ins that are never behind
+    sql = POSTGRES_LAG if connection.vendor == "postgresql" else "SELECT 0"
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaMonitor:
+    """Keeps the replicas that are up and at most `max_lag` seconds behind in rotation.
+
+    A thread in each process measures every replica every `interval`
+    seconds. A replica that fails the check or is too far behind takes no
+    reads until a later check passes. Until the first pass, reads go to the
+    primaries.
+    """
+
+    def __init__(self, replicas, interval, max_lag):
+        self.replicas = replicas
+        self.interval = interval
+        self.max_lag = max_lag
+        self.available = {}
+        self.last = {}
+        self._monitor_pid = None
+        self._lock = threading.Lock()
+
+    def get(self, primary):
+        """Replicas of `primary` currently taking reads."""
+        self.start()
+        return self.available.get(primary, ())
+
+    def start(self):
+        # Started by the first read, so each forked worker gets its own
+        pid = os.getpid()
+        if self._monitor_pid == pid:
+            return
+        with self._lock:
+            if self._monitor_pid == pid:
+                return
+            self.available, self.last = {}, {}
+            threading.Thread(target=self.run, name="replica-monitor", daemon=True).start()
+            self._monitor_pid = pid
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Checking replicas failed")
+            time.sleep(self.interval)
+
+    def check(self):
+        available = {}
+        for primary, aliases in self.replicas.items():
+            available[primary] = tuple(alias for alias in aliases if self.check_one(alias))
+        self.available = available
+
+    def check_one(self, alias):
+        try:
+            lag = measure_lag(alias)
+        except Exception as exc:
+            return self.set_available(alias, False, exc)
+        finally:
+            close_quietly(alias)
+        DB_REPLICA_LAG.labels(alias).set(lag)
+        if lag > self.max_lag:
+            return self.set_available(alias, False, f"{lag:.1f}s behind")
+        return self.set_available(alias, True)
+
+    def set_available(self, alias, available, reason=None):
+        # Logged when it changes, and at the first check
+        if self.last.get(alias) is not available:
+            if available:
+                logger.info("Replica %s is in rotation", alias)
+            else:
+                logger.warning("Replica %s is out of rotation: %s", alias, reason)
+        self.last[alias] = available
+        DB_REPLICA_AVAILABLE.labels(alias).set(int(available))
+        return available
+
+
+monitor = ReplicaMonitor(REPLICAS, settings.DATABASE_REPLICA_CHECK_INTERVAL, settings.DATABASE_REPLICA_MAX_LAG)
+
+
+def read_only(handler):
+    """Mark a view method with an unsafe HTTP method (a lookup sent as a POST) as only reading."""
+    handler.replica_reads = True
+    return handler
+
+
+def is_write(request, match=None):
+    """Whether `request` may write: an unsafe method, unless its view is marked `read_only`.
+
+    `match` is the request's ResolverMatch, for callers running before Django resolves it.
+    """
+    if request.method in SAFE_METHODS:
+        return False
+    view = (match or request.resolver_match).func
+    view_class = getattr(view, "cls", None) or getattr(view, "view_class", None)
+    # A viewset action, or the method's handler
+    name = (getattr(view, "actions", None) or {}).get(request.method.lower(), request.method.lower())
+    return not getattr(getattr(view_class, name, None), "replica_reads", False)
+
+
+class ReadState:
+    """How the current request reads: the user it serves and the replica picked per primary."""
+
+    __slots__ = ("request", "_writes", "primary", "user_id", "checked", "chosen")
+
+    def __init__(self, request):
+        self.request = request
+        self._writes = None
+        self.primary = False
+        self.user_id = None
+        self.checked = False
+        self.chosen = {}
+
+    @property
+    def writes(self):
+        if self._writes is None:
+            if self.request.resolver_match is None:
+                # Not routed yet; only a safe method is known not to write
+                return self.request.method not in SAFE_METHODS
+            self._writes = is_write(self.request)
+        return self._writes
+
+
+_state = ContextVar("replica_reads", default=None)
+
+
+def sticky_key(user_id):
+    return f"replicas:wrote:{user_id}"
+
+
+def written(user_ids):
+    """Whether any of `user_ids` wrote within the last DATABASE_REPLICA_STICKY_SECONDS."""
+    if not REPLICAS or not user_ids:
+        return False
+    return bool(caches[settings.DATABASE_REPLICA_CACHE_ALIAS].get_many([sticky_key(user_id) for user_id in user_ids]))
+
+
+def mark_written(user_id):
+    caches[settings.DATABASE_REPLICA_CACHE_ALIAS].set(
+        sticky_key(user_id), 1, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS
+    )
+
+
+async def amark_written(user_id):
+    await caches[settings.DATABASE_REPLICA_CACHE_ALIAS].aset(
+        sticky_key(user_id), 1, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS
+    )
+
+
+def check_marker_cache(app_configs, **kwargs):
+    """Warn when replicas take reads but the recent-writer markers are not shared by every worker."""
+    alias = settings.DATABASE_REPLICA_CACHE_ALIAS
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if REPLICAS and backend in LOCAL_CACHES:
+        return [
+            checks.Warning(
+                f"DATABASE_REPLICA_CACHE_ALIAS {alias!r} uses {backend}, which not every worker shares, so "
+                "a user may read from a replica that has not caught up with their own write.",
+                hint="Set REDIS_URL.",
+                id="service_common.W001",
+            )
+        ]
+    return []
+
+
+def select_user(user_id):
+    """Route reads of the rest of the request for `user_id`.
+
+    A writing request marks the user before it writes anything, so that
+    from then on their requests read from the primaries, even those already
+    running on other workers.
+    """
+    state = _state.get()
+    if state is not None:
+        state.user_id = str(user_id)
+        if state.writes and REPLICAS:
+            mark_written(state.user_id)
+
+
+async def aselect_user(user_id):
+    state = _state.get()
+    if state is not None:
+        state.user_id = str(user_id)
+        if state.writes and REPLICAS:
+            await amark_written(state.user_id)
+
+
+def db_for_read(primary):
+    """A replica of `primary` for reads of the current request, or `primary` itself.
+
+    Reads stay on the primary outside requests, in requests that write,
+    inside transactions and for users who wrote within the sticky window,
+    so nobody reads back older data than they wrote. A request keeps
+    reading from the same replica.
+    """
+    alias = primary
+    state = _state.get()
+    if state is not None and not state.writes and not state.primary and not connections[primary].in_atomic_block:
+        alias = state.chosen.get(primary)
+        if alias is None:
+            replicas = monitor.get(primary)
+            if replicas and not state.checked:
+                # Looked up once, and only by requests that would use a replica
+                state.checked = True
+                state.primary = state.user_id is not None and written([state.user_id])
+            alias = random.choice(replicas) if replicas and not state.primary else primary
+            state.chosen[primary] = alias
+    DB_READS.labels(alias).inc()
+    return alias
+
+
+class ReplicaRouter:
+    """Sends reads to a replica of "default" (see `db_for_read`) and writes to "default".
+
+    For services without their own router; one that has one calls
+    `db_for_read` with the primary it picked.
+    """
+
+    def db_for_read(self, model, **hints):
+        return db_for_read(DEFAULT_DB_ALIAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return primary_of(obj1._state.db) == primary_of(obj2._state.db)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from their primary
+        return False if db in PRIMARY_OF else None
+
+
+class ReplicaMiddleware:
+    """Starts each request's read routing.
+
+    Requests with an unsafe method, unless their view is marked
+    `read_only`, read from the primaries throughout, and their user keeps
+    reading from the primaries for DATABASE_REPLICA_STICKY_SECONDS, longer
+    than a replica in rotation can be behind. That only holds on every
+    worker when the DATABASE_REPLICA_CACHE_ALIAS cache holding the marker is
+    shared (Redis); a local one covers the worker that took the write, and a
+    dummy one none (see `check_marker_cache`).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _state.set(ReadState(request))
+        try:
+            return self.get_response(request)
+        finally:
+            _state.reset(token)
+
+    async def __acall__(self, request):
+        token = _state.set(ReadState(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            _state.reset(token)
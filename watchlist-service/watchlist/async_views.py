@@ -0,0 +1,213 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError
+from django.http import HttpResponse, QueryDict
+from django.views import View
+from rest_framework import exceptions, status
+from service_common.renderers import FastJSONRenderer
+from service_common.replicas import read_only
+from service_common.rows import RowSerializer
+
+from .authentication import JWTAuthentication
+from .batch import apply_batch
+from .cache import watchlist_cache
+from .changes import aget_changes
+from .membership import alookup_membership
+from .services import create_entry, delete_entry, update_entry
+from .stats import aget_stats
+from .transfer import export_response, get_format, import_entries
+from .models import Watchlist
+from .pagination import WatchlistCursorPagination
+from .serializers import (
+    DUPLICATE_ENTRY_ERROR,
+    WatchlistBatchSerializer,
+    WatchlistMembershipSerializer,
+    WatchlistSerializer,
+    WatchlistStatsSerializer,
+)
+
+
+class AsyncWatchlistView(View):
+    """Native async counterpart of `WatchlistViewSet` for ASGI deployments.
+
+    Runs directly on the Uvicorn event loop and reads through Django's async
+    ORM, so a read never waits for a free sync worker thread. Writes that must
+    commit together with their side effects go through watchlist.services in
+    a thread. URLs, status codes and response bodies match the DRF viewset.
+    """
+
+    authentication = JWTAuthentication()
+    renderer = FastJSONRenderer()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Authentication is token based, same as the DRF views.
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            auth = await self.authentication.aauthenticate(request)
+            if auth is None:
+                raise exceptions.NotAuthenticated()
+            request.user, request.auth = auth
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        raise exceptions.MethodNotAllowed(request.method)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            # JWTAuthentication has no WWW-Authenticate header, so DRF answers 403.
+            exc.status_code = status.HTTP_403_FORBIDDEN
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {"detail": exc.detail}
+        response = self.render(data, status=exc.status_code)
+        if getattr(exc, "wait", None):
+            response["Retry-After"] = "%d" % exc.wait
+        return response
+
+    def render(self, data, status=status.HTTP_200_OK):
+        return HttpResponse(self.renderer.render(data), status=status, content_type="application/json")
+
+    def get_queryset(self):
+        return Watchlist.objects.for_user(self.request.user.id)
+
+    async def get_object(self, pk):
+        try:
+            return await self.get_queryset().aget(pk=pk)
+        except (Watchlist.DoesNotExist, DjangoValidationError, ValueError):
+            raise exceptions.NotFound()
+
+    def parse_body(self, request):
+        if not request.body:
+            return {}
+        if request.content_type == "application/json":
+            try:
+                return json.loads(request.body)
+            except ValueError as exc:
+                raise exceptions.ParseError(f"JSON parse error - {exc}")
+        if request.content_type == "application/x-www-form-urlencoded":
+            return QueryDict(request.body, encoding=request.encoding)
+        raise exceptions.UnsupportedMediaType(request.content_type)
+
+
+class AsyncWatchlistListView(AsyncWatchlistView):
+    pagination_class = WatchlistCursorPagination
+    row_serializer = RowSerializer(WatchlistSerializer)
+
+    async def get(self, request):
+        user_id = request.user.id
+        url = request.build_absolute_uri()
+        version = await watchlist_cache.aget_version(user_id)
+        etag = watchlist_cache.etag(user_id, version, url)
+        if watchlist_cache.not_modified(request, etag):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        key = watchlist_cache.page_key(user_id, version, url)
+        data = await watchlist_cache.aget(key)
+        if data is None:
+            paginator = self.pagination_class()
+            if self.row_serializer is None:
+                page = await paginator.apaginate_queryset(self.get_queryset(), request)
+                results = WatchlistSerializer(page, many=True).data
+            else:
+                page = await paginator.apaginate_queryset(self.row_serializer.rows(self.get_queryset()), request)
+                results = self.row_serializer.many(page)
+            data = paginator.get_paginated_data(results)
+            await watchlist_cache.aset(key, data)
+        response = self.render(data)
+        if etag is not None:
+            response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    async def post(self, request):
+        serializer = WatchlistSerializer(data=self.parse_body(request))
+        serializer.is_valid(raise_exception=True)
+        try:
+            # Writes take a thread hop: the row and its stats share a transaction.
+            entry = await sync_to_async(create_entry)(request.user.id, serializer.validated_data)
+        except IntegrityError:
+            raise exceptions.ValidationError(DUPLICATE_ENTRY_ERROR)
+        return self.render(WatchlistSerializer(entry).data, status=status.HTTP_201_CREATED)
+
+
+class AsyncWatchlistDetailView(AsyncWatchlistView):
+    async def get(self, request, pk):
+        entry = await self.get_object(pk)
+        return self.render(WatchlistSerializer(entry).data)
+
+    async def put(self, request, pk):
+        return await self.perform_update(request, pk, partial=False)
+
+    async def patch(self, request, pk):
+        return await self.perform_update(request, pk, partial=True)
+
+    async def delete(self, request, pk):
+        entry = await self.get_object(pk)
+        await sync_to_async(delete_entry)(entry)
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+    async def perform_update(self, request, pk, partial):
+        entry = await self.get_object(pk)
+        data = self.parse_body(request)
+        if "user_id" in data:
+            # Owner can never be changed, mirroring WatchlistViewSet.update
+            data = data.copy()
+            data.pop("user_id")
+        serializer = WatchlistSerializer(entry, data=data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        try:
+            await sync_to_async(update_entry)(entry, serializer.validated_data)
+        except IntegrityError:
+            raise exceptions.ValidationError(DUPLICATE_ENTRY_ERROR)
+        return self.render(WatchlistSerializer(entry).data)
+
+
+class AsyncWatchlistBatchView(AsyncWatchlistView):
+    async def post(self, request):
+        serializer = WatchlistBatchSerializer(data=self.parse_body(request))
+        serializer.is_valid(raise_exception=True)
+        # The batch runs in one transaction, which the async ORM cannot span.
+        results = await sync_to_async(apply_batch)(request.user.id, serializer.validated_data["operations"])
+        return self.render({"results": results})
+
+
+class AsyncWatchlistMembershipView(AsyncWatchlistView):
+    @read_only
+    async def post(self, request):
+        serializer = WatchlistMembershipSerializer(data=self.parse_body(request))
+        serializer.is_valid(raise_exception=True)
+        results = await alookup_membership(request.user.id, serializer.validated_data["items"])
+        return self.render({"results": results})
+
+
+class AsyncWatchlistStatsView(AsyncWatchlistView):
+    async def get(self, request):
+        return self.render(WatchlistStatsSerializer(await aget_stats(request.user.id)).data)
+
+
+class AsyncWatchlistChangesView(AsyncWatchlistView):
+    async def get(self, request):
+        return self.render(await aget_changes(request.user.id, request))
+
+
+class AsyncWatchlistExportView(AsyncWatchlistView):
+    async def get(self, request):
+        return export_response(self.get_queryset(), get_format(request), asynchronous=True)
+
+
+class AsyncWatchlistImportView(AsyncWatchlistView):
+    async def post(self, request):
+        # ASGI has already spooled the upload to a temporary file; the import
+        # reads it line by line and writes each batch in its own transaction.
+        summary = await sync_to_async(import_entries)(request.user.id, request, request.content_type)
+        return self.render(summary)
@@ -1,7 +1,19 @@
+import hashlib
 import os
+import time
 from types import SimpleNamespace
 import jwt
+from django.conf import settings
 from rest_framework import authentication, exceptions
+from service_common import replicas
+
+from . import sharding
+from .cache import LocalLRUCache
+from .metrics import TOKEN_CACHE_LOOKUPS
+
+# Verified claims by sha256(token). Entries never outlive the token's `exp`,
+# and JWT_CACHE_TTL bounds how long a removed key keeps being honoured.
+token_cache = LocalLRUCache(settings.JWT_CACHE_MAX_ENTRIES)
 
 
 class JWTAuthentication(authentication.BaseAuthentication):
@@ -9,25 +21,85 @@ class JWTAuthentication(authentication.BaseAuthentication):
     Simple JWT authentication that uses a shared JWT_SECRET env var.
 
     Expects tokens with a claim containing the user's id (user_id or sub).
+    Additional keys can be configured by `kid` in JWT_KEYS so the secret can
+    be rotated without downtime; verified tokens are cached in `token_cache`.
     """
 
     def authenticate(self, request):
+        token = self.get_token(request)
+        if token is None:
+            return None
+        user, token = self.authenticate_credentials(token)
+        # Per-user tables of this request go to the user's shard, read from
+        # a replica unless the user wrote recently
+        sharding.select_user(user.id)
+        replicas.select_user(user.id)
+        return (user, token)
+
+    async def aauthenticate(self, request):
+        """Async counterpart of `authenticate` for native async views.
+
+        Token verification is pure CPU work (no I/O), so it runs inline on the
+        event loop instead of taking a sync_to_async thread hop; an uncached
+        shard lookup uses the async ORM.
+        """
+        token = self.get_token(request)
+        if token is None:
+            return None
+        user, token = self.authenticate_credentials(token)
+        await sharding.aselect_user(user.id)
+        await replicas.aselect_user(user.id)
+        return (user, token)
+
+    def get_token(self, request):
         auth = authentication.get_authorization_header(request).split()
         if not auth or auth[0].lower() != b'bearer':
             return None
         if len(auth) == 1:
             raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+        return auth[1]
+
+    def get_verification_keys(self, token):
+        """Keys to try for `token`: the one named by its `kid`, else all of them."""
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is not None:
+            key = settings.JWT_KEYS.get(kid)
+            if not key:
+                raise exceptions.AuthenticationFailed('Unknown key id')
+            return [key]
+        secret = os.environ.get('JWT_SECRET')
+        return ([secret] if secret else []) + list(settings.JWT_KEYS.values())
+
+    def decode(self, token):
+        keys = self.get_verification_keys(token)
+        if not keys:
+            raise exceptions.AuthenticationFailed('JWT secret not configured')
+        for key in keys[:-1]:
+            try:
+                return jwt.decode(token, key, algorithms=settings.JWT_ALGORITHMS, options={"verify_aud": False})
+            except jwt.InvalidSignatureError:
+                continue
+        return jwt.decode(token, keys[-1], algorithms=settings.JWT_ALGORITHMS, options={"verify_aud": False})
+
+    def authenticate_credentials(self, token):
+        cache_key = hashlib.sha256(token).digest()
+        payload = token_cache.get(cache_key)
+        TOKEN_CACHE_LOOKUPS.labels('miss' if payload is None else 'hit').inc()
+
+        if payload is None:
+            try:
+                payload = self.decode(token)
+            except jwt.ExpiredSignatureError:
+                raise exceptions.AuthenticationFailed('Token has expired')
+            except exceptions.AuthenticationFailed:
+                raise
+            except Exception as e:
+                raise exceptions.AuthenticationFailed('Invalid token')
 
-        token = auth[1]
-        try:
-            secret = os.environ.get('JWT_SECRET')
-            if not secret:
-                raise exceptions.AuthenticationFailed('JWT secret not configured')
-            payload = jwt.decode(token, secret, algorithms=["HS256"], options={"verify_aud": False})
-        except jwt.ExpiredSignatureError:
-            raise exceptions.AuthenticationFailed('Token has expired')
-        except Exception as e:
-            raise exceptions.AuthenticationFailed('Invalid token')
+            expires_at = time.time() + settings.JWT_CACHE_TTL
+            if isinstance(payload.get('exp'), (int, float)):
+                expires_at = min(expires_at, payload['exp'])
+            token_cache.set(cache_key, payload, expires_at=expires_at)
 
         user_id = payload.get('user_id') or payload.get('sub') or payload.get('id')
         if not user_id:
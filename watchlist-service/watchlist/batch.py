@@ -0,0 +1,149 @@
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import events, sharding, stats, trending
+from .cache import watchlist_cache
+from .models import Watchlist, WatchlistTombstone
+from .serializers import WatchlistBatchOperationSerializer, WatchlistSerializer
+
+
+def apply_batch(user_id, operations):
+    """Apply a batch of add/update/remove operations for one user.
+
+    Operations are addressed by `(media_id, media_type)`. Whatever the batch
+    size, this locks the user's stats row and issues one SELECT for the
+    affected rows plus at most one upsert, one bulk UPDATE and one DELETE
+    (with its tombstones), the stats update and one outbox insert, all
+    inside a single transaction on the user's shard.
+
+    Returns one result dict per operation, in request order.
+    """
+    user_id = str(user_id)
+    child = WatchlistBatchOperationSerializer()
+    results = [None] * len(operations)
+    valid = []
+    seen = set()
+
+    for index, item in enumerate(operations):
+        try:
+            op = child.run_validation(item)
+            key = (op["media_id"], op["media_type"])
+            if key in seen:
+                raise serializers.ValidationError("Each media_id/media_type may only appear once per batch.")
+        except serializers.ValidationError as exc:
+            results[index] = {"index": index, "result": "invalid", "errors": serializers.as_serializer_error(exc)}
+            continue
+        seen.add(key)
+        valid.append((index, key, op))
+
+    if not valid:
+        return results
+
+    with sharding.use_user(user_id, write=True) as db, transaction.atomic(using=db):
+        # Before reading: a single-entry write committing in between would
+        # otherwise be overwritten by the upsert and counted twice
+        stats.lock_user(user_id)
+        existing = {
+            (entry.media_id, entry.media_type): entry
+            for entry in Watchlist.objects.select_for_update().filter(
+                user_id=user_id, media_id__in={key[0] for key in seen}
+            )
+            if (entry.media_id, entry.media_type) in seen
+        }
+
+        now = timezone.now()
+        to_upsert, to_update, to_delete, readded, created = [], [], [], [], set()
+        activity = []
+        delta = Counter()
+
+        for index, key, op in valid:
+            action = op.pop("op")
+            entry = existing.get(key)
+
+            if action == "add":
+                if entry is None:
+                    new = Watchlist(user_id=user_id, **op)
+                    created.add(new.id)
+                    activity.append((new, trending.ADD_WEIGHT))
+                else:
+                    # Re-adding keeps the row identity and any fields not sent
+                    new = Watchlist(
+                        id=entry.id,
+                        user_id=user_id,
+                        created_at=entry.created_at,
+                        **{"title": entry.title, "poster_url": entry.poster_url, "status": entry.status, **op},
+                    )
+                    readded.append((new, entry.created_at))
+                    activity.append((new, trending.status_weight(entry.status, new.status)))
+                    delta.update(stats.entry_delta(entry, -1))
+                delta.update(stats.entry_delta(new))
+                to_upsert.append(new)
+                results[index] = (index, "updated" if entry is not None else "created", new)
+            elif entry is None:
+                results[index] = {"index": index, "result": "not_found", "media_id": key[0], "media_type": key[1]}
+            elif action == "update":
+                delta.update(stats.entry_delta(entry, -1))
+                activity.append((entry, trending.status_weight(entry.status, op.get("status", entry.status))))
+                for attr, value in op.items():
+                    setattr(entry, attr, value)
+                delta.update(stats.entry_delta(entry))
+                entry.updated_at = now
+                to_update.append(entry)
+                results[index] = (index, "updated", entry)
+            else:
+                to_delete.append(entry)
+                delta.update(stats.entry_delta(entry, -1))
+                results[index] = {"index": index, "result": "deleted", "media_id": key[0], "media_type": key[1]}
+
+        changes = len(to_upsert) + len(to_update) + len(to_delete)
+        if not changes:
+            return results
+
+        # One feed sequence number per changed entry
+        seq = stats.apply_delta(user_id, delta, changes=changes)
+        for entry in to_upsert + to_update + to_delete:
+            entry.change_seq, seq = seq, seq + 1
+
+        if to_upsert:
+            Watchlist.objects.bulk_create(
+                to_upsert,
+                update_conflicts=True,
+                unique_fields=["user_id", "media_id", "media_type"],
+                update_fields=["title", "poster_url", "status", "updated_at", "change_seq"],
+            )
+            # auto_now_add stamped these in memory; the row kept its original value
+            for new, created_at in readded:
+                new.created_at = created_at
+        if to_update:
+            Watchlist.objects.bulk_update(to_update, ["title", "poster_url", "status", "updated_at", "change_seq"])
+        if to_delete:
+            WatchlistTombstone.objects.bulk_create(
+                WatchlistTombstone(
+                    entry_id=entry.id,
+                    user_id=user_id,
+                    media_id=entry.media_id,
+                    media_type=entry.media_type,
+                    change_seq=entry.change_seq,
+                )
+                for entry in to_delete
+            )
+            Watchlist.objects.filter(id__in=[entry.id for entry in to_delete]).delete()
+        events.record(
+            [
+                events.entry_event(events.ENTRY_ADDED if entry.id in created else events.ENTRY_UPDATED, entry)
+                for entry in to_upsert + to_update
+            ]
+            + [events.entry_event(events.ENTRY_REMOVED, entry) for entry in to_delete]
+        )
+        trending.record(activity, using=db)
+        transaction.on_commit(partial(watchlist_cache.bump, user_id), using=db)
+
+    for i, result in enumerate(results):
+        if isinstance(result, tuple):
+            index, outcome, entry = result
+            results[i] = {"index": index, "result": outcome, "entry": WatchlistSerializer(entry).data}
+    return results
@@ -0,0 +1,168 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+
+
+class LocalLRUCache:
+    """Small thread-safe in-process LRU, the first tier in front of the shared cache.
+
+    Entries may carry an absolute `expires_at` (epoch seconds) after which
+    they are treated as missing.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class WatchlistCache:
+    """Per-user cache of serialized watchlist pages and membership maps.
+
+    Every user has a version counter in the shared tier (Redis in production,
+    any Django cache backend in tests) that is bumped on each write. Cached
+    pages and ETags are derived from that version, so a bump invalidates all
+    of a user's pages at once and an unchanged list can be answered with a
+    304 after a single version lookup. A tier that keeps nothing (DummyCache)
+    gives no version, and then nothing is cached and no ETag is sent.
+    """
+
+    def __init__(self, alias, local_entries, timeout):
+        self.alias = alias
+        self.local = LocalLRUCache(local_entries)
+        self.timeout = timeout
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def version_key(self, user_id):
+        return f"version:{user_id}"
+
+    def page_key(self, user_id, version, url):
+        if version is None:
+            return None
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        return f"page:{user_id}:{version}:{digest}"
+
+    def membership_key(self, user_id, version):
+        if version is None:
+            return None
+        return f"membership:{user_id}:{version}"
+
+    def etag(self, user_id, version, url):
+        if version is None:
+            return None
+        return '"%s"' % hashlib.sha1(self.page_key(user_id, version, url).encode()).hexdigest()
+
+    def not_modified(self, request, etag):
+        return etag is not None and etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+
+    def initial_version(self):
+        # Not 0: if the shared tier loses the counter, restarting from a
+        # fresh value keeps ETags handed out earlier from matching again.
+        return time.time_ns()
+
+    def get_version(self, user_id):
+        key = self.version_key(user_id)
+        version = self.shared.get(key)
+        if version is None:
+            self.shared.add(key, self.initial_version(), timeout=None)
+            version = self.shared.get(key)
+        return version
+
+    async def aget_version(self, user_id):
+        key = self.version_key(user_id)
+        version = await self.shared.aget(key)
+        if version is None:
+            await self.shared.aadd(key, self.initial_version(), timeout=None)
+            version = await self.shared.aget(key)
+        return version
+
+    def bump(self, user_id):
+        key = self.version_key(user_id)
+        try:
+            self.shared.incr(key)
+        except ValueError:
+            self.shared.add(key, self.initial_version(), timeout=None)
+
+    def get(self, key):
+        if key is None:
+            return None
+        data = self.local.get(key)
+        if data is None:
+            data = self.shared.get(key)
+            if data is not None:
+                self.local.set(key, data)
+        return data
+
+    async def aget(self, key):
+        if key is None:
+            return None
+        data = self.local.get(key)
+        if data is None:
+            data = await self.shared.aget(key)
+            if data is not None:
+                self.local.set(key, data)
+        return data
+
+    def set(self, key, data):
+        if key is None:
+            return
+        self.local.set(key, data)
+        self.shared.set(key, data, timeout=self.timeout)
+
+    async def aset(self, key, data):
+        if key is None:
+            return
+        self.local.set(key, data)
+        await self.shared.aset(key, data, timeout=self.timeout)
+
+
+watchlist_cache = WatchlistCache(
+    settings.WATCHLIST_CACHE_ALIAS,
+    local_entries=settings.WATCHLIST_CACHE_LOCAL_ENTRIES,
+    timeout=settings.WATCHLIST_CACHE_TIMEOUT,
+)
@@ -0,0 +1,38 @@
+from django.utils import timezone
+
+from .models import WatchlistOutbox
+
+ENTRY_ADDED = "watchlist.entry.added"
+ENTRY_UPDATED = "watchlist.entry.updated"
+ENTRY_REMOVED = "watchlist.entry.removed"
+# The entry got a time-ordered id; the payload's previous_entry_id is the old one
+ENTRY_REKEYED = "watchlist.entry.rekeyed"
+
+
+def entry_event(event_type, entry, **extra):
+    """Outbox row describing `entry` after a change; `change_seq` must be set.
+
+    `extra` is added to the payload.
+    """
+    return WatchlistOutbox(
+        user_id=entry.user_id,
+        event_type=event_type,
+        change_seq=entry.change_seq,
+        payload={
+            "type": event_type,
+            "user_id": entry.user_id,
+            "entry_id": str(entry.id),
+            "media_id": entry.media_id,
+            "media_type": entry.media_type,
+            "title": entry.title,
+            "status": entry.status,
+            "change_seq": entry.change_seq,
+            "occurred_at": timezone.now().isoformat(),
+            **extra,
+        },
+    )
+
+
+def record(events):
+    """Queue events for the relay; call inside the transaction that made the change."""
+    WatchlistOutbox.objects.bulk_create(events)
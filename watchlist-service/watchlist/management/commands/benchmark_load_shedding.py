@@ -0,0 +1,179 @@
+import asyncio
+import json
+import math
+import os
+import random
+import time
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+
+from service_common import admission
+from service_common.benchmarks import client_host, percentile, write_results
+from watchlist.models import Watchlist
+from watchlist.services import delete_entry
+from watchlist.sharding import SHARDS, use_user
+
+USER_PREFIX = "bench-shed-"
+ENTRIES_PER_USER = 20
+
+
+def unlimited():
+    """A limit that never sheds, for the baseline runs."""
+    return admission.AdaptiveLimit(
+        initial=math.inf,
+        minimum=math.inf,
+        maximum=math.inf,
+        tolerance=math.inf,
+        queue_target=math.inf,
+        interval=1,
+        write_share=1,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Open-loop load through the ASGI stack of one worker: a read/write mix at the normal rate and at "
+        "twice it, with load shedding off and on, reporting p50/p99 of served requests and the share shed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=10, help="Seconds per phase.")
+        parser.add_argument(
+            "--load", type=float, default=0.6, help="Normal rate as a share of the measured capacity."
+        )
+        parser.add_argument("--write-share", type=float, default=0.2, help="Share of requests that are writes.")
+        parser.add_argument("--users", type=int, default=50, help="Users the requests are spread over.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        secret = os.environ.get("JWT_SECRET")
+        if not secret:
+            raise CommandError("JWT_SECRET must be set to sign the benchmark tokens")
+        if not settings.LOAD_SHED_ENABLED:
+            raise CommandError("LOAD_SHED_ENABLED is off, so the middleware is not installed")
+        users = [f"{USER_PREFIX}{i:04d}" for i in range(options["users"])]
+        entries = {}
+        for user_id in users:
+            with use_user(user_id, write=True):
+                Watchlist.objects.filter(user_id=user_id).delete()
+                entries[user_id] = [
+                    str(entry.id)
+                    for entry in Watchlist.objects.bulk_create(
+                        Watchlist(user_id=user_id, media_id=f"shed-{i}", media_type="anime", title=f"Title {i}")
+                        for i in range(ENTRIES_PER_USER)
+                    )
+                ]
+        self.tokens = {user_id: jwt.encode({"user_id": user_id}, secret, algorithm="HS256") for user_id in users}
+        self.entries = entries
+        self.rng = random.Random(options["seed"])
+        self.write_share = options["write_share"]
+
+        saved, results = admission.limiter, []
+        try:
+            admission.limiter = unlimited()
+            capacity = asyncio.run(self.capacity())
+            normal = capacity * options["load"]
+            self.stdout.write(f"Capacity {capacity:.0f} req/s; normal load {normal:.0f} req/s")
+            for mode in ("off", "on"):
+                admission.limiter = unlimited() if mode == "off" else admission.configured_limit()
+                for phase, rate in (("normal", normal), ("2x", 2 * normal)):
+                    result = asyncio.run(self.run_phase(rate, options["duration"]))
+                    result.update(mode=mode, phase=phase, limit=admission.limiter.limit)
+                    results.append(result)
+        finally:
+            admission.limiter = saved
+            for shard in SHARDS:
+                for entry in Watchlist.objects.using(shard).filter(user_id__startswith=USER_PREFIX):
+                    delete_entry(entry)
+
+        self.stdout.write(
+            f"{'shedding':<10}{'phase':<8}{'offered':>9}{'served':>9}{'shed %':>8}{'reads':>7}{'writes':>8}"
+            f"{'p50 ms':>9}{'p99 ms':>9}{'p99 all':>9}{'limit':>7}"
+        )
+        for result in results:
+            limit = "-" if math.isinf(result["limit"]) else f"{result['limit']:.0f}"
+            self.stdout.write(
+                f"{result['mode']:<10}{result['phase']:<8}{result['offered_rps']:>9}{result['served_rps']:>9}"
+                f"{result['shed_pct']:>8}{result['reads_shed_pct']:>7}{result['writes_shed_pct']:>8}{result['p50_ms']:>9}{result['p99_ms']:>9}{result['p99_all_ms']:>9}"
+                f"{limit:>7}"
+            )
+        if options["output"]:
+            for result in results:
+                result["limit"] = None if math.isinf(result["limit"]) else result["limit"]
+            write_results(options["output"], {**options, "capacity_rps": round(capacity, 1)}, results)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def request(self, client):
+        """`(write, response)` of one read (a list page) or, at `--write-share`, one write (a status change)."""
+        user_id = self.rng.choice(list(self.tokens))
+        headers = {"authorization": f"Bearer {self.tokens[user_id]}", "x-request-start": f"t={time.time():.3f}"}
+        if self.rng.random() < self.write_share:
+            entry_id = self.rng.choice(self.entries[user_id])
+            body = json.dumps({"status": self.rng.choice(Watchlist.Status.values)})
+            url = f"/api/watchlist/{entry_id}/"
+            return True, client.patch(url, body, content_type="application/json", headers=headers)
+        return False, client.get("/api/watchlist/", headers=headers)
+
+    async def capacity(self, requests=500, concurrency=8):
+        """Requests per second the worker completes when kept just busy."""
+        client = AsyncClient(headers={"host": client_host(settings.ALLOWED_HOSTS)})
+        queue = iter(range(requests))
+
+        async def worker():
+            for _ in queue:
+                await self.request(client)[1]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+    async def run_phase(self, rate, duration):
+        """Send requests at Poisson arrivals of `rate` per second for `duration` seconds, whatever the responses.
+
+        Latency counts from the scheduled arrival, so requests the worker
+        falls behind on are not hidden by a slower client.
+        """
+        client = AsyncClient(headers={"host": client_host(settings.ALLOWED_HOSTS)})
+        served, shed, tasks = [], [], []
+        # [reads, writes] sent and shed
+        sent, dropped = [0, 0], [0, 0]
+
+        async def one(arrival):
+            write, response = self.request(client)
+            sent[write] += 1
+            response = await response
+            latency = time.perf_counter() - arrival
+            if response.status_code == 503:
+                shed.append(latency)
+                dropped[write] += 1
+            elif response.status_code < 400:
+                served.append(latency)
+            else:
+                raise CommandError(f"Unexpected status {response.status_code}: {response.content[:200]!r}")
+
+        started = time.perf_counter()
+        arrival = started
+        while arrival - started < duration:
+            arrival += self.rng.expovariate(rate)
+            await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            tasks.append(asyncio.create_task(one(arrival)))
+        await asyncio.gather(*tasks)
+        # Until the last response, however far behind the worker fell
+        elapsed = time.perf_counter() - started
+        served.sort()
+        every = sorted(served + shed)
+        return {
+            "requests": len(tasks),
+            "offered_rps": round(len(tasks) / duration, 1),
+            "served_rps": round(len(served) / elapsed, 1),
+            "shed_pct": round(len(shed) / len(tasks) * 100, 1),
+            "reads_shed_pct": round(dropped[0] / max(sent[0], 1) * 100, 1),
+            "writes_shed_pct": round(dropped[1] / max(sent[1], 1) * 100, 1),
+            "p50_ms": round(percentile(served, 0.50) * 1000, 1) if served else None,
+            "p99_ms": round(percentile(served, 0.99) * 1000, 1) if served else None,
+            "p99_all_ms": round(percentile(every, 0.99) * 1000, 1),
+        }
@@ -0,0 +1,85 @@
+import json
+import os
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from prometheus_client import REGISTRY
+
+from service_common.benchmarks import client_host, format_table, run_scenario, write_results
+from watchlist.models import PlaybackProgress
+from watchlist.progress import playback_progress
+from watchlist.sharding import SHARDS
+
+VIEWER_PREFIX = "bench-viewer-"
+
+
+def rows_written():
+    return REGISTRY.get_sample_value("playback_progress_rows_written_total") or 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Heartbeat throughput of POST /api/progress/heartbeat/ through the full middleware stack, "
+        "written straight through vs buffered and coalesced, with the rows each one wrote."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000, help="Heartbeats per scenario.")
+        parser.add_argument("--warmup", type=int, default=100, help="Untimed heartbeats before each scenario.")
+        parser.add_argument("--viewers", type=int, default=200, help="Users watching at the same time.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        secret = os.environ.get("JWT_SECRET")
+        if not secret:
+            raise CommandError("JWT_SECRET must be set to sign the benchmark tokens")
+        viewers = [f"{VIEWER_PREFIX}{i:05d}" for i in range(options["viewers"])]
+        tokens = {user_id: jwt.encode({"user_id": user_id}, secret, algorithm="HS256") for user_id in viewers}
+        client = Client(HTTP_HOST=client_host(settings.ALLOWED_HOSTS))
+
+        def prepare(i):
+            # Each viewer plays one episode and reports every few seconds
+            user_id = viewers[i % len(viewers)]
+            body = {"media_id": "bench-title", "media_type": "anime", "episode": "1", "position": i // len(viewers) * 5}
+            return user_id, json.dumps(body)
+
+        def call(user_id, body):
+            return client.post(
+                "/api/progress/heartbeat/",
+                body,
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {tokens[user_id]}",
+            )
+
+        def check(response):
+            return response.status_code == 204
+
+        interval = playback_progress.interval
+        results = []
+        try:
+            for name, scenario_interval in (("direct", 0), ("buffered", interval or 5)):
+                playback_progress.interval = scenario_interval
+                before = rows_written()
+                result = run_scenario(name, options["requests"], prepare, call, check, options["warmup"])
+                playback_progress.flush()
+                result["rows_written"] = int(rows_written() - before)
+                results.append(result)
+        finally:
+            playback_progress.interval = interval
+            for shard in SHARDS:
+                PlaybackProgress.objects.using(shard).filter(user_id__startswith=VIEWER_PREFIX).delete()
+
+        self.stdout.write(format_table(results))
+        for result in results:
+            heartbeats = options["warmup"] + result["requests"]
+            self.stdout.write(
+                f"{result['scenario']}: {heartbeats} heartbeats, {result['rows_written']} rows written "
+                f"({heartbeats / max(result['rows_written'], 1):.1f} heartbeats per row)"
+            )
+        if options["output"]:
+            recorded = {key: options[key] for key in ("requests", "warmup", "viewers")}
+            recorded["flush_interval"] = interval
+            write_results(options["output"], recorded, results)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,176 @@
+import random
+import time
+import uuid
+
+from django.apps.registry import Apps
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.utils import OperationalError
+from django.utils import timezone
+
+from service_common.benchmarks import write_results
+from watchlist.ids import uuid7
+from watchlist.models import Watchlist
+
+SCHEMES = {"uuid4": uuid.uuid4, "uuid7": uuid7}
+MB = 1024 * 1024
+
+
+def scratch_model(scheme):
+    """A copy of Watchlist in its own table, with the primary key and the (user_id, id) index."""
+    table = f"bench_pk_{scheme}"
+    meta = type(
+        "Meta",
+        (),
+        {
+            "app_label": "watchlist",
+            # Kept out of the project's registry, so migrations never see it
+            "apps": Apps(),
+            "db_table": table,
+            "indexes": [models.Index(fields=["user_id", "id"], name=f"{table}_user_idx")],
+        },
+    )
+    fields = {field.name: field.clone() for field in Watchlist._meta.local_fields}
+    for field in fields.values():
+        # Only the indexes that hold the id are compared
+        field.db_index = False
+    return type(f"BenchPk{scheme.title()}", (models.Model,), {"__module__": __name__, "Meta": meta, **fields})
+
+
+def sizes(connection, table):
+    """`(table bytes, {index name: bytes})`, or None where the backend cannot tell."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_relation_size(%s::regclass)", [table])
+            table_size = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT indexrelid::regclass::text, pg_relation_size(indexrelid) FROM pg_index "
+                "WHERE indrelid = %s::regclass",
+                [table],
+            )
+            return table_size, dict(cursor.fetchall())
+        if connection.vendor == "sqlite":
+            try:
+                cursor.execute(
+                    "SELECT s.name, SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON m.name = s.name "
+                    "WHERE m.tbl_name = %s GROUP BY s.name",
+                    [table],
+                )
+            except OperationalError:
+                # SQLite built without the dbstat table
+                return None, {}
+            found = dict(cursor.fetchall())
+            return found.pop(table, None), found
+    return None, {}
+
+
+def wal_position(connection):
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn()::text")
+        return cursor.fetchone()[0]
+
+
+def wal_bytes(connection, start):
+    if start is None:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s::pg_lsn)", [start])
+        return int(cursor.fetchone()[0])
+
+
+def megabytes(size):
+    return round(size / MB, 1) if size is not None else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert throughput and index size of random (uuid4) vs time-ordered (uuid7) primary keys, "
+        "seeding a scratch copy of the watchlist table with each and dropping it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=2_000_000, help="Rows inserted per scheme.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per INSERT.")
+        parser.add_argument("--users", type=int, default=50_000, help="Distinct users the rows belong to.")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        results = [self.run(scheme, connection, options) for scheme in SCHEMES]
+        self.stdout.write(
+            f"{'scheme':<8}{'rows/s':>10}{'last 10%':>10}{'table MB':>10}{'pk MB':>9}{'user MB':>9}{'WAL MB':>9}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['scenario']:<8}{result['rows_per_s']:>10}{result['last_tenth_rows_per_s']:>10}"
+                f"{str(result['table_mb']):>10}{str(result['pk_index_mb']):>9}{str(result['user_index_mb']):>9}"
+                f"{str(result['wal_mb']):>9}"
+            )
+        if options["output"]:
+            write_results(options["output"], options, results)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def run(self, scheme, connection, options):
+        model = scratch_model(scheme)
+        table = model._meta.db_table
+        if table in connection.introspection.table_names():
+            # Left over from an interrupted run
+            with connection.schema_editor() as editor:
+                editor.delete_model(model)
+        with connection.schema_editor() as editor:
+            editor.create_model(model)
+        make_id = SCHEMES[scheme]
+        # The same users and titles for both schemes
+        rng = random.Random(0)
+        rows, batch_size = options["rows"], options["batch_size"]
+        timings = []
+        try:
+            start = wal_position(connection)
+            for offset in range(0, rows, batch_size):
+                now = timezone.now()
+                batch = [
+                    model(
+                        id=make_id(),
+                        user_id=f"bench-pk-{rng.randrange(options['users']):06d}",
+                        media_id=str(offset + i),
+                        media_type="anime",
+                        title="Benchmark title",
+                        status="planned",
+                        change_seq=offset + i + 1,
+                        created_at=now,
+                        updated_at=now,
+                    )
+                    for i in range(min(batch_size, rows - offset))
+                ]
+                started = time.perf_counter()
+                model.objects.using(options["database"]).bulk_create(batch)
+                timings.append((len(batch), time.perf_counter() - started))
+                if len(timings) % 200 == 0:
+                    self.stdout.write(f"{scheme}: {offset + len(batch)} rows")
+            written = wal_bytes(connection, start)
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    # Fresh visibility map and statistics, as autovacuum would leave them
+                    cursor.execute(f"VACUUM ANALYZE {connection.ops.quote_name(table)}")
+            table_size, index_sizes = sizes(connection, table)
+        finally:
+            with connection.schema_editor() as editor:
+                editor.delete_model(model)
+
+        tail = timings[len(timings) - max(1, len(timings) // 10) :]
+        user_index = index_sizes.pop(f"{table}_user_idx", None)
+        return {
+            "scenario": scheme,
+            "rows": rows,
+            "seconds": round(sum(seconds for _, seconds in timings), 2),
+            "rows_per_s": round(rows / sum(seconds for _, seconds in timings)),
+            "last_tenth_rows_per_s": round(sum(n for n, _ in tail) / sum(seconds for _, seconds in tail)),
+            "table_mb": megabytes(table_size),
+            # What is left is the primary key's index
+            "pk_index_mb": megabytes(sum(index_sizes.values())) if index_sizes else None,
+            "user_index_mb": megabytes(user_index),
+            "wal_mb": megabytes(written),
+        }
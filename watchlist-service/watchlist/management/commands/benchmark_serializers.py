@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from watchlist.models import Watchlist
+from service_common.renderers import FastJSONRenderer
+from service_common.rows import RowSerializer
+from watchlist.serializers import WatchlistSerializer
+from watchlist.sharding import use_user
+
+
+class Command(BaseCommand):
+    help = "CPU time per 1,000 rows of the list read path: ModelSerializer + JSONRenderer vs rows + FastJSONRenderer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        row_serializer = RowSerializer(WatchlistSerializer)
+        json_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+
+        def serializer_path(queryset):
+            return json_renderer.render(WatchlistSerializer(list(queryset), many=True).data)
+
+        def row_path(queryset):
+            return fast_renderer.render(row_serializer.many(row_serializer.rows(queryset)))
+
+        # Seeded rows are rolled back at the end
+        with use_user("benchmark-serializers", write=True) as shard, transaction.atomic(using=shard):
+            Watchlist.objects.bulk_create(
+                Watchlist(
+                    user_id="benchmark-serializers",
+                    media_id=f"bench-{i}",
+                    media_type=Watchlist.MediaType.ANIME,
+                    title=f"Benchmark title {i} – ünïcode",
+                    poster_url=f"https://img.example.com/{i}.jpg" if i % 2 else None,
+                )
+                for i in range(rows)
+            )
+            queryset = Watchlist.objects.for_user("benchmark-serializers")
+            if serializer_path(queryset) != row_path(queryset):
+                raise CommandError("Output differs between the two paths")
+
+            results = {}
+            for name, path in (("serializer", serializer_path), ("rows", row_path)):
+                path(queryset)
+                start = time.process_time()
+                for _ in range(repeat):
+                    path(queryset)
+                results[name] = (time.process_time() - start) / repeat / rows * 1000 * 1000
+                self.stdout.write(f"{name:>10}: {results[name]:7.2f} ms CPU per 1,000 rows")
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Identical output, {results['serializer'] / results['rows']:.1f}x less CPU per row")
+        )
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import time
+
+import jwt
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncRequestFactory
+
+from watchlist.async_views import AsyncWatchlistListView
+from watchlist.models import Watchlist
+from watchlist.sharding import use_user
+from watchlist.views import WatchlistViewSet
+
+
+class Command(BaseCommand):
+    help = "Compare requests/sec of the sync DRF viewset and the async views for GET /api/watchlist/."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=200)
+        parser.add_argument("--rows", type=int, default=20, help="Watchlist rows seeded for the benchmark user.")
+        parser.add_argument("--user-id", default="benchmark-user")
+
+    def handle(self, *args, **options):
+        secret = os.environ.get("JWT_SECRET")
+        if not secret:
+            raise CommandError("JWT_SECRET must be set to sign the benchmark token")
+
+        user_id = options["user_id"]
+        with use_user(user_id, write=True):
+            missing = options["rows"] - Watchlist.objects.filter(user_id=user_id).count()
+            Watchlist.objects.bulk_create(
+                Watchlist(user_id=user_id, media_id=f"bench-{i}", media_type=Watchlist.MediaType.ANIME, title=f"Benchmark {i}")
+                for i in range(max(missing, 0))
+            )
+        token = jwt.encode({"user_id": user_id}, secret, algorithm="HS256")
+
+        sync_view = WatchlistViewSet.as_view({"get": "list"})
+        async_view = AsyncWatchlistListView.as_view()
+
+        async def call_sync(request):
+            # This is what Django's ASGI handler does for a sync view.
+            def run():
+                return sync_view(request).render()
+            return await sync_to_async(run, thread_sensitive=True)()
+
+        for name, call in (("sync", call_sync), ("async", async_view)):
+            elapsed, latencies = asyncio.run(self.run(call, token, options["requests"], options["concurrency"]))
+            latencies.sort()
+            self.stdout.write(
+                f"{name:>5}: {options['requests'] / elapsed:8.1f} req/s  "
+                f"p50={latencies[len(latencies) // 2] * 1000:.1f}ms  "
+                f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms"
+            )
+
+    async def run(self, call, token, total, concurrency):
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one():
+            async with semaphore:
+                request = factory.get("/api/watchlist/", headers={"authorization": f"Bearer {token}"})
+                started = time.perf_counter()
+                response = await call(request)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f"Unexpected status {response.status_code}: {response.content[:200]!r}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return time.perf_counter() - started, latencies
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from watchlist.models import Watchlist
+from watchlist.sharding import SHARDS
+from watchlist.transfer import EXPORT_FIELDS, FORMATS, export_entries
+
+
+class Command(BaseCommand):
+    help = "Stream watchlist entries of all (or some) users to stdout as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", dest="name", choices=list(FORMATS), default="ndjson")
+        parser.add_argument("--user", dest="user_ids", action="append", help="Only this user (repeatable).")
+
+    def handle(self, *args, **options):
+        for index, shard in enumerate(SHARDS):
+            entries = Watchlist.objects.using(shard)
+            if options["user_ids"]:
+                entries = entries.filter(user_id__in=options["user_ids"])
+            chunks = export_entries(entries, options["name"], fields=["user_id", *EXPORT_FIELDS])
+            if index:
+                # One CSV header for the whole export
+                next(chunks)
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending="")
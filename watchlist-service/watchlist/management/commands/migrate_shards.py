@@ -0,0 +1,22 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from watchlist.sharding import SHARDS
+
+
+class Command(BaseCommand):
+    help = (
+        'Run migrate on "default" and on every database in WATCHLIST_SHARDS. The router only '
+        "creates per-user tables on the shards and everything else in default."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("app_label", nargs="?")
+        parser.add_argument("migration_name", nargs="?")
+
+    def handle(self, *args, **options):
+        labels = [label for label in (options["app_label"], options["migration_name"]) if label]
+        for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *SHARDS]):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Database {alias}:"))
+            call_command("migrate", *labels, database=alias, interactive=False, verbosity=options["verbosity"])
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from watchlist.models import WatchlistStats, WatchlistTombstone
+from watchlist.sharding import SHARDS
+
+
+class Command(BaseCommand):
+    help = "Delete change-feed tombstones older than the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.WATCHLIST_TOMBSTONE_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        deleted = 0
+        for shard in SHARDS:
+            expired = WatchlistTombstone.objects.using(shard).filter(deleted_at__lt=cutoff)
+            with transaction.atomic(using=shard):
+                # Clients whose cursor predates a purged tombstone get 410 and resync.
+                horizons = expired.values("user_id").annotate(seq=Max("change_seq")).order_by()
+                for row in horizons.iterator():
+                    WatchlistStats.objects.using(shard).filter(user_id=row["user_id"]).update(
+                        purged_seq=Greatest("purged_seq", row["seq"])
+                    )
+                deleted += expired.delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} tombstones older than {options['days']} days"))
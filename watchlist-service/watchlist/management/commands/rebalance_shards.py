@@ -0,0 +1,243 @@
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.fields import AutoFieldMixin
+
+from watchlist.models import (
+    PlaybackProgress,
+    ShardPlacement,
+    Watchlist,
+    WatchlistOutbox,
+    WatchlistStats,
+    WatchlistTombstone,
+)
+from watchlist.sharding import SHARDS, HashRing, directory
+
+# Copied and verified row for row; auto-increment ids are reassigned by the
+# target, so they are left out of the copy and of the comparison.
+COPIED_MODELS = [Watchlist, WatchlistStats, WatchlistTombstone, PlaybackProgress]
+
+
+def copied_fields(model):
+    return [field.attname for field in model._meta.concrete_fields if not isinstance(field, AutoFieldMixin)]
+
+
+@contextmanager
+def source_timestamps(model):
+    """Keep auto_now / auto_now_add from stamping copies with the time of the copy."""
+    fields = [
+        field
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def normalize(value):
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return str(value) if value is not None else None
+
+
+def fingerprint(queryset, fields):
+    """Row count and an order-independent checksum of `fields`.
+
+    Rows are hashed one by one and the hashes summed, so the two shards do
+    not have to sort text the same way.
+    """
+    count, total = 0, 0
+    for row in queryset.values_list(*fields).iterator(chunk_size=2000):
+        digest = hashlib.blake2b(repr([normalize(value) for value in row]).encode(), digest_size=16).digest()
+        total = (total + int.from_bytes(digest, "big")) % (1 << 128)
+        count += 1
+    return count, total
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users whose rows are not on their ring shard (or the --user ones, to --to), a batch at a "
+        "time: refuse their writes, copy and verify their rows, switch their placement, then delete the "
+        "source rows. Reads keep working throughout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ring", help="Comma-separated target ring (default WATCHLIST_SHARD_RING).")
+        parser.add_argument("--user", dest="user_ids", action="append", help="Only this user (repeatable).")
+        parser.add_argument("--to", help="Move the --user users to this shard instead of their ring shard.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Users moved together.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per copy statement.")
+        parser.add_argument("--limit", type=int, help="Stop after moving this many users.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would move.")
+        parser.add_argument(
+            "--purge-strays",
+            action="store_true",
+            help="Delete rows found on a shard their user is not placed on (left by an interrupted move).",
+        )
+
+    def handle(self, *args, **options):
+        ring_shards = options["ring"].split(",") if options["ring"] else settings.WATCHLIST_SHARD_RING
+        unknown = {*ring_shards, *([options["to"]] if options["to"] else [])} - set(SHARDS)
+        if unknown:
+            raise CommandError(f"Not in WATCHLIST_SHARDS: {', '.join(sorted(unknown))}")
+        if options["to"] and not options["user_ids"]:
+            raise CommandError("--to needs --user")
+        if len(SHARDS) == 1:
+            self.stdout.write("Only one shard configured; nothing to rebalance.")
+            return
+        ring = HashRing(ring_shards)
+
+        def target(user_id):
+            return options["to"] or ring.get(user_id)
+
+        plan, strays = {}, {}
+        for shard in SHARDS:
+            for user_id in self.discover(shard, options["user_ids"], strays):
+                if target(user_id) != shard:
+                    plan.setdefault((shard, target(user_id)), []).append(user_id)
+
+        for (source, destination), user_ids in sorted(plan.items()):
+            self.stdout.write(f"{source} -> {destination}: {len(user_ids)} users")
+        for shard, user_ids in sorted(strays.items()):
+            self.stdout.write(self.style.WARNING(f"{shard}: stray rows of {len(user_ids)} users placed elsewhere"))
+        if options["dry_run"]:
+            return
+        if options["purge_strays"]:
+            for shard, user_ids in strays.items():
+                self.delete_rows(shard, user_ids)
+            self.stdout.write(f"Purged stray rows of {sum(map(len, strays.values()))} users")
+
+        moved, started = 0, time.perf_counter()
+        for (source, destination), user_ids in sorted(plan.items()):
+            for batch in chunked(user_ids[: options["limit"] - moved if options["limit"] else None], options["batch_size"]):
+                self.move(source, destination, batch, options["chunk_size"])
+                moved += len(batch)
+                self.stdout.write(f"Moved {moved} users ({source} -> {destination})")
+            if options["limit"] and moved >= options["limit"]:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} users in {time.perf_counter() - started:.1f}s"))
+
+    def discover(self, shard, only, strays):
+        """Yield users with rows on `shard` that are placed there, placing unplaced ones on it.
+
+        Users with rows here but placed on another shard are collected in `strays`.
+        """
+        # Every user with entries has a stats row; progress can exist without them
+        stats = WatchlistStats.objects.using(shard)
+        progress = PlaybackProgress.objects.using(shard)
+        if only:
+            stats, progress = stats.filter(user_id__in=only), progress.filter(user_id__in=only)
+        user_ids = stats.values_list("user_id", flat=True).union(progress.values_list("user_id", flat=True))
+        for chunk in chunked(user_ids.iterator(), 1000):
+            placements = dict(
+                ShardPlacement.objects.filter(user_id__in=chunk).values_list("user_id", "shard").iterator()
+            )
+            unplaced = [user_id for user_id in chunk if user_id not in placements]
+            # Rows from before sharding, or from before the placement was recorded
+            ShardPlacement.objects.bulk_create(
+                [ShardPlacement(user_id=user_id, shard=shard) for user_id in unplaced], ignore_conflicts=True
+            )
+            placements.update(
+                ShardPlacement.objects.filter(user_id__in=unplaced).values_list("user_id", "shard").iterator()
+            )
+            for user_id in chunk:
+                if placements[user_id] == shard:
+                    yield user_id
+                else:
+                    strays.setdefault(shard, []).append(user_id)
+
+    def wait(self):
+        # Every worker's cached placement of these users has expired, and
+        # writes that passed the old placement have finished
+        time.sleep(settings.WATCHLIST_SHARD_DIRECTORY_TTL + settings.WATCHLIST_SHARD_MOVE_GRACE)
+
+    def move(self, source, target, user_ids, chunk_size):
+        placements = ShardPlacement.objects.filter(user_id__in=user_ids, shard=source)
+        placements.update(moving=True)
+        directory.forget(user_ids)
+        try:
+            self.wait()
+            self.move_outbox(source, target, user_ids)
+            self.copy(source, target, user_ids, chunk_size)
+            self.verify(source, target, user_ids)
+        except BaseException:
+            try:
+                # Events the target relay has not published yet go back to
+                # the shard the placement still names
+                self.move_outbox(target, source, user_ids)
+                self.delete_rows(target, user_ids, outbox=False)
+            finally:
+                placements.update(moving=False)
+            raise
+        placements.update(shard=target, moving=False)
+        directory.forget(user_ids)
+        # Workers still routing reads to the source keep finding the rows
+        self.wait()
+        self.delete_rows(source, user_ids)
+
+    def move_outbox(self, source, target, user_ids):
+        """Move unpublished events in one step, so neither relay publishes them twice.
+
+        The row locks make the source relay wait; a crash between the two
+        commits can only cause a duplicate, which consumers already handle.
+        """
+        with transaction.atomic(using=source):
+            rows = list(
+                WatchlistOutbox.objects.using(source).select_for_update().filter(user_id__in=user_ids).order_by("id")
+            )
+            if not rows:
+                return
+            ids = [row.id for row in rows]
+            for row in rows:
+                row.id = None
+            with source_timestamps(WatchlistOutbox):
+                WatchlistOutbox.objects.using(target).bulk_create(rows)
+            WatchlistOutbox.objects.using(source).filter(id__in=ids).delete()
+
+    def copy(self, source, target, user_ids, chunk_size):
+        with transaction.atomic(using=target):
+            # Leftovers of an interrupted move; the placement still says source
+            self.delete_rows(target, user_ids, outbox=False)
+            for model in COPIED_MODELS:
+                fields = copied_fields(model)
+                rows = model.objects.using(source).filter(user_id__in=user_ids).order_by("pk").values(*fields)
+                with source_timestamps(model):
+                    for chunk in chunked(rows.iterator(chunk_size=chunk_size), chunk_size):
+                        model.objects.using(target).bulk_create([model(**row) for row in chunk])
+
+    def verify(self, source, target, user_ids):
+        for model in COPIED_MODELS:
+            fields = copied_fields(model)
+            expected = fingerprint(model.objects.using(source).filter(user_id__in=user_ids), fields)
+            copied = fingerprint(model.objects.using(target).filter(user_id__in=user_ids), fields)
+            if expected != copied:
+                raise CommandError(
+                    f"{model.__name__} differs after copying {len(user_ids)} users from {source} to {target}: "
+                    f"{expected[0]} rows vs {copied[0]}"
+                )
+
+    def delete_rows(self, shard, user_ids, outbox=True):
+        with transaction.atomic(using=shard):
+            for model in COPIED_MODELS + ([WatchlistOutbox] if outbox else []):
+                model.objects.using(shard).filter(user_id__in=user_ids).delete()
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from watchlist import trending
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute TrendingScore from the Watchlist table in one aggregate query. Run it after "
+        "changing TRENDING_HALF_LIFE_HOURS or TRENDING_EPOCH, or to repair missed updates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = trending.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt trending scores for {count} titles in {time.perf_counter() - started:.2f}s")
+        )
@@ -0,0 +1,58 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from watchlist.models import Watchlist, WatchlistStats
+from watchlist.sharding import SHARDS
+from watchlist.stats import COUNTER_FIELDS, count_entries
+
+
+class Command(BaseCommand):
+    help = "Recompute WatchlistStats from the Watchlist table and fix any rows that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", dest="user_ids", action="append", help="Only this user (repeatable).")
+        parser.add_argument("--check", action="store_true", help="Report drift without writing.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for shard in SHARDS:
+            self.rebuild(shard, options)
+
+    def rebuild(self, shard, options):
+        entries = Watchlist.objects.using(shard)
+        stored = WatchlistStats.objects.using(shard)
+        if options["user_ids"]:
+            entries = entries.filter(user_id__in=options["user_ids"])
+            stored = stored.filter(user_id__in=options["user_ids"])
+
+        expected = count_entries(entries)
+        drifted = []
+        seen = set()
+        for row in stored.iterator():
+            seen.add(row.user_id)
+            counts = expected.get(row.user_id, Counter())
+            if any(getattr(row, field) != counts[field] for field in COUNTER_FIELDS):
+                drifted.append(row.user_id)
+        missing = [user_id for user_id in expected if user_id not in seen]
+
+        self.stdout.write(
+            f"{shard}: {len(expected)} users with entries, {len(drifted)} drifted, {len(missing)} missing stats rows"
+        )
+        if options["check"] or not (drifted or missing):
+            return
+
+        rows = [
+            WatchlistStats(user_id=user_id, **{field: expected.get(user_id, Counter())[field] for field in COUNTER_FIELDS})
+            for user_id in drifted + missing
+        ]
+        with transaction.atomic(using=shard):
+            WatchlistStats.objects.using(shard).bulk_create(
+                rows,
+                batch_size=options["batch_size"],
+                update_conflicts=True,
+                unique_fields=["user_id"],
+                update_fields=[*COUNTER_FIELDS, "updated_at"],
+            )
+        self.stdout.write(self.style.SUCCESS(f"{shard}: rebuilt stats for {len(rows)} users"))
@@ -0,0 +1,131 @@
+import time
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import CharField, Func
+
+from watchlist import events, sharding, stats
+from watchlist.cache import watchlist_cache
+from watchlist.ids import uuid7
+from watchlist.models import Watchlist, WatchlistTombstone
+from watchlist.sharding import SHARDS, UserMoving
+
+REKEY = "UPDATE {table} SET {id} = %s, {change_seq} = %s WHERE {id} = %s"
+
+
+class UUIDVersion(Func):
+    """The version digit of a UUID column, as text."""
+
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        template = "substring(%(expressions)s::text from 15 for 1)"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Stored as 32 hex digits without dashes
+        template = "substr(%(expressions)s, 13, 1)"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+
+def random_ids(queryset):
+    return queryset.annotate(id_version=UUIDVersion("id")).exclude(id_version="7")
+
+
+class Command(BaseCommand):
+    help = (
+        "Give entries created before time-ordered ids a UUIDv7 id from their created_at, a user at a time. "
+        "Delta-sync clients see the old id deleted and the entry under its new id; the outbox gets a "
+        "watchlist.entry.rekeyed event with the old id. Safe to rerun; set WATCHLIST_KEYSET_BY_ID once "
+        "nothing is left."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Stop after rekeying this many users.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many entries are left.")
+
+    def handle(self, *args, **options):
+        rekeyed_users, rekeyed, skipped, started = 0, 0, 0, time.perf_counter()
+        for shard in SHARDS:
+            pending = random_ids(Watchlist.objects.using(shard))
+            if options["dry_run"]:
+                users = pending.values("user_id").distinct().count()
+                self.stdout.write(f"{shard}: {pending.count()} entries of {users} users left")
+                continue
+            user_ids = list(pending.values_list("user_id", flat=True).distinct().order_by())
+            for user_id in user_ids:
+                if options["limit"] and rekeyed_users >= options["limit"]:
+                    break
+                count = self.rekey_user(shard, user_id)
+                if count is None:
+                    skipped += 1
+                    continue
+                rekeyed_users += 1
+                rekeyed += count
+                if rekeyed_users % 100 == 0:
+                    self.stdout.write(f"Rekeyed {rekeyed} entries of {rekeyed_users} users")
+        if options["dry_run"]:
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rekeyed {rekeyed} entries of {rekeyed_users} users in {time.perf_counter() - started:.1f}s"
+            )
+        )
+        if skipped:
+            self.stdout.write(
+                self.style.WARNING(f"Skipped {skipped} users being moved or placed on another shard; rerun later")
+            )
+
+    def rekey_user(self, shard, user_id):
+        """Rekey the user's remaining entries in one transaction; None if their rows are not writable here."""
+        if sharding.shards_for([user_id])[user_id][0] != shard:
+            # Stray rows, which rebalance_shards deals with
+            return None
+        try:
+            with sharding.use_user(user_id, write=True) as db, transaction.atomic(using=db):
+                # The stats row first, then the entries, in the same order as batch writes
+                stats.lock_user(user_id)
+                entries = random_ids(Watchlist.objects.select_for_update().filter(user_id=user_id))
+                entries = list(entries.order_by("created_at", "id"))
+                if not entries:
+                    return 0
+                # Two feed changes per entry: the tombstone of the old id and the entry under the new one
+                seq = stats.apply_delta(user_id, {}, changes=2 * len(entries))
+                tombstones, outbox, params = [], [], []
+                connection = connections[db]
+                pk = Watchlist._meta.pk
+                for entry in entries:
+                    previous = entry.id
+                    tombstones.append(
+                        WatchlistTombstone(
+                            entry_id=previous,
+                            user_id=user_id,
+                            media_id=entry.media_id,
+                            media_type=entry.media_type,
+                            change_seq=seq,
+                        )
+                    )
+                    entry.id, entry.change_seq, seq = uuid7(entry.created_at), seq + 1, seq + 2
+                    params.append(
+                        (
+                            pk.get_db_prep_value(entry.id, connection),
+                            entry.change_seq,
+                            pk.get_db_prep_value(previous, connection),
+                        )
+                    )
+                    outbox.append(events.entry_event(events.ENTRY_REKEYED, entry, previous_entry_id=str(previous)))
+                WatchlistTombstone.objects.bulk_create(tombstones)
+                quote = connection.ops.quote_name
+                sql = REKEY.format(
+                    table=quote(Watchlist._meta.db_table),
+                    id=quote(pk.column),
+                    change_seq=quote(Watchlist._meta.get_field("change_seq").column),
+                )
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, params)
+                events.record(outbox)
+                transaction.on_commit(partial(watchlist_cache.bump, user_id), using=db)
+                return len(entries)
+        except UserMoving:
+            return None
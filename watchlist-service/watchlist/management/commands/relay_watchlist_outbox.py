@@ -0,0 +1,76 @@
+import json
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from watchlist.models import WatchlistOutbox
+from watchlist.publishers import PublishError, get_publisher
+from watchlist.sharding import SHARDS
+
+
+class Command(BaseCommand):
+    help = "Publish queued watchlist events from the outbox (WATCHLIST_OUTBOX_PUBLISHER)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.WATCHLIST_OUTBOX_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=settings.WATCHLIST_OUTBOX_POLL_INTERVAL,
+                            help="Seconds to wait when the outbox is empty or publishing failed.")
+        parser.add_argument("--once", action="store_true", help="Drain the outbox and exit.")
+
+    def handle(self, *args, **options):
+        database = connections[DEFAULT_DB_ALIAS].settings_dict
+        if database["ENGINE"] == "django.db.backends.sqlite3" and database["NAME"] == str(settings.BASE_DIR / "db.sqlite3"):
+            # The web workers write elsewhere, so this outbox would stay empty
+            raise CommandError("DATABASE_URL is not set; the relay needs the database the web workers write to")
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        publisher = get_publisher()
+        published = 0
+        try:
+            while not self.stopping:
+                counts = []
+                try:
+                    # Each shard has its own outbox; a user's events are all on one
+                    for shard in SHARDS:
+                        counts.append(self.relay_batch(publisher, options["batch_size"], shard))
+                except PublishError as exc:
+                    if options["once"]:
+                        raise CommandError(str(exc))
+                    self.stderr.write(f"Publishing failed, retrying: {exc}")
+                    time.sleep(options["interval"])
+                    continue
+                finally:
+                    published += sum(counts)
+                if max(counts) < options["batch_size"]:
+                    if options["once"]:
+                        break
+                    time.sleep(options["interval"])
+        finally:
+            publisher.close()
+        self.stdout.write(self.style.SUCCESS(f"Published {published} events"))
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def relay_batch(self, publisher, batch_size, shard):
+        """Publish the oldest `batch_size` events of `shard` and delete them once acknowledged.
+
+        Rows are only deleted after the publisher's flush succeeds, so a crash
+        or broker error leaves them to be sent again (at-least-once); consumers
+        dedupe on the event `id`. The row locks keep a second relay from
+        publishing the same rows, and since a user's writes serialize on their
+        stats row, `id` order is also that user's commit order.
+        """
+        with transaction.atomic(using=shard):
+            rows = list(WatchlistOutbox.objects.using(shard).select_for_update().order_by("id")[:batch_size])
+            if not rows:
+                return 0
+            for row in rows:
+                value = json.dumps({"id": row.id, **row.payload}, separators=(",", ":"))
+                publisher.publish(settings.KAFKA_TOPIC_WATCHLIST_CHANGED, row.user_id, value.encode())
+            publisher.flush()
+            WatchlistOutbox.objects.using(shard).filter(id__in=[row.id for row in rows]).delete()
+        return len(rows)
@@ -0,0 +1,144 @@
+import json
+import os
+import random
+import uuid
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from service_common.benchmarks import (
+    SEED_PREFIX,
+    client_host,
+    compare,
+    format_table,
+    run_scenario,
+    write_results,
+    zipf_weights,
+)
+from watchlist.cache import watchlist_cache
+from watchlist.models import Watchlist, WatchlistStats
+from watchlist.services import delete_entry
+from watchlist.sharding import SHARDS, use_user
+
+SCENARIOS = ["list", "list_uncached", "create", "update"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay list/create/update requests through the full middleware stack against users "
+        "seeded by seed_watchlists, and report throughput, p50/p95/p99 and queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=50, help="Untimed requests before each scenario.")
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+        parser.add_argument("--users", type=int, default=1000, help="Seeded users requests are spread over.")
+        parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of user activity.")
+        parser.add_argument("--page-size", type=int, default=settings.WATCHLIST_PAGE_SIZE)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--compare", help="Results JSON of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        secret = os.environ.get("JWT_SECRET")
+        if not secret:
+            raise CommandError("JWT_SECRET must be set to sign the benchmark tokens")
+        scenarios = options["scenarios"].split(",")
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        # Seeded user ids sort heaviest first, so this is the hot end of the skew
+        users = sorted(
+            user_id
+            for shard in SHARDS
+            for user_id in WatchlistStats.objects.using(shard)
+            .filter(user_id__startswith=SEED_PREFIX)
+            .order_by("user_id")
+            .values_list("user_id", flat=True)[: options["users"]]
+        )[: options["users"]]
+        if not users:
+            raise CommandError("No seeded users; run seed_watchlists first.")
+
+        rng = random.Random(options["seed"])
+        weights = zipf_weights(len(users), options["skew"])
+        picks = [rng.choices(users, cum_weights=weights)[0] for _ in range(options["warmup"] + options["requests"])]
+        tokens = {user_id: jwt.encode({"user_id": user_id}, secret, algorithm="HS256") for user_id in set(picks)}
+        client = Client(HTTP_HOST=client_host(settings.ALLOWED_HOSTS))
+
+        def auth(user_id):
+            return {"HTTP_AUTHORIZATION": f"Bearer {tokens[user_id]}"}
+
+        list_url = f"/api/watchlist/?page_size={options['page_size']}"
+        created = []
+
+        def prepare_list(i):
+            return (picks[i],)
+
+        def prepare_list_uncached(i):
+            watchlist_cache.bump(picks[i])
+            return (picks[i],)
+
+        def call_list(user_id):
+            return client.get(list_url, **auth(user_id))
+
+        def prepare_create(i):
+            media_id = f"bench-{uuid.uuid4().hex}"
+            return picks[i], {"media_id": media_id, "media_type": "anime", "title": f"Benchmark {media_id}"}
+
+        def call_create(user_id, body):
+            return client.post("/api/watchlist/", json.dumps(body), content_type="application/json", **auth(user_id))
+
+        def check_ok(response):
+            return response.status_code == 200
+
+        def check_create(response):
+            if response.status_code == 201:
+                created.append(response.json()["id"])
+                return True
+            return False
+
+        entries = {}
+
+        def prepare_update(i):
+            user_id = picks[i]
+            if user_id not in entries:
+                with use_user(user_id):
+                    entries[user_id] = list(Watchlist.objects.filter(user_id=user_id).values_list("id", flat=True)[:50])
+            status = rng.choice(Watchlist.Status.values)
+            return user_id, rng.choice(entries[user_id]), {"status": status}
+
+        def call_update(user_id, entry_id, body):
+            return client.patch(
+                f"/api/watchlist/{entry_id}/", json.dumps(body), content_type="application/json", **auth(user_id)
+            )
+
+        plans = {
+            "list": (prepare_list, call_list, check_ok),
+            "list_uncached": (prepare_list_uncached, call_list, check_ok),
+            "create": (prepare_create, call_create, check_create),
+            "update": (prepare_update, call_update, check_ok),
+        }
+        results = []
+        try:
+            for name in scenarios:
+                prepare, call, check = plans[name]
+                results.append(run_scenario(name, options["requests"], prepare, call, check, options["warmup"]))
+        finally:
+            # Keep the seeded data set stable between runs
+            for shard in SHARDS:
+                for entry in Watchlist.objects.using(shard).filter(id__in=created):
+                    delete_entry(entry)
+
+        self.stdout.write(format_table(results))
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as previous:
+                self.stdout.write(compare(json.load(previous), results))
+        if options["output"]:
+            recorded = {key: options[key] for key in ("requests", "warmup", "scenarios", "users", "skew", "page_size", "seed")}
+            recorded["async_views"] = settings.WATCHLIST_ASYNC_VIEWS
+            write_results(options["output"], recorded, results)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,106 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from service_common.benchmarks import SEED_PREFIX, seed_user_id, zipf_weights
+from watchlist.models import Watchlist, WatchlistOutbox, WatchlistStats, WatchlistTombstone
+from watchlist.sharding import SHARDS, shards_for
+
+STATUS_WEIGHTS = {Watchlist.Status.PLANNED: 5, Watchlist.Status.WATCHING: 2, Watchlist.Status.COMPLETED: 3}
+MEDIA_TYPE_WEIGHTS = {Watchlist.MediaType.ANIME: 6, Watchlist.MediaType.MOVIE: 4}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic watchlists for benchmarks: Zipf-distributed list sizes over "
+        f"'{SEED_PREFIX}*' users and Zipf-distributed title popularity."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--entries", type=int, default=1000000, help="Approximate total number of entries.")
+        parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of list sizes and popularity.")
+        parser.add_argument("--max-per-user", type=int, default=5000)
+        parser.add_argument("--catalogue", type=int, default=50000, help="Distinct media ids per media type.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=1, help="Random seed; the same seed gives the same data.")
+        parser.add_argument("--clear", action="store_true", help="Delete previously seeded users first.")
+
+    def handle(self, *args, **options):
+        users, catalogue = options["users"], options["catalogue"]
+        if options["max_per_user"] > catalogue:
+            raise CommandError("--max-per-user cannot exceed --catalogue")
+
+        if options["clear"]:
+            for shard in SHARDS:
+                for model in (Watchlist, WatchlistStats, WatchlistTombstone, WatchlistOutbox):
+                    model.objects.using(shard).filter(user_id__startswith=SEED_PREFIX).delete()
+        elif any(Watchlist.objects.using(shard).filter(user_id__startswith=SEED_PREFIX).exists() for shard in SHARDS):
+            raise CommandError("Seeded users already exist; pass --clear to replace them.")
+
+        rng = random.Random(options["seed"])
+        size_weights = zipf_weights(users, options["skew"])
+        scale = options["entries"] / size_weights[-1]
+        popularity = zipf_weights(catalogue, options["skew"])
+        statuses, status_weights = zip(*STATUS_WEIGHTS.items())
+        media_types, media_type_weights = zip(*MEDIA_TYPE_WEIGHTS.items())
+
+        started = time.perf_counter()
+        entries, stats, total = [], [], 0
+        previous = 0.0
+        for index in range(users):
+            # Rank `index` gets its share of the Zipf mass, at least one entry
+            weight = size_weights[index] - previous
+            previous = size_weights[index]
+            size = max(1, min(options["max_per_user"], round(weight * scale)))
+
+            user_id = seed_user_id(index)
+            keys = set()
+            while len(keys) < size:
+                for rank in rng.choices(range(catalogue), cum_weights=popularity, k=size - len(keys)):
+                    media_type = rng.choices(media_types, weights=media_type_weights)[0]
+                    keys.add((f"{media_type}-{rank}", media_type))
+            counters = {"total": 0, **{value: 0 for value in statuses + media_types}}
+            for seq, (media_id, media_type) in enumerate(sorted(keys), start=1):
+                status = rng.choices(statuses, weights=status_weights)[0]
+                entries.append(
+                    Watchlist(
+                        user_id=user_id,
+                        media_id=media_id,
+                        media_type=media_type,
+                        title=f"{media_type.title()} {media_id.split('-')[1]}",
+                        poster_url=f"https://img.example.com/{media_id}.jpg" if rng.random() < 0.7 else None,
+                        status=status,
+                        change_seq=seq,
+                    )
+                )
+                counters["total"] += 1
+                counters[status] += 1
+                counters[media_type] += 1
+            stats.append(WatchlistStats(user_id=user_id, change_seq=size, **counters))
+            total += size
+
+            if len(entries) >= options["batch_size"]:
+                self.flush(entries, stats, options["batch_size"])
+                self.stdout.write(f"{total} entries for {index + 1} users")
+
+        self.flush(entries, stats, options["batch_size"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Seeded {total} entries for {users} users in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)")
+        )
+
+    def flush(self, entries, stats, batch_size):
+        placements = shards_for([row.user_id for row in stats], write=True)
+        for shard in SHARDS:
+            with transaction.atomic(using=shard):
+                Watchlist.objects.using(shard).bulk_create(
+                    [entry for entry in entries if placements[entry.user_id][0] == shard], batch_size=batch_size
+                )
+                WatchlistStats.objects.using(shard).bulk_create(
+                    [row for row in stats if placements[row.user_id][0] == shard], batch_size=batch_size
+                )
+        entries.clear()
+        stats.clear()
@@ -0,0 +1,68 @@
+from django.conf import settings
+
+from .cache import watchlist_cache
+from .models import Watchlist
+
+# Cached in place of the map for users with more than
+# WATCHLIST_MEMBERSHIP_MAX_ENTRIES entries; they get one query per batch.
+TOO_LARGE = False
+
+
+def membership_key(media_type, media_id):
+    return f"{media_type}:{media_id}"
+
+
+def membership_query(user_id):
+    limit = settings.WATCHLIST_MEMBERSHIP_MAX_ENTRIES
+    return Watchlist.objects.filter(user_id=str(user_id)).values_list("media_type", "media_id", "status")[: limit + 1]
+
+
+def build_membership(rows):
+    """Compact `{"<media_type>:<media_id>": status}` map of watchlist rows."""
+    return {membership_key(media_type, media_id): status for media_type, media_id, status in rows}
+
+
+def cacheable(members):
+    if len(members) > settings.WATCHLIST_MEMBERSHIP_MAX_ENTRIES:
+        return TOO_LARGE
+    return members
+
+
+def batch_query(user_id, items):
+    return Watchlist.objects.filter(
+        user_id=str(user_id), media_id__in={item["media_id"] for item in items}
+    ).values_list("media_type", "media_id", "status")
+
+
+def answer(members, items):
+    return {
+        key: members.get(key)
+        for key in (membership_key(item["media_type"], item["media_id"]) for item in items)
+    }
+
+
+def lookup_membership(user_id, items):
+    """Status of each `(media_id, media_type)` in `items`, or None if absent.
+
+    Answered from the user's cached membership map when there is one; a cold
+    cache costs a single indexed query that also fills the map.
+    """
+    key = watchlist_cache.membership_key(user_id, watchlist_cache.get_version(user_id))
+    members = watchlist_cache.get(key)
+    if members is None:
+        members = cacheable(build_membership(membership_query(user_id)))
+        watchlist_cache.set(key, members)
+    if members is TOO_LARGE:
+        members = build_membership(batch_query(user_id, items))
+    return answer(members, items)
+
+
+async def alookup_membership(user_id, items):
+    key = watchlist_cache.membership_key(user_id, await watchlist_cache.aget_version(user_id))
+    members = await watchlist_cache.aget(key)
+    if members is None:
+        members = cacheable(build_membership([row async for row in membership_query(user_id)]))
+        await watchlist_cache.aset(key, members)
+    if members is TOO_LARGE:
+        members = build_membership([row async for row in batch_query(user_id, items)])
+    return answer(members, items)
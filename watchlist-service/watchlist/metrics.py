@@ -0,0 +1,15 @@
+from prometheus_client import Counter, Histogram
+from service_common.metrics import LATENCY_BUCKETS
+
+# Watchlist-only metrics; the request, database and load-shedding ones are in
+# service_common.metrics.
+
+# Verified-token cache (watchlist.authentication). Hits / all lookups is the hit rate.
+TOKEN_CACHE_LOOKUPS = Counter("jwt_token_cache_lookups_total", "Lookups of verified tokens, by result.", ["result"])
+
+# Playback progress (watchlist.progress). Heartbeats / rows written is the coalescing ratio.
+PLAYBACK_HEARTBEATS = Counter("playback_heartbeats_total", "Playback heartbeats received.")
+PLAYBACK_ROWS_WRITTEN = Counter("playback_progress_rows_written_total", "Playback progress rows upserted.")
+PLAYBACK_WRITE_DURATION = Histogram(
+    "playback_progress_write_seconds", "Time of one playback progress upsert.", buckets=LATENCY_BUCKETS
+)
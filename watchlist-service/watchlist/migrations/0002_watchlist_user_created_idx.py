@@ -0,0 +1,17 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(fields=['user_id', 'created_at', 'id'], name='watchlist_user_created_idx'),
+        ),
+    ]
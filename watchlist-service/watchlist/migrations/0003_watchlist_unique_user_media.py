@@ -0,0 +1,34 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:34
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_entries(apps, schema_editor):
+    """Keep the most recently updated row of each (user_id, media_id, media_type)."""
+    db = schema_editor.connection.alias
+    Watchlist = apps.get_model('watchlist', 'Watchlist')
+    duplicates = (
+        Watchlist.objects.using(db).values('user_id', 'media_id', 'media_type')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for key in duplicates.iterator():
+        key.pop('rows')
+        stale = Watchlist.objects.using(db).filter(**key).order_by('-updated_at').values_list('id', flat=True)[1:]
+        Watchlist.objects.using(db).filter(id__in=list(stale)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0002_watchlist_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_entries, migrations.RunPython.noop, hints={'model_name': 'watchlist'}),
+        migrations.AddConstraint(
+            model_name='watchlist',
+            constraint=models.UniqueConstraint(fields=('user_id', 'media_id', 'media_type'), name='watchlist_unique_user_media'),
+        ),
+    ]
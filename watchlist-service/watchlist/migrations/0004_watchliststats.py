@@ -0,0 +1,42 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_stats(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Watchlist = apps.get_model('watchlist', 'Watchlist')
+    WatchlistStats = apps.get_model('watchlist', 'WatchlistStats')
+    stats = {}
+    rows = Watchlist.objects.using(db).values('user_id', 'status', 'media_type').annotate(n=Count('id')).order_by()
+    for row in rows.iterator():
+        entry = stats.setdefault(row['user_id'], WatchlistStats(user_id=row['user_id']))
+        entry.total += row['n']
+        setattr(entry, row['status'], getattr(entry, row['status']) + row['n'])
+        setattr(entry, row['media_type'], getattr(entry, row['media_type']) + row['n'])
+    WatchlistStats.objects.using(db).bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0003_watchlist_unique_user_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchlistStats',
+            fields=[
+                ('user_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('total', models.IntegerField(default=0)),
+                ('watching', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('planned', models.IntegerField(default=0)),
+                ('anime', models.IntegerField(default=0)),
+                ('movie', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop, hints={'model_name': 'watchliststats'}),
+    ]
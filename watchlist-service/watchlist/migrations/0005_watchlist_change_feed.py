@@ -0,0 +1,63 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:40
+
+from django.db import migrations, models
+
+
+def backfill_change_seq(apps, schema_editor):
+    """Number existing entries 1..n per user, oldest update first."""
+    db = schema_editor.connection.alias
+    Watchlist = apps.get_model('watchlist', 'Watchlist')
+    WatchlistStats = apps.get_model('watchlist', 'WatchlistStats')
+    user_ids = Watchlist.objects.using(db).values_list('user_id', flat=True).distinct().order_by()
+    for user_id in list(user_ids):
+        entries = list(Watchlist.objects.using(db).filter(user_id=user_id).order_by('updated_at', 'id').only('id'))
+        for seq, entry in enumerate(entries, start=1):
+            entry.change_seq = seq
+        Watchlist.objects.using(db).bulk_update(entries, ['change_seq'], batch_size=1000)
+        WatchlistStats.objects.using(db).filter(user_id=user_id).update(change_seq=len(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0004_watchliststats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchlistTombstone',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('entry_id', models.UUIDField()),
+                ('user_id', models.CharField(max_length=255)),
+                ('media_id', models.CharField(max_length=255)),
+                ('media_type', models.CharField(choices=[('anime', 'Anime'), ('movie', 'Movie')], max_length=20)),
+                ('change_seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='watchlist',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='watchliststats',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='watchliststats',
+            name='purged_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(fields=['user_id', 'change_seq'], name='watchlist_user_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchlisttombstone',
+            index=models.Index(fields=['user_id', 'change_seq'], name='tombstone_user_change_idx'),
+        ),
+        migrations.RunPython(backfill_change_seq, migrations.RunPython.noop, hints={'model_name': 'watchlist'}),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.27 on 2026-10-17 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0005_watchlist_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchlistOutbox',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=255)),
+                ('event_type', models.CharField(max_length=40)),
+                ('change_seq', models.BigIntegerField()),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
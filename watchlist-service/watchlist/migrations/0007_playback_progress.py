@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-17 21:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0006_watchlist_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaybackProgress',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=255)),
+                ('media_id', models.CharField(max_length=255)),
+                ('media_type', models.CharField(choices=[('anime', 'Anime'), ('movie', 'Movie')], max_length=20)),
+                ('episode', models.CharField(blank=True, default='', max_length=255)),
+                ('position', models.FloatField()),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'updated_at'], name='progress_user_updated_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='playbackprogress',
+            constraint=models.UniqueConstraint(fields=('user_id', 'media_id', 'media_type', 'episode'), name='progress_unique_user_episode'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-17 21:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0007_playback_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('media_id', models.CharField(max_length=255)),
+                ('media_type', models.CharField(choices=[('anime', 'Anime'), ('movie', 'Movie')], max_length=20)),
+                ('title', models.CharField(max_length=512)),
+                ('poster_url', models.URLField(blank=True, null=True)),
+                ('score', models.FloatField(default=0)),
+                ('events', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['media_type', '-score'], name='trending_type_score_idx'), models.Index(fields=['-score'], name='trending_score_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='trendingscore',
+            constraint=models.UniqueConstraint(fields=('media_id', 'media_type'), name='trending_unique_media'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.27 on 2026-10-17 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watchlist', '0008_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardPlacement',
+            fields=[
+                ('user_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('shard', models.CharField(max_length=64)),
+                ('moving', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shard'], name='placement_shard_idx')],
+            },
+        ),
+    ]
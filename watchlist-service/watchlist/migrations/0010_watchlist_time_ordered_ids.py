@@ -0,0 +1,42 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+import watchlist.ids
+
+
+class AddIndexOnline(AddIndexConcurrently):
+    """CREATE INDEX CONCURRENTLY on PostgreSQL, so writes to the table go on; a plain AddIndex elsewhere."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('watchlist', '0009_shard_placement'),
+    ]
+
+    operations = [
+        # Only changes the default for new rows; rekey_watchlist converts existing ones
+        migrations.AlterField(
+            model_name='watchlist',
+            name='id',
+            field=models.UUIDField(default=watchlist.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        AddIndexOnline(
+            model_name='watchlist',
+            index=models.Index(fields=['user_id', 'id'], name='watchlist_user_id_idx'),
+        ),
+    ]
@@ -1,6 +1,20 @@
-import uuid
+from django.conf import settings
 from django.db import models
 
+from .ids import uuid7
+
+# Oldest first; lists are read in reverse. Once rekey_watchlist has given
+# every entry a time-ordered id, the id alone sorts like created_at.
+LIST_ORDER = ("id",) if settings.WATCHLIST_KEYSET_BY_ID else ("created_at", "id")
+
+
+class WatchlistQuerySet(models.QuerySet):
+    def for_user(self, user_id):
+        """Entries owned by `user_id`, most recent first."""
+        if not user_id:
+            return self.none()
+        return self.filter(user_id=str(user_id)).order_by(*(f"-{field}" for field in LIST_ORDER))
+
 
 class Watchlist(models.Model):
     class MediaType(models.TextChoices):
@@ -12,7 +26,8 @@ class Watchlist(models.Model):
         COMPLETED = "completed"
         PLANNED = "planned"
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Time-ordered, so inserts append to the primary key index
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     user_id = models.CharField(max_length=255, db_index=True)
     media_id = models.CharField(max_length=255)
     media_type = models.CharField(max_length=20, choices=MediaType.choices)
@@ -23,6 +38,173 @@ class Watchlist(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Per-user position in the change feed, assigned by watchlist.stats.apply_delta
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    objects = WatchlistQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the per-user keyset pagination in WatchlistCursorPagination
+            models.Index(fields=["user_id", "created_at", "id"], name="watchlist_user_created_idx"),
+            # The same with WATCHLIST_KEYSET_BY_ID
+            models.Index(fields=["user_id", "id"], name="watchlist_user_id_idx"),
+            models.Index(fields=["user_id", "change_seq"], name="watchlist_user_change_idx"),
+        ]
+        constraints = [
+            # One entry per title per user; also the conflict target of the batch upsert
+            models.UniqueConstraint(fields=["user_id", "media_id", "media_type"], name="watchlist_unique_user_media"),
+        ]
 
     def __str__(self):
         return f"{self.user_id} - {self.title} ({self.media_id})"
+
+
+class WatchlistStats(models.Model):
+    """Per-user counters of `Watchlist` rows, kept in step by watchlist.stats.
+
+    Updated in the same transaction as every watchlist write so the stats
+    endpoint is a single primary-key lookup however long the list is. The
+    row also hands out the user's change-feed sequence numbers: the row lock
+    taken by that update orders them the same way the writes commit.
+    """
+
+    user_id = models.CharField(max_length=255, primary_key=True)
+    total = models.IntegerField(default=0)
+    watching = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    planned = models.IntegerField(default=0)
+    anime = models.IntegerField(default=0)
+    movie = models.IntegerField(default=0)
+    change_seq = models.BigIntegerField(default=0)
+    # Highest sequence whose tombstones were purged; older cursors must resync
+    purged_seq = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.total} entries"
+
+
+class WatchlistTombstone(models.Model):
+    """Marker left by a deleted entry so delta-sync clients learn about it."""
+
+    id = models.BigAutoField(primary_key=True)
+    entry_id = models.UUIDField()
+    user_id = models.CharField(max_length=255)
+    media_id = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=20, choices=Watchlist.MediaType.choices)
+    change_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user_id", "change_seq"], name="tombstone_user_change_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - deleted {self.media_id} ({self.media_type})"
+
+
+class WatchlistOutbox(models.Model):
+    """Event waiting to be published, written in the same transaction as the change.
+
+    `relay_watchlist_outbox` publishes rows in `id` order and deletes them
+    once the publisher has acknowledged them.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    user_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=40)
+    change_seq = models.BigIntegerField()
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.event_type} #{self.change_seq}"
+
+
+class PlaybackProgress(models.Model):
+    """Last playback position of one episode (or movie) for one user.
+
+    Heartbeats are buffered and coalesced by watchlist.progress, which
+    upserts the newest position per key once per flush window. `updated_at`
+    is the time of that heartbeat, not of the write.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    user_id = models.CharField(max_length=255)
+    media_id = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=20, choices=Watchlist.MediaType.choices)
+    # Empty for movies
+    episode = models.CharField(max_length=255, blank=True, default="")
+    position = models.FloatField()
+    duration = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # "Continue watching": a user's most recently played first
+            models.Index(fields=["user_id", "updated_at"], name="progress_user_updated_idx"),
+        ]
+        constraints = [
+            # Conflict target of the flush upsert
+            models.UniqueConstraint(
+                fields=["user_id", "media_id", "media_type", "episode"], name="progress_unique_user_episode"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.media_id} {self.episode} @ {self.position:.0f}s"
+
+
+class TrendingScore(models.Model):
+    """Time-decayed watchlist activity of one title, for the trending shelves.
+
+    Kept by watchlist.trending with forward decay: an event at time t adds
+    `weight * 2 ** ((t - TRENDING_EPOCH) / half-life)`, so scores never have
+    to be decayed in place and ordering by `score` is the current ranking.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    media_id = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=20, choices=Watchlist.MediaType.choices)
+    title = models.CharField(max_length=512)
+    poster_url = models.URLField(blank=True, null=True)
+    score = models.FloatField(default=0)
+    events = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Top-K per media type, and overall, read straight off the index
+            models.Index(fields=["media_type", "-score"], name="trending_type_score_idx"),
+            models.Index(fields=["-score"], name="trending_score_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["media_id", "media_type"], name="trending_unique_media"),
+        ]
+
+    def __str__(self):
+        return f"{self.title} ({self.media_type}) - {self.events} events"
+
+
+class ShardPlacement(models.Model):
+    """Shard holding one user's rows, kept in "default" by watchlist.sharding.
+
+    Written by the user's first write (from the hash ring) and by
+    rebalance_shards, which sets `moving` while it copies the user's rows
+    and refuses their writes meanwhile.
+    """
+
+    user_id = models.CharField(max_length=255, primary_key=True)
+    shard = models.CharField(max_length=64)
+    moving = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["shard"], name="placement_shard_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.shard}{' (moving)' if self.moving else ''}"
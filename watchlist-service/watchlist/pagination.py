@@ -0,0 +1,123 @@
+import base64
+import binascii
+import json
+import uuid
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .ids import first_uuid7
+from .models import LIST_ORDER
+
+
+class WatchlistCursorPagination(BasePagination):
+    """Keyset pagination over `(created_at, id)`, or `id` alone (LIST_ORDER), newest first.
+
+    The cursor is an opaque token holding the position of the last (or first)
+    row of the current page, so every page is an index range scan on
+    `(user_id, created_at, id)` or `(user_id, id)` that costs the same as the
+    first one.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = settings.WATCHLIST_PAGE_SIZE
+    max_page_size = settings.WATCHLIST_MAX_PAGE_SIZE
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.GET.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            created_at = parse_datetime(data["t"])
+            if created_at is None:
+                raise ValueError(data["t"])
+            return created_at, uuid.UUID(data["id"]), bool(data.get("r"))
+        except (TypeError, KeyError, ValueError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, entry, reverse):
+        data = {"t": entry.created_at.isoformat(), "id": str(entry.id)}
+        if reverse:
+            data["r"] = 1
+        token = base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def page_queryset(self, queryset, request):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        self.has_cursor = cursor is not None
+        self.reverse = False
+
+        if cursor is not None and LIST_ORDER == ("id",):
+            created_at, pk, self.reverse = cursor
+            if pk.version != 7:
+                # Handed out before the entry was re-keyed; nearest time-ordered position
+                pk = first_uuid7(created_at)
+            queryset = queryset.filter(id__gt=pk) if self.reverse else queryset.filter(id__lt=pk)
+        elif cursor is not None:
+            created_at, pk, self.reverse = cursor
+            # The redundant created_at bound lets the database seek straight
+            # to the cursor instead of filtering from the start of the range.
+            if self.reverse:
+                queryset = queryset.filter(created_at__gte=created_at).filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(created_at__lte=created_at).filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+
+        ordering = LIST_ORDER if self.reverse else [f"-{field}" for field in LIST_ORDER]
+        return queryset.order_by(*ordering)[: self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.build_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.build_page([entry async for entry in self.page_queryset(queryset, request)])
+
+    def build_page(self, rows):
+        has_more = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.has_cursor, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.has_cursor
+        return self.page
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_data(self, data):
+        return {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
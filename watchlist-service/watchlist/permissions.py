@@ -8,3 +8,10 @@ class IsOwner(permissions.BasePermission):
         # obj.user_id is stored as string
         user_id = getattr(request.user, 'id', None)
         return user_id is not None and str(obj.user_id) == str(user_id)
+
+
+class HasUserId(permissions.BasePermission):
+    """Only allow requests whose token named a user (JWT users have no `is_authenticated`)."""
+
+    def has_permission(self, request, view):
+        return getattr(request.user, 'id', None) is not None
@@ -0,0 +1,285 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, connections
+
+from . import sharding
+from .metrics import PLAYBACK_HEARTBEATS, PLAYBACK_ROWS_WRITTEN, PLAYBACK_WRITE_DURATION
+from .models import PlaybackProgress
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ["media_id", "media_type", "episode", "position", "duration", "updated_at"]
+
+# Only moves a row forward in time, so flushers in different workers may
+# write the same key in any order.
+UPSERT = """
+    INSERT INTO {table} (user_id, media_id, media_type, episode, position, duration, updated_at)
+    VALUES {values}
+    ON CONFLICT (user_id, media_id, media_type, episode) DO UPDATE
+    SET position = EXCLUDED.position, duration = EXCLUDED.duration, updated_at = EXCLUDED.updated_at
+    WHERE {table}.updated_at < EXCLUDED.updated_at
+"""
+
+
+def progress_key(media_id, media_type, episode):
+    return f"{media_type}\x1f{media_id}\x1f{episode}"
+
+
+class LocalProgressBuffer:
+    """Per-process buffer: the newest record of each (user, key) and the keys not yet written.
+
+    Records stay readable until they are written, then are dropped unless
+    a newer heartbeat replaced them in the meantime.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        # Insertion-ordered set of (user_id, key)
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    def put(self, user_id, key, record):
+        with self._lock:
+            self._entries.setdefault(user_id, {})[key] = record
+            self._dirty[(user_id, key)] = None
+
+    def get(self, user_id):
+        with self._lock:
+            return dict(self._entries.get(user_id, {}))
+
+    def take(self, limit):
+        with self._lock:
+            pending = list(islice(self._dirty, limit))
+            for item in pending:
+                del self._dirty[item]
+            return [(user_id, key, self._entries[user_id][key]) for user_id, key in pending]
+
+    def written(self, taken):
+        with self._lock:
+            for user_id, key, record in taken:
+                entries = self._entries.get(user_id)
+                # A newer heartbeat is a new record object, still to be written
+                if entries is not None and entries.get(key) is record:
+                    del entries[key]
+                    if not entries:
+                        del self._entries[user_id]
+
+    def failed(self, taken):
+        with self._lock:
+            for user_id, key, record in taken:
+                self._dirty.setdefault((user_id, key), None)
+
+
+class RedisProgressBuffer:
+    """Buffer shared by all workers: a hash of records per user and a set of keys not yet written.
+
+    The hashes are not cleared by a flush; they expire `ttl` seconds after
+    the user's last heartbeat, so reads never miss a write still in flight.
+    A worker that dies between taking keys and writing them loses those
+    positions, which the next heartbeat replaces.
+    """
+
+    dirty_key = "watchlist:progress:dirty"
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def user_key(self, user_id):
+        return f"watchlist:progress:user:{user_id}"
+
+    def put(self, user_id, key, record):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(self.user_key(user_id), key, json.dumps(record))
+        pipe.expire(self.user_key(user_id), self.ttl)
+        pipe.sadd(self.dirty_key, f"{user_id}\x1f{key}")
+        pipe.execute()
+
+    def get(self, user_id):
+        return {key.decode(): json.loads(value) for key, value in self.client.hgetall(self.user_key(user_id)).items()}
+
+    def take(self, limit):
+        # SPOP hands each key to exactly one flusher
+        members = self.client.spop(self.dirty_key, limit)
+        if not members:
+            return []
+        pending = [member.decode().split("\x1f", 1) for member in members]
+        pipe = self.client.pipeline(transaction=False)
+        for user_id, key in pending:
+            pipe.hget(self.user_key(user_id), key)
+        return [
+            (user_id, key, json.loads(value))
+            for (user_id, key), value in zip(pending, pipe.execute())
+            if value is not None
+        ]
+
+    def written(self, taken):
+        pass
+
+    def failed(self, taken):
+        if taken:
+            self.client.sadd(self.dirty_key, *(f"{user_id}\x1f{key}" for user_id, key, record in taken))
+
+
+class PlaybackProgressStore:
+    """Coalesces playback heartbeats into one row write per key per flush window.
+
+    `record()` only updates the buffer. A flusher thread in each process
+    upserts the keys changed since its last pass every `interval` seconds,
+    `batch_size` rows per statement, however often the player reported in
+    between. Reads merge the buffer over the table. With `interval` 0 each
+    heartbeat is written straight through instead.
+    """
+
+    def __init__(self, buffer, interval, batch_size):
+        self.buffer = buffer
+        self.interval = interval
+        self.batch_size = batch_size
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+
+    def record(self, user_id, media_id, media_type, episode, position, duration=None):
+        PLAYBACK_HEARTBEATS.inc()
+        record = {
+            "media_id": media_id,
+            "media_type": media_type,
+            "episode": episode,
+            "position": position,
+            "duration": duration,
+            "updated_at": time.time(),
+        }
+        if not self.interval:
+            self.write([(user_id, record)], sharding.shard_for(user_id, write=True))
+            return
+        self.buffer.put(user_id, progress_key(media_id, media_type, episode), record)
+        self.start_flusher()
+
+    def start_flusher(self):
+        # Started by the first heartbeat, so each forked worker gets its own
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            threading.Thread(target=self.run, name="playback-progress-flusher", daemon=True).start()
+            atexit.register(self.flush_at_exit)
+            self._flusher_pid = pid
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing playback progress failed; retrying next window")
+            finally:
+                close_old_connections()
+
+    def flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing playback progress at exit failed")
+
+    def flush(self):
+        """Write every buffered change; returns the number of rows written."""
+        total = 0
+        while True:
+            taken = self.buffer.take(self.batch_size)
+            if not taken:
+                return total
+            try:
+                placements = sharding.shards_for([user_id for user_id, key, record in taken], write=True)
+            except BaseException:
+                self.buffer.failed(taken)
+                raise
+            groups, moving = {}, []
+            for item in taken:
+                shard, is_moving = placements[item[0]]
+                # Users being moved to another shard are written after the move
+                (moving if is_moving else groups.setdefault(shard, [])).append(item)
+            pending = list(groups.items())
+            for index, (shard, items) in enumerate(pending):
+                rows = [(user_id, record) for user_id, key, record in items]
+                try:
+                    self.write(rows, shard)
+                    total += len(rows)
+                except (DataError, IntegrityError):
+                    # Retrying would fail the same way; keep the rows that can be written
+                    total += self.write_each(rows, shard)
+                except BaseException:
+                    self.buffer.failed([*items, *moving, *(item for _, rest in pending[index + 1 :] for item in rest)])
+                    raise
+                self.buffer.written(items)
+            self.buffer.failed(moving)
+            if len(taken) < self.batch_size or len(moving) == len(taken):
+                return total
+
+    def write(self, rows, using):
+        """Upsert `(user_id, record)` pairs of users on shard `using` in one statement; keys must be distinct."""
+        connection = connections[using]
+        table = connection.ops.quote_name(PlaybackProgress._meta.db_table)
+        placeholders = "(%s, %s, %s, %s, %s, %s, %s)"
+        params = []
+        for user_id, record in rows:
+            updated_at = datetime.fromtimestamp(record["updated_at"], timezone.utc)
+            params += [user_id, *(record[field] for field in FIELDS[:-1])]
+            params.append(connection.ops.adapt_datetimefield_value(updated_at))
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(UPSERT.format(table=table, values=", ".join([placeholders] * len(rows))), params)
+        PLAYBACK_WRITE_DURATION.observe(time.perf_counter() - started)
+        PLAYBACK_ROWS_WRITTEN.inc(len(rows))
+
+    def write_each(self, rows, using):
+        written = 0
+        for user_id, record in rows:
+            try:
+                self.write([(user_id, record)], using)
+                written += 1
+            except (DataError, IntegrityError):
+                logger.exception("Dropped playback progress of %s: %r", user_id, record)
+        return written
+
+    def get(self, user_id, media_id=None, media_type=None, limit=None):
+        """The user's progress, most recently played first, with buffered heartbeats applied.
+
+        Either the newest `limit` episodes, or every episode of one title.
+        """
+        rows = PlaybackProgress.objects.filter(user_id=user_id)
+        if media_id is not None:
+            rows = rows.filter(media_id=media_id, media_type=media_type)
+        rows = rows.order_by("-updated_at").values_list(*FIELDS)[:limit]
+        merged = {}
+        for row in rows:
+            record = dict(zip(FIELDS, row))
+            record["updated_at"] = record["updated_at"].timestamp()
+            merged[progress_key(record["media_id"], record["media_type"], record["episode"])] = record
+        for key, record in self.buffer.get(user_id).items():
+            if media_id is not None and (record["media_id"], record["media_type"]) != (media_id, media_type):
+                continue
+            current = merged.get(key)
+            if current is None or current["updated_at"] < record["updated_at"]:
+                merged[key] = record
+        ordered = sorted(merged.values(), key=lambda record: record["updated_at"], reverse=True)[:limit]
+        return [
+            {**record, "updated_at": datetime.fromtimestamp(record["updated_at"], timezone.utc)} for record in ordered
+        ]
+
+
+playback_progress = PlaybackProgressStore(
+    RedisProgressBuffer(settings.REDIS_URL, settings.PLAYBACK_BUFFER_TTL) if settings.REDIS_URL else LocalProgressBuffer(),
+    interval=settings.PLAYBACK_FLUSH_INTERVAL,
+    batch_size=settings.PLAYBACK_FLUSH_BATCH_SIZE,
+)
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+class PublishError(Exception):
+    pass
+
+
+class BasePublisher:
+    """Sends outbox events to a broker.
+
+    `publish` may buffer; `flush` must block until every message published
+    since the last flush is acknowledged, and raise PublishError otherwise.
+    The relay only deletes outbox rows after a successful flush.
+    """
+
+    def publish(self, topic, key, value):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class KafkaPublisher(BasePublisher):
+    """Idempotent Kafka producer keyed by user id, so each user's events stay ordered."""
+
+    def __init__(self):
+        try:
+            from confluent_kafka import Producer
+        except ImportError as exc:
+            raise ImproperlyConfigured("KafkaPublisher requires the confluent-kafka package") from exc
+        if not settings.KAFKA_BROKERS:
+            raise ImproperlyConfigured("KAFKA_BROKERS is required")
+        self.producer = Producer({
+            "bootstrap.servers": settings.KAFKA_BROKERS,
+            "client.id": "watchlist-service",
+            "enable.idempotence": True,
+            "acks": "all",
+            "linger.ms": 5,
+        })
+        self.errors = []
+
+    def on_delivery(self, err, msg):
+        if err is not None:
+            self.errors.append(err)
+
+    def publish(self, topic, key, value):
+        while True:
+            try:
+                self.producer.produce(topic, key=key, value=value, on_delivery=self.on_delivery)
+                return
+            except BufferError:
+                # Local queue is full: serve delivery reports to make room
+                self.producer.poll(0.1)
+
+    def flush(self):
+        remaining = self.producer.flush(settings.WATCHLIST_OUTBOX_PUBLISH_TIMEOUT)
+        errors, self.errors = self.errors, []
+        if remaining or errors:
+            raise PublishError(f"{remaining} messages unacknowledged, {len(errors)} failed: {errors[:1]}")
+
+    def close(self):
+        self.producer.flush(settings.WATCHLIST_OUTBOX_PUBLISH_TIMEOUT)
+
+
+class MemoryPublisher(BasePublisher):
+    """Keeps published messages in `messages`; for tests and local development."""
+
+    messages = []
+    _lock = threading.Lock()
+
+    def publish(self, topic, key, value):
+        with self._lock:
+            self.messages.append((topic, key, value))
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls.messages.clear()
+
+
+class FilePublisher(BasePublisher):
+    """Appends one JSON line per message to WATCHLIST_OUTBOX_FILE."""
+
+    def __init__(self):
+        self.file = open(settings.WATCHLIST_OUTBOX_FILE, "a", encoding="utf-8")
+
+    def publish(self, topic, key, value):
+        line = {"topic": topic, "key": key, "value": json.loads(value)}
+        self.file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def get_publisher():
+    return import_string(settings.WATCHLIST_OUTBOX_PUBLISHER)()
@@ -1,5 +1,12 @@
+import math
+
+from django.conf import settings
+from django.db import IntegrityError
 from rest_framework import serializers
-from .models import Watchlist
+from .models import Watchlist, WatchlistStats, WatchlistTombstone
+from .services import create_entry, update_entry
+
+DUPLICATE_ENTRY_ERROR = "This title is already in the watchlist."
 
 
 class WatchlistSerializer(serializers.ModelSerializer):
@@ -10,4 +17,107 @@ class WatchlistSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         # user_id will be set in the view's perform_create
-        return super().create(validated_data)
+        user_id = validated_data.pop("user_id")
+        try:
+            return create_entry(user_id, validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError(DUPLICATE_ENTRY_ERROR)
+
+    def update(self, instance, validated_data):
+        try:
+            return update_entry(instance, validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError(DUPLICATE_ENTRY_ERROR)
+
+
+class WatchlistBatchOperationSerializer(serializers.Serializer):
+    """One operation of a batch request, addressed by (media_id, media_type)."""
+
+    op = serializers.ChoiceField(choices=["add", "update", "remove"])
+    media_id = serializers.CharField(max_length=255)
+    media_type = serializers.ChoiceField(choices=Watchlist.MediaType.choices)
+    title = serializers.CharField(max_length=512, required=False)
+    poster_url = serializers.URLField(required=False, allow_null=True, allow_blank=True)
+    status = serializers.ChoiceField(choices=Watchlist.Status.choices, required=False)
+
+    def validate(self, attrs):
+        if attrs["op"] == "add" and "title" not in attrs:
+            raise serializers.ValidationError({"title": ["This field is required."]})
+        if attrs["op"] == "update" and "status" not in attrs:
+            raise serializers.ValidationError({"status": ["This field is required."]})
+        return attrs
+
+
+class WatchlistBatchSerializer(serializers.Serializer):
+    # Items are validated one by one in watchlist.batch so that a bad item
+    # only fails itself instead of the whole batch.
+    operations = serializers.ListField(allow_empty=False, max_length=settings.WATCHLIST_BATCH_MAX_OPERATIONS)
+
+
+class WatchlistMembershipItemSerializer(serializers.Serializer):
+    media_id = serializers.CharField(max_length=255)
+    media_type = serializers.ChoiceField(choices=Watchlist.MediaType.choices)
+
+
+class WatchlistMembershipSerializer(serializers.Serializer):
+    items = serializers.ListField(
+        child=WatchlistMembershipItemSerializer(), allow_empty=False, max_length=settings.WATCHLIST_MEMBERSHIP_MAX_ITEMS
+    )
+
+
+class WatchlistStatsSerializer(serializers.ModelSerializer):
+    by_status = serializers.SerializerMethodField()
+    by_media_type = serializers.SerializerMethodField()
+
+    class Meta:
+        model = WatchlistStats
+        fields = ['total', 'by_status', 'by_media_type']
+
+    def get_by_status(self, obj):
+        return {status: getattr(obj, status) for status in Watchlist.Status.values}
+
+    def get_by_media_type(self, obj):
+        return {media_type: getattr(obj, media_type) for media_type in Watchlist.MediaType.values}
+
+
+class WatchlistTombstoneSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(source='entry_id')
+
+    class Meta:
+        model = WatchlistTombstone
+        fields = ['id', 'media_id', 'media_type', 'deleted_at']
+
+
+class PlaybackHeartbeatSerializer(serializers.Serializer):
+    media_id = serializers.CharField(max_length=255)
+    media_type = serializers.ChoiceField(choices=Watchlist.MediaType.choices)
+    # Omitted for movies
+    episode = serializers.CharField(max_length=255, required=False, allow_blank=True, default="")
+    position = serializers.FloatField(min_value=0)
+    duration = serializers.FloatField(min_value=0, required=False, allow_null=True, default=None)
+
+    def validate(self, attrs):
+        # FloatField lets "nan" and "inf" through
+        for field in ("position", "duration"):
+            if attrs[field] is not None and not math.isfinite(attrs[field]):
+                raise serializers.ValidationError({field: ["A finite number is required."]})
+        return attrs
+
+
+class PlaybackProgressSerializer(PlaybackHeartbeatSerializer):
+    updated_at = serializers.DateTimeField()
+
+
+class TrendingQuerySerializer(serializers.Serializer):
+    media_type = serializers.ChoiceField(choices=Watchlist.MediaType.choices, required=False)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.TRENDING_MAX_PAGE_SIZE, default=settings.TRENDING_PAGE_SIZE
+    )
+
+
+class TrendingScoreSerializer(serializers.Serializer):
+    media_id = serializers.CharField()
+    media_type = serializers.CharField()
+    title = serializers.CharField()
+    poster_url = serializers.CharField(allow_null=True)
+    score = serializers.FloatField()
@@ -0,0 +1,54 @@
+from functools import partial
+
+from django.db import transaction
+
+from . import events, sharding, stats, trending
+from .cache import watchlist_cache
+from .models import Watchlist, WatchlistTombstone
+
+# Every single-entry write goes through these functions so that side
+# effects (per-user stats, change-feed sequence and tombstones, outbox
+# events, cache invalidation) commit together with the row, in the user's
+# shard; trending scores follow right after commit.
+
+
+def create_entry(user_id, data):
+    user_id = str(user_id)
+    with sharding.use_user(user_id, write=True) as db, transaction.atomic(using=db):
+        entry = Watchlist(user_id=user_id, **data)
+        entry.change_seq = stats.apply_delta(user_id, stats.entry_delta(entry))
+        entry.save(force_insert=True)
+        events.record([events.entry_event(events.ENTRY_ADDED, entry)])
+        trending.record([(entry, trending.ADD_WEIGHT)], using=db)
+        transaction.on_commit(partial(watchlist_cache.bump, user_id), using=db)
+    return entry
+
+
+def update_entry(entry, data):
+    with sharding.use_user(entry.user_id, write=True) as db, transaction.atomic(using=db):
+        delta = stats.entry_delta(entry, -1)
+        previous = entry.status
+        for attr, value in data.items():
+            setattr(entry, attr, value)
+        delta.update(stats.entry_delta(entry))
+        entry.change_seq = stats.apply_delta(entry.user_id, delta)
+        entry.save()
+        events.record([events.entry_event(events.ENTRY_UPDATED, entry)])
+        trending.record([(entry, trending.status_weight(previous, entry.status))], using=db)
+        transaction.on_commit(partial(watchlist_cache.bump, entry.user_id), using=db)
+    return entry
+
+
+def delete_entry(entry):
+    with sharding.use_user(entry.user_id, write=True) as db, transaction.atomic(using=db):
+        entry.change_seq = stats.apply_delta(entry.user_id, stats.entry_delta(entry, -1))
+        WatchlistTombstone.objects.create(
+            entry_id=entry.id,
+            user_id=entry.user_id,
+            media_id=entry.media_id,
+            media_type=entry.media_type,
+            change_seq=entry.change_seq,
+        )
+        events.record([events.entry_event(events.ENTRY_REMOVED, entry)])
+        entry.delete()
+        transaction.on_commit(partial(watchlist_cache.bump, entry.user_id), using=db)
@@ -0,0 +1,245 @@
+import bisect
+import hashlib
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import exceptions, status
+
+from service_common import replicas
+from .cache import LocalLRUCache
+from .models import ShardPlacement
+
+# Per-user tables, stored on the user's shard. The rest of the app
+# (trending scores, the shard directory) stays in "default".
+SHARDED_MODELS = {"watchlist", "watchliststats", "watchlisttombstone", "watchlistoutbox", "playbackprogress"}
+SHARDS = settings.WATCHLIST_SHARDS
+# Points per shard on the ring; more points even out the share each shard gets
+VNODES = 128
+
+
+class ShardNotSelected(RuntimeError):
+    """A per-user table was queried with no user selected and no explicit `.using()`."""
+
+
+class UserMoving(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "This watchlist is being moved to another database, try again shortly."
+    default_code = "user_moving"
+
+    def __init__(self):
+        super().__init__()
+        # Sent as Retry-After
+        self.wait = max(1, math.ceil(settings.WATCHLIST_SHARD_DIRECTORY_TTL))
+
+
+def hash_key(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of user ids onto shards.
+
+    Each shard owns VNODES points on a 64-bit ring and a user belongs to
+    the first point at or after the hash of their id, so adding a shard to
+    N others only takes over about 1/(N+1) of the users.
+    """
+
+    def __init__(self, shards, vnodes=VNODES):
+        points = sorted((hash_key(f"{shard}#{i}"), shard) for shard in shards for i in range(vnodes))
+        self.points = [point for point, shard in points]
+        self.shards = [shard for point, shard in points]
+
+    def get(self, user_id):
+        return self.shards[bisect.bisect(self.points, hash_key(str(user_id))) % len(self.points)]
+
+
+class ShardDirectory:
+    """Where each user's rows live, from the ShardPlacement table in "default".
+
+    A user is placed on the ring by their first write and stays on that
+    shard until rebalance_shards moves them, so changing the ring only
+    affects new users. Lookups are cached per process for `ttl` seconds;
+    users with no placement have no rows and read from their ring shard.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.cache = LocalLRUCache(max_entries)
+
+    def remember(self, placements):
+        expires_at = time.time() + self.ttl
+        for user_id, placement in placements.items():
+            # An empty shard marks a user with no placement
+            self.cache.set(user_id, placement or ("", False), expires_at=expires_at)
+
+    def lookup(self, user_ids):
+        """`{user_id: (shard, moving)}`, or None for users that were never placed."""
+        found, missing = {}, []
+        for user_id in user_ids:
+            placement = self.cache.get(user_id)
+            if placement is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = placement if placement[0] else None
+        if missing:
+            fetched = dict.fromkeys(missing)
+            rows = ShardPlacement.objects.filter(user_id__in=missing).values_list("user_id", "shard", "moving")
+            fetched.update((user_id, (shard, moving)) for user_id, shard, moving in rows)
+            self.remember(fetched)
+            found.update(fetched)
+        return found
+
+    async def alookup(self, user_id):
+        placement = self.cache.get(user_id)
+        if placement is None:
+            row = await ShardPlacement.objects.filter(user_id=user_id).values_list("shard", "moving").afirst()
+            self.remember({user_id: row})
+            return row
+        return placement if placement[0] else None
+
+    def place(self, user_ids):
+        """Place users that have no placement yet on their ring shard; returns every user's placement."""
+        ShardPlacement.objects.bulk_create(
+            [ShardPlacement(user_id=user_id, shard=ring.get(user_id)) for user_id in user_ids], ignore_conflicts=True
+        )
+        # Re-read: another process may have placed some of them first
+        placements = dict.fromkeys(user_ids)
+        rows = ShardPlacement.objects.filter(user_id__in=user_ids).values_list("user_id", "shard", "moving")
+        placements.update((user_id, (shard, moving)) for user_id, shard, moving in rows)
+        self.remember(placements)
+        return placements
+
+    def forget(self, user_ids):
+        for user_id in user_ids:
+            self.cache.delete(user_id)
+
+
+ring = HashRing(settings.WATCHLIST_SHARD_RING)
+directory = ShardDirectory(settings.WATCHLIST_SHARD_DIRECTORY_TTL, settings.WATCHLIST_SHARD_DIRECTORY_ENTRIES)
+
+
+def shards_for(user_ids, write=False):
+    """`{user_id: (shard, moving)}` for each user.
+
+    With `write`, users that were never placed are placed on the ring
+    first, since they are about to get rows.
+    """
+    user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+    if len(SHARDS) == 1:
+        return dict.fromkeys(user_ids, (SHARDS[0], False))
+    placements = directory.lookup(user_ids)
+    unplaced = [user_id for user_id, placement in placements.items() if placement is None]
+    if unplaced and write:
+        placements.update(directory.place(unplaced))
+    return {user_id: placement or (ring.get(user_id), False) for user_id, placement in placements.items()}
+
+
+def shard_for(user_id, write=False):
+    """Database holding `user_id`'s rows; writes raise UserMoving while the user is being moved."""
+    shard, moving = shards_for([user_id], write)[str(user_id)]
+    if moving and write:
+        raise UserMoving()
+    return shard
+
+
+_current = ContextVar("watchlist_shard", default=None)
+
+
+def select_user(user_id):
+    """Route per-user tables to `user_id`'s shard for the rest of the request."""
+    _current.set(shard_for(user_id))
+
+
+async def aselect_user(user_id):
+    user_id = str(user_id)
+    if len(SHARDS) == 1:
+        placement = (SHARDS[0], False)
+    else:
+        placement = await directory.alookup(user_id)
+    _current.set(placement[0] if placement else ring.get(user_id))
+
+
+@contextmanager
+def use_user(user_id, write=False):
+    """Route per-user tables to `user_id`'s shard inside the block; yields the shard alias."""
+    token = _current.set(shard_for(user_id, write))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def current_shard():
+    shard = _current.get()
+    if shard is not None:
+        return shard
+    if len(SHARDS) == 1:
+        return SHARDS[0]
+    raise ShardNotSelected("No user selected; wrap the query in sharding.use_user() or pass .using(shard)")
+
+
+def is_sharded(model):
+    return model._meta.app_label == "watchlist" and model._meta.model_name in SHARDED_MODELS
+
+
+class ShardRouter:
+    """Sends per-user tables to the selected user's shard and everything else to "default".
+
+    Reads may go to a replica of that database instead (service_common.replicas).
+    """
+
+    def db_for_read(self, model, **hints):
+        # Placements change under rebalance_shards, which waits only for the directory TTL
+        if model is ShardPlacement:
+            return DEFAULT_DB_ALIAS
+        return replicas.db_for_read(self.db_for_write(model, **hints))
+
+    def db_for_write(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return replicas.primary_of(instance._state.db)
+        return current_shard()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return replicas.primary_of(obj1._state.db) == replicas.primary_of(obj2._state.db)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == "watchlist" and model_name in SHARDED_MODELS:
+            return db in SHARDS
+        return db == DEFAULT_DB_ALIAS
+
+
+class ShardMiddleware:
+    """Clears the selected shard after each request, so a worker thread never reuses it."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _current.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
+
+    async def __acall__(self, request):
+        token = _current.set(None)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,79 @@
+from collections import Counter
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Watchlist, WatchlistStats
+
+COUNTER_FIELDS = ["total", *Watchlist.Status.values, *Watchlist.MediaType.values]
+
+
+def entry_delta(entry, sign=1):
+    """Counter changes contributed by one entry (sign=-1 to remove it)."""
+    return Counter({"total": sign, entry.status: sign, entry.media_type: sign})
+
+
+def lock_user(user_id):
+    """Lock the user's stats row, creating it if needed, until the transaction ends.
+
+    Every write for the user takes this lock (apply_delta updates the row),
+    so after it no other write can add or remove the user's entries. Call
+    inside the write's transaction, before reading the rows it changes.
+    """
+    user_id = str(user_id)
+    rows = WatchlistStats.objects.select_for_update().filter(user_id=user_id)
+    if rows.values_list("user_id"):
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(WatchlistStats)):
+            WatchlistStats.objects.create(user_id=user_id)
+    except IntegrityError:
+        # Created concurrently by another write for the same user; wait for it
+        list(rows.values_list("user_id"))
+
+
+def apply_delta(user_id, delta, changes=1):
+    """Add `delta` to the user's counters and reserve `changes` feed sequence numbers.
+
+    Call inside the write's transaction. Returns the first reserved sequence
+    number; the rest follow consecutively.
+    """
+    user_id = str(user_id)
+    updates = {field: F(field) + n for field, n in delta.items() if n}
+    updates["change_seq"] = F("change_seq") + changes
+    rows = WatchlistStats.objects.filter(user_id=user_id)
+    if not rows.update(updated_at=timezone.now(), **updates):
+        try:
+            with transaction.atomic(using=router.db_for_write(WatchlistStats)):
+                WatchlistStats.objects.create(
+                    user_id=user_id, change_seq=changes, **{field: n for field, n in delta.items() if n}
+                )
+        except IntegrityError:
+            # Created concurrently by another write for the same user
+            rows.update(updated_at=timezone.now(), **updates)
+    return rows.values_list("change_seq", flat=True).get() - changes + 1
+
+
+def get_stats(user_id):
+    try:
+        return WatchlistStats.objects.get(user_id=str(user_id))
+    except WatchlistStats.DoesNotExist:
+        return WatchlistStats(user_id=str(user_id))
+
+
+async def aget_stats(user_id):
+    try:
+        return await WatchlistStats.objects.aget(user_id=str(user_id))
+    except WatchlistStats.DoesNotExist:
+        return WatchlistStats(user_id=str(user_id))
+
+
+def count_entries(queryset):
+    """Recompute counters from `Watchlist` rows, as `{user_id: Counter}`."""
+    counts = {}
+    rows = queryset.values("user_id", "status", "media_type").annotate(n=Count("id")).order_by()
+    for row in rows.iterator():
+        counter = counts.setdefault(row["user_id"], Counter())
+        counter.update({"total": row["n"], row["status"]: row["n"], row["media_type"]: row["n"]})
+    return counts
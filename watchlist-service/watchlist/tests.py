@@ -0,0 +1,1360 @@
+import base64
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock, skipUnless
+
+import jwt
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.core.signals import setting_changed
+from django.db import OperationalError, connections, transaction
+from django.db.models import QuerySet
+from django.dispatch import receiver
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.client import ClientHandler
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve
+from prometheus_client import REGISTRY
+from rest_framework.renderers import JSONRenderer
+
+from service_common import admission, profiling, replicas
+from service_common.profiling import ProfileStore, Sampler, sign_token
+from service_common.rows import RowSerializer
+
+from . import trending, urls
+from .async_views import AsyncWatchlistListView
+from .authentication import token_cache
+from .batch import apply_batch
+from .cache import watchlist_cache
+from .changes import CursorExpired, encode_cursor
+from .events import ENTRY_REKEYED
+from .ids import first_uuid7, uuid7
+from .management.commands.rebalance_shards import COPIED_MODELS
+from .management.commands.rebalance_shards import Command as RebalanceCommand
+from .models import (
+    PlaybackProgress,
+    ShardPlacement,
+    TrendingScore,
+    Watchlist,
+    WatchlistOutbox,
+    WatchlistStats,
+    WatchlistTombstone,
+)
+from .progress import LocalProgressBuffer, PlaybackProgressStore
+from .publishers import MemoryPublisher, PublishError
+from .services import create_entry, delete_entry, update_entry
+from .serializers import WatchlistSerializer
+from .sharding import SHARDS, HashRing, directory, shard_for, use_user
+from .stats import COUNTER_FIELDS, apply_delta, count_entries
+
+TEST_KEYS = {"test": "test-secret"}
+# Stands in for the Redis instance every worker shares
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "watchlist": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "watchlist-tests"},
+}
+MB = 1024 * 1024
+
+
+@receiver(setting_changed)
+def reload_urls(setting, **kwargs):
+    # watchlist.urls picks the sync or async views when it is imported, and
+    # the root URLconf keeps the resolver that has read its patterns
+    if setting == "WATCHLIST_ASYNC_VIEWS":
+        importlib.reload(urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+
+class ShardedTestCase(TestCase):
+    # The per-user tables are on every shard when run with several
+    databases = "__all__"
+
+
+def token_for(user_id):
+    return jwt.encode({"user_id": user_id}, TEST_KEYS["test"], algorithm="HS256", headers={"kid": "test"})
+
+
+def auth_headers(user_id):
+    return {"HTTP_AUTHORIZATION": f"Bearer {token_for(user_id)}"}
+
+
+def add_entries(user_id, count, title="Title"):
+    with use_user(user_id, write=True):
+        Watchlist.objects.bulk_create(
+            Watchlist(user_id=user_id, media_id=str(i), media_type="anime", title=f"{title} {i}")
+            for i in range(count)
+        )
+
+
+async def aread(streaming_content):
+    """`(lines, bytes)` of a response streamed by the async views."""
+    lines = size = 0
+    async for chunk in streaming_content:
+        lines += chunk.count(b"\n")
+        size += len(chunk)
+    return lines, size
+
+
+def counters(user_id):
+    """`(stored stats counters, counters recomputed from the entries)` of `user_id`."""
+    with use_user(user_id):
+        stored = WatchlistStats.objects.filter(user_id=user_id).values(*COUNTER_FIELDS).first() or {}
+        counted = count_entries(Watchlist.objects.filter(user_id=user_id)).get(user_id, {})
+    return (
+        {field: stored.get(field, 0) for field in COUNTER_FIELDS},
+        {field: counted.get(field, 0) for field in COUNTER_FIELDS},
+    )
+
+
+def peak_memory(run):
+    """`(result of run(), peak bytes allocated while it ran)`."""
+    tracemalloc.start()
+    try:
+        result = run()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@override_settings(JWT_KEYS=TEST_KEYS, SLOW_REQUEST_MS=60_000)
+class TransferMemoryTests(TransactionTestCase):
+    """Export and import hold a chunk or batch of rows at a time, never the whole list.
+
+    Each batch commits, as in production; inside a TestCase the trending
+    updates queued for commit would pile up and count against the import.
+    """
+
+    databases = "__all__"
+
+    rows = 8_000
+    # Long enough titles that the whole list dwarfs one chunk or batch
+    title = "A title long enough to make each row weigh a few hundred bytes " * 5
+
+    def export(self, user_id, name):
+        response = self.client.get(f"/api/watchlist/export/?type={name}", **auth_headers(user_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        def consume():
+            if response.is_async:
+                return async_to_sync(aread)(response.streaming_content)
+            lines = size = 0
+            for chunk in response.streaming_content:
+                lines += chunk.count(b"\n")
+                size += len(chunk)
+            return lines, size
+
+        (lines, size), peak = peak_memory(consume)
+        return lines, size, peak
+
+    @override_settings(WATCHLIST_EXPORT_CHUNK_SIZE=200)
+    def test_export_streams_in_chunks(self):
+        add_entries("export-user", self.rows, self.title)
+        for name, header in (("ndjson", 0), ("csv", 1)):
+            with self.subTest(name):
+                lines, size, peak = self.export("export-user", name)
+                self.assertEqual(lines, self.rows + header)
+                self.assertGreater(size, 2 * MB)
+                self.assertLess(peak, size / 5)
+
+    def import_upload(self, user_id, rows):
+        """`(summary, upload size, peak bytes)` of importing `rows` entries through the whole stack."""
+        body = b"".join(
+            json.dumps({"media_id": str(i), "media_type": "anime", "title": f"{self.title} {i}"}).encode() + b"\n"
+            for i in range(rows)
+        )
+        # Built before tracing starts, so the upload itself is not counted
+        request = RequestFactory().post(
+            "/api/watchlist/import/", body, content_type="application/x-ndjson", **auth_headers(user_id)
+        )
+        handler = ClientHandler()
+        handler.load_middleware()
+        response, peak = peak_memory(lambda: handler.get_response(request))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content), len(body), peak
+
+    @override_settings(WATCHLIST_IMPORT_BATCH_SIZE=100)
+    def test_import_reads_a_batch_at_a_time(self):
+        # A batch costs the same whatever the upload size, so the peak must
+        # not grow with it
+        small, _, small_peak = self.import_upload("import-small", self.rows // 8)
+        large, size, large_peak = self.import_upload("import-large", self.rows // 2)
+
+        self.assertEqual(small["created"], self.rows // 8)
+        self.assertEqual(large["created"], self.rows // 2)
+        self.assertGreater(size, MB)
+        self.assertLess(large_peak, small_peak * 1.5)
+        with use_user("import-large"):
+            self.assertEqual(Watchlist.objects.filter(user_id="import-large").count(), self.rows // 2)
+
+
+@override_settings(JWT_KEYS=TEST_KEYS)
+class AuthenticationTests(ShardedTestCase):
+    def setUp(self):
+        token_cache.clear()
+
+    def lookups(self, result):
+        return REGISTRY.get_sample_value("jwt_token_cache_lookups_total", {"result": result}) or 0
+
+    def test_unknown_key_id_is_rejected(self):
+        token = jwt.encode({"user_id": "auth-user"}, "other-secret", algorithm="HS256", headers={"kid": "retired"})
+        response = self.client.get("/api/watchlist/stats/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["detail"], "Unknown key id")
+
+    def test_token_cache_hits_and_misses_are_counted(self):
+        hits, misses = self.lookups("hit"), self.lookups("miss")
+        for _ in range(3):
+            self.assertEqual(self.client.get("/api/watchlist/stats/", **auth_headers("auth-user")).status_code, 200)
+        self.assertEqual(self.lookups("miss") - misses, 1)
+        self.assertEqual(self.lookups("hit") - hits, 2)
+
+
+class FailingPublisher(MemoryPublisher):
+    """Takes messages but never gets them acknowledged."""
+
+    def flush(self):
+        raise PublishError("broker unavailable")
+
+
+class OutboxRelayTests(ShardedTestCase):
+    user_id = "relay-user"
+
+    def setUp(self):
+        MemoryPublisher.clear()
+        apply_batch(
+            self.user_id,
+            [{"op": "add", "media_id": str(i), "media_type": "anime", "title": f"Title {i}"} for i in range(3)],
+        )
+        apply_batch(self.user_id, [{"op": "remove", "media_id": "0", "media_type": "anime"}])
+
+    def outbox(self):
+        with use_user(self.user_id):
+            return list(WatchlistOutbox.objects.filter(user_id=self.user_id).order_by("id"))
+
+    @override_settings(WATCHLIST_OUTBOX_PUBLISHER="watchlist.publishers.MemoryPublisher")
+    def test_rows_are_deleted_after_a_successful_flush(self):
+        queued = self.outbox()
+        self.assertEqual(len(queued), 4)
+
+        call_command("relay_watchlist_outbox", "--once", stdout=StringIO())
+
+        self.assertEqual(self.outbox(), [])
+        published = [json.loads(value) for _, _, value in MemoryPublisher.messages]
+        self.assertEqual([event["id"] for event in published], [row.id for row in queued])
+        self.assertEqual([event["type"] for event in published], [row.event_type for row in queued])
+        self.assertEqual({key for _, key, _ in MemoryPublisher.messages}, {self.user_id})
+
+    @override_settings(WATCHLIST_OUTBOX_PUBLISHER="watchlist.tests.FailingPublisher")
+    def test_rows_are_kept_when_the_flush_fails(self):
+        queued = self.outbox()
+
+        with self.assertRaisesMessage(CommandError, "broker unavailable"):
+            call_command("relay_watchlist_outbox", "--once", stdout=StringIO())
+
+        self.assertEqual(self.outbox(), queued)
+
+    def test_relay_refuses_the_local_sqlite_default(self):
+        default = {"ENGINE": "django.db.backends.sqlite3", "NAME": str(settings.BASE_DIR / "db.sqlite3")}
+        with mock.patch.dict(connections["default"].settings_dict, default):
+            with self.assertRaisesMessage(CommandError, "DATABASE_URL is not set"):
+                call_command("relay_watchlist_outbox", "--once", stdout=StringIO())
+        self.assertEqual(len(self.outbox()), 4)
+
+    @override_settings(WATCHLIST_OUTBOX_PUBLISHER="watchlist.publishers.MemoryPublisher")
+    def test_relay_publishes_in_batches(self):
+        call_command("relay_watchlist_outbox", "--once", "--batch-size", "1", stdout=StringIO())
+
+        self.assertEqual(self.outbox(), [])
+        self.assertEqual(len(MemoryPublisher.messages), 4)
+
+
+@override_settings(JWT_KEYS=TEST_KEYS)
+class RendererTests(ShardedTestCase):
+    def test_list_pages_match_json_renderer(self):
+        add_entries("renderer-user", 5, title="Caf\u00e9 \u2028 \"quoted\"")
+        response = self.client.get("/api/watchlist/", **auth_headers("renderer-user"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, JSONRenderer().render(json.loads(response.content)))
+
+    def test_rows_serialize_like_the_serializer(self):
+        add_entries("renderer-user", 3)
+        with use_user("renderer-user", write=True):
+            Watchlist.objects.filter(media_id="1").update(poster_url="https://example.com/1.png", status="watching")
+            entries = Watchlist.objects.for_user("renderer-user")
+            row_serializer = RowSerializer(WatchlistSerializer)
+            rows = row_serializer.many(row_serializer.rows(entries))
+            self.assertEqual(rows, WatchlistSerializer(entries, many=True).data)
+        self.assertEqual([list(row) for row in rows], [list(WatchlistSerializer().fields)] * 3)
+
+    def test_float_responses_keep_json_formatting(self):
+        top = [{"media_id": "1", "media_type": "anime", "title": "Title", "poster_url": None, "score": 1e16}]
+        with mock.patch("watchlist.views.get_top", return_value=top):
+            response = self.client.get("/api/trending/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"score":1e+16', response.content)
+
+
+class HashRingTests(SimpleTestCase):
+    users = [f"user-{i}" for i in range(3000)]
+
+    def placements(self, shards):
+        ring = HashRing(shards)
+        return {user_id: ring.get(user_id) for user_id in self.users}
+
+    def test_placement_is_stable(self):
+        # Hashed with blake2b, so every process agrees
+        self.assertEqual(self.placements(["a", "b", "c"]), self.placements(["c", "a", "b"]))
+
+    def test_adding_a_shard_only_moves_users_onto_it(self):
+        before, after = self.placements(["a", "b", "c"]), self.placements(["a", "b", "c", "d"])
+        moved = [user_id for user_id in self.users if before[user_id] != after[user_id]]
+        self.assertEqual({after[user_id] for user_id in moved}, {"d"})
+        # About a quarter of the users
+        self.assertLess(abs(len(moved) / len(self.users) - 0.25), 0.05)
+
+
+@skipUnless(len(SHARDS) > 1, "needs several shards; run with --settings=watchlist_service.sharded_settings")
+@override_settings(WATCHLIST_SHARD_DIRECTORY_TTL=0, WATCHLIST_SHARD_MOVE_GRACE=0)
+class ShardingTests(ShardedTestCase):
+    user_id = "shard-user"
+
+    def setUp(self):
+        directory.forget([self.user_id])
+        apply_batch(
+            self.user_id,
+            [{"op": "add", "media_id": str(i), "media_type": "anime", "title": f"Title {i}"} for i in range(5)],
+        )
+        self.source = ShardPlacement.objects.get(user_id=self.user_id).shard
+        self.target = next(shard for shard in SHARDS if shard != self.source)
+
+    def rows(self, shard):
+        """Row counts of the user's tables on `shard`."""
+        return {
+            model.__name__: model.objects.using(shard).filter(user_id=self.user_id).count()
+            for model in COPIED_MODELS + [WatchlistOutbox]
+        }
+
+    def rebalance(self):
+        call_command("rebalance_shards", "--user", self.user_id, "--to", self.target, stdout=StringIO())
+        directory.forget([self.user_id])
+
+    def test_placement_survives_ring_changes(self):
+        with mock.patch("watchlist.sharding.ring", HashRing([self.target])):
+            self.assertEqual(shard_for(self.user_id, write=True), self.source)
+            self.assertEqual(shard_for("new-user", write=True), self.target)
+
+    def test_move_copies_rows_and_switches_placement(self):
+        rows = self.rows(self.source)
+        self.assertEqual(rows["Watchlist"], 5)
+        # One event per added entry
+        self.assertEqual(rows["WatchlistOutbox"], 5)
+
+        self.rebalance()
+
+        self.assertEqual(self.rows(self.target), rows)
+        self.assertEqual(set(self.rows(self.source).values()), {0})
+        self.assertEqual(
+            ShardPlacement.objects.filter(user_id=self.user_id).values_list("shard", "moving").get(),
+            (self.target, False),
+        )
+        with use_user(self.user_id, write=True) as shard:
+            self.assertEqual(shard, self.target)
+            self.assertEqual(WatchlistStats.objects.get(user_id=self.user_id).total, 5)
+
+    def test_failed_move_leaves_the_user_on_the_source(self):
+        rows = self.rows(self.source)
+        outbox = list(
+            WatchlistOutbox.objects.using(self.source).filter(user_id=self.user_id).values_list("event_type", "payload")
+        )
+
+        with mock.patch.object(RebalanceCommand, "verify", side_effect=CommandError("checksums differ")):
+            with self.assertRaisesMessage(CommandError, "checksums differ"):
+                self.rebalance()
+
+        self.assertEqual(self.rows(self.source), rows)
+        self.assertEqual(set(self.rows(self.target).values()), {0})
+        # The moved events are back, to be published by the source relay
+        self.assertEqual(
+            list(
+                WatchlistOutbox.objects.using(self.source)
+                .filter(user_id=self.user_id)
+                .values_list("event_type", "payload")
+            ),
+            outbox,
+        )
+        self.assertEqual(
+            ShardPlacement.objects.filter(user_id=self.user_id).values_list("shard", "moving").get(),
+            (self.source, False),
+        )
+
+
+@skipUnless(replicas.REPLICAS, "needs a replica; run with --settings=watchlist_service.replica_settings")
+@override_settings(JWT_KEYS=TEST_KEYS, CACHES=SHARED_CACHES)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Reads go to the replica, except for users who wrote within the sticky window."""
+
+    # Replicas only read what was committed
+    databases = "__all__"
+
+    def setUp(self):
+        caches[settings.DATABASE_REPLICA_CACHE_ALIAS].clear()
+        add_entries("writer", 1)
+        add_entries("reader", 1)
+        self.replica = replicas.REPLICAS["default"][0]
+        # Checked here instead of by the monitor's thread
+        for patcher in (mock.patch.object(replicas.monitor, "start"), mock.patch.object(replicas.monitor, "available")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        replicas.monitor.check()
+
+    def get_entry(self, user_id):
+        """`(response, queries on "default", queries on the replica)` of reading the user's entry."""
+        entry = Watchlist.objects.using("default").get(user_id=user_id)
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections[self.replica]) as replica:
+                response = self.client.get(f"/api/watchlist/{entry.id}/", **auth_headers(user_id))
+        self.assertEqual(response.status_code, 200)
+        return response, len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        _, primary, replica = self.get_entry("reader")
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_writer_reads_from_the_primary(self):
+        entry_id = self.get_entry("writer")[0].json()["id"]
+        response = self.client.patch(
+            f"/api/watchlist/{entry_id}/", {"status": "watching"}, content_type="application/json", **auth_headers("writer")
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response, primary, replica = self.get_entry("writer")
+        self.assertEqual(response.json()["status"], "watching")
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        # Users who did not write keep reading from the replica
+        self.assertEqual(self.get_entry("reader")[1], 0)
+
+
+class AdaptiveLimitTests(SimpleTestCase):
+    def limit(self, **overrides):
+        options = dict(
+            initial=4, minimum=2, maximum=10, tolerance=2, queue_target=0.1, interval=1, write_share=0.5
+        )
+        return admission.AdaptiveLimit(**{**options, **overrides})
+
+    def run_window(self, limit, latency, concurrent, now):
+        """Serve `concurrent` requests at once, then enough more of `latency` to close the window at `now`."""
+        for _ in range(concurrent):
+            self.assertIsNone(limit.acquire(False, None, now))
+        for _ in range(concurrent):
+            limit.release(latency, now - 0.5)
+        for _ in range(admission.MIN_SAMPLES):
+            limit.acquire(False, None, now)
+            limit.release(latency, now)
+
+    def test_limit_grows_by_one_when_reached(self):
+        limit = self.limit()
+        start = time.monotonic()
+        self.run_window(limit, 0.01, 4, start + 1)
+        self.assertEqual(limit.limit, 5)
+        # Not reached: it stays
+        self.run_window(limit, 0.01, 1, start + 2)
+        self.assertEqual(limit.limit, 5)
+
+    def test_limit_is_cut_when_latency_rises(self):
+        limit = self.limit(initial=8)
+        start = time.monotonic()
+        self.run_window(limit, 0.01, 1, start + 1)
+        self.run_window(limit, 0.05, 1, start + 2)
+        self.assertAlmostEqual(limit.limit, 8 * admission.BACKOFF)
+        for window in range(3, 30):
+            self.run_window(limit, 0.05 * window, 1, start + window)
+        self.assertEqual(limit.limit, 2)
+
+    def test_requests_past_the_limit_are_shed(self):
+        limit = self.limit()
+        now = time.monotonic()
+        # Writes may use half of it
+        self.assertEqual([limit.acquire(True, None, now) for _ in range(3)], [None, None, "limit"])
+        self.assertEqual([limit.acquire(False, None, now) for _ in range(3)], [None, None, "limit"])
+        limit.release(0.01, now)
+        self.assertIsNone(limit.acquire(False, None, now))
+
+    def test_standing_queue_sheds_writes_before_reads(self):
+        limit = self.limit(initial=100)
+        start = time.monotonic()
+        # One long wait is a burst, not a standing queue
+        self.assertIsNone(limit.acquire(True, 0.5, start + 0.5))
+        later = start + 1.5
+        self.assertEqual(limit.acquire(True, 0.15, later), "queue")
+        self.assertIsNone(limit.acquire(False, 0.15, later))
+        self.assertEqual(limit.acquire(False, 0.25, later), "queue")
+        # A request that did not wait ends it
+        self.assertIsNone(limit.acquire(False, 0.01, later))
+        self.assertIsNone(limit.acquire(True, 0.15, later + 0.5))
+        # And a window that ends inside one cuts the limit
+        for _ in range(admission.MIN_SAMPLES):
+            limit.release(0.01, later + 1.5)
+        self.assertLess(limit.limit, 100)
+
+    def test_queue_delay_reads_x_request_start(self):
+        now = 1_700_000_000.5
+        for header in ("t=1700000000.250", "1700000000250", "1700000000250000"):
+            request = RequestFactory().get("/", HTTP_X_REQUEST_START=header)
+            self.assertAlmostEqual(admission.queue_delay(request, now), 0.25, places=3)
+        self.assertIsNone(admission.queue_delay(RequestFactory().get("/"), now))
+
+
+@override_settings(JWT_KEYS=TEST_KEYS)
+class LoadShedMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        limit = admission.AdaptiveLimit(
+            initial=1, minimum=1, maximum=1, tolerance=2, queue_target=0.1, interval=60, write_share=1
+        )
+        patcher = mock.patch.object(admission, "limiter", limit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The only slot is taken
+        limit.acquire(False, None, time.monotonic())
+
+    def test_shed_requests_get_503_with_retry_after_and_cors_headers(self):
+        response = self.client.get("/api/watchlist/stats/", HTTP_ORIGIN="http://localhost:3000", **auth_headers("u"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], str(settings.LOAD_SHED_RETRY_AFTER))
+        self.assertEqual(response["Access-Control-Allow-Origin"], "http://localhost:3000")
+
+    def test_metrics_are_never_shed(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+
+@override_settings(JWT_KEYS=TEST_KEYS, CACHES=SHARED_CACHES)
+class ListCacheTests(ShardedTestCase):
+    user_id = "cache-user"
+
+    def setUp(self):
+        caches["watchlist"].clear()
+        watchlist_cache.local.clear()
+        add_entries(self.user_id, 3)
+
+    def get_list(self, **headers):
+        return self.client.get("/api/watchlist/", **auth_headers(self.user_id), **headers)
+
+    def add_entry(self):
+        # The version is bumped once the write commits on the user's shard
+        with self.captureOnCommitCallbacks(using=shard_for(self.user_id), execute=True):
+            response = self.client.post(
+                "/api/watchlist/",
+                {"media_id": "new", "media_type": "anime", "title": "New"},
+                content_type="application/json",
+                **auth_headers(self.user_id),
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.get_list()["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get_list(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_pages_are_served_from_the_cache(self):
+        first = self.get_list()
+        with self.assertNumQueries(0):
+            second = self.get_list()
+        self.assertEqual(second.json(), first.json())
+
+    def test_write_invalidates_pages_and_etag(self):
+        first = self.get_list()
+        self.add_entry()
+
+        response = self.get_list(HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual(len(response.json()["results"]), 4)
+
+    def test_other_users_pages_are_kept(self):
+        add_entries("other-user", 1)
+        etag = self.client.get("/api/watchlist/", **auth_headers("other-user"))["ETag"]
+        self.add_entry()
+        response = self.client.get("/api/watchlist/", HTTP_IF_NONE_MATCH=etag, **auth_headers("other-user"))
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(CACHES={**SHARED_CACHES, "watchlist": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+    def test_nothing_is_cached_without_a_shared_tier(self):
+        first = self.get_list()
+        self.assertNotIn("ETag", first)
+        self.add_entry()
+        response = self.get_list(HTTP_IF_NONE_MATCH='"None"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 4)
+
+
+class BatchTests(ShardedTestCase):
+    user_id = "batch-user"
+
+    def setUp(self):
+        apply_batch(
+            self.user_id,
+            [{"op": "add", "media_id": str(i), "media_type": "anime", "title": f"Title {i}"} for i in range(1, 4)],
+        )
+
+    def test_operations_and_stats(self):
+        with use_user(self.user_id):
+            before = {entry.media_id: entry for entry in Watchlist.objects.filter(user_id=self.user_id)}
+        results = apply_batch(
+            self.user_id,
+            [
+                {"op": "add", "media_id": "4", "media_type": "movie", "title": "Four", "status": "watching"},
+                {"op": "add", "media_id": "1", "media_type": "anime", "title": "One again"},
+                {"op": "update", "media_id": "2", "media_type": "anime", "status": "completed"},
+                {"op": "remove", "media_id": "3", "media_type": "anime"},
+                {"op": "update", "media_id": "9", "media_type": "anime", "status": "completed"},
+                {"op": "remove", "media_id": "4", "media_type": "movie"},
+                {"op": "add", "media_id": "5", "media_type": "anime"},
+                {"op": "rename", "media_id": "6", "media_type": "anime"},
+            ],
+        )
+
+        self.assertEqual(
+            [result["result"] for result in results],
+            ["created", "updated", "updated", "deleted", "not_found", "invalid", "invalid", "invalid"],
+        )
+        self.assertIn("non_field_errors", results[5]["errors"])
+        self.assertIn("title", results[6]["errors"])
+        self.assertIn("op", results[7]["errors"])
+        with use_user(self.user_id):
+            after = {entry.media_id: entry for entry in Watchlist.objects.filter(user_id=self.user_id)}
+            tombstones = list(WatchlistTombstone.objects.filter(user_id=self.user_id).values_list("entry_id", "change_seq"))
+        self.assertEqual(set(after), {"1", "2", "4"})
+        # Responses carry the stored rows
+        self.assertEqual(results[0]["entry"]["id"], str(after["4"].id))
+        self.assertEqual(results[1]["entry"]["id"], str(before["1"].id))
+        self.assertEqual((after["1"].title, after["1"].created_at), ("One again", before["1"].created_at))
+        self.assertEqual(after["2"].status, "completed")
+        self.assertEqual([entry_id for entry_id, _ in tombstones], [before["3"].id])
+        # One feed sequence number per change, after those of the first batch
+        seqs = [entry.change_seq for entry in after.values()] + [seq for _, seq in tombstones]
+        self.assertEqual(sorted(seqs), [4, 5, 6, 7])
+
+        stored, counted = counters(self.user_id)
+        self.assertEqual(stored, counted)
+        self.assertEqual((stored["total"], stored["movie"], stored["completed"]), (3, 1, 1))
+
+    def test_batch_without_changes_writes_nothing(self):
+        results = apply_batch(self.user_id, [{"op": "remove", "media_id": "9", "media_type": "anime"}])
+        self.assertEqual(results[0]["result"], "not_found")
+        with use_user(self.user_id):
+            self.assertEqual(WatchlistStats.objects.get(user_id=self.user_id).change_seq, 3)
+
+
+@override_settings(JWT_KEYS=TEST_KEYS, WATCHLIST_ASYNC_VIEWS=True)
+class AsyncViewTests(ShardedTestCase):
+    user_id = "async-user"
+
+    def setUp(self):
+        apply_batch(
+            self.user_id,
+            [{"op": "add", "media_id": str(i), "media_type": "anime", "title": f"Title {i}"} for i in range(3)],
+        )
+        with use_user(self.user_id):
+            self.entry = Watchlist.objects.get(user_id=self.user_id, media_id="0")
+
+    def request(self, method, path, data=None, user_id=None):
+        # AsyncClient takes headers by name, not as WSGI environ keys
+        headers = {"Authorization": f"Bearer {token_for(user_id or self.user_id)}"}
+        if data is None:
+            return getattr(self.async_client, method)(path, headers=headers)
+        return getattr(self.async_client, method)(path, data, content_type="application/json", headers=headers)
+
+    def test_urls_resolve_to_the_async_views(self):
+        self.assertIs(resolve("/api/watchlist/").func.view_class, AsyncWatchlistListView)
+
+    async def test_list(self):
+        response = await self.request("get", "/api/watchlist/?page_size=2")
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual([entry["media_id"] for entry in page["results"]], ["2", "1"])
+        self.assertIsNotNone(page["next"])
+
+        response = await self.request("get", page["next"])
+        self.assertEqual([entry["media_id"] for entry in response.json()["results"]], ["0"])
+        self.assertEqual((await self.async_client.get("/api/watchlist/")).status_code, 403)
+
+    async def test_detail(self):
+        response = await self.request("get", f"/api/watchlist/{self.entry.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], self.entry.title)
+        response = await self.request("get", f"/api/watchlist/{self.entry.id}/", user_id="someone-else")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_create(self):
+        entry = {"media_id": "9", "media_type": "movie", "title": "Nine"}
+        response = await self.request("post", "/api/watchlist/", entry)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()["user_id"], response.json()["status"]), (self.user_id, "planned"))
+        response = await self.request("post", "/api/watchlist/", entry)
+        self.assertEqual(response.status_code, 400)
+        with use_user(self.user_id):
+            self.assertEqual(await Watchlist.objects.for_user(self.user_id).acount(), 4)
+            self.assertEqual((await WatchlistStats.objects.aget(user_id=self.user_id)).movie, 1)
+
+    async def test_update(self):
+        path = f"/api/watchlist/{self.entry.id}/"
+        response = await self.request("patch", path, {"status": "completed", "user_id": "someone-else"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["status"], response.json()["user_id"]), ("completed", self.user_id))
+
+        entry = {"media_id": "0", "media_type": "anime", "title": "Renamed", "status": "watching"}
+        response = await self.request("put", path, entry)
+        self.assertEqual(response.status_code, 200)
+        with use_user(self.user_id):
+            stored = await Watchlist.objects.aget(pk=self.entry.id)
+        self.assertEqual((stored.title, stored.status), ("Renamed", "watching"))
+        self.assertEqual((await self.request("put", path, {"title": "Missing fields"})).status_code, 400)
+
+    async def test_delete(self):
+        path = f"/api/watchlist/{self.entry.id}/"
+        self.assertEqual((await self.request("delete", path, user_id="someone-else")).status_code, 404)
+        self.assertEqual((await self.request("delete", path)).status_code, 204)
+        self.assertEqual((await self.request("get", path)).status_code, 404)
+        with use_user(self.user_id):
+            self.assertEqual((await WatchlistStats.objects.aget(user_id=self.user_id)).total, 2)
+
+    async def test_export_streams(self):
+        for name, header in (("ndjson", 0), ("csv", 1)):
+            with self.subTest(name):
+                response = await self.request("get", f"/api/watchlist/export/?type={name}")
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.is_async)
+                lines, _ = await aread(response.streaming_content)
+                self.assertEqual(lines, 3 + header)
+
+
+class StatsTests(ShardedTestCase):
+    user_id = "stats-user"
+
+    def assertCountersMatch(self, user_id):
+        stored, counted = counters(user_id)
+        self.assertEqual(stored, counted)
+        return stored
+
+    def test_writes_keep_the_counters_in_step(self):
+        entry = create_entry(self.user_id, {"media_id": "1", "media_type": "anime", "title": "One"})
+        create_entry(self.user_id, {"media_id": "2", "media_type": "movie", "title": "Two", "status": "watching"})
+        self.assertEqual(self.assertCountersMatch(self.user_id)["total"], 2)
+
+        update_entry(entry, {"status": "completed"})
+        self.assertEqual(self.assertCountersMatch(self.user_id)["completed"], 1)
+
+        delete_entry(entry)
+        self.assertEqual(self.assertCountersMatch(self.user_id)["anime"], 0)
+
+        apply_batch(
+            self.user_id,
+            [
+                {"op": "add", "media_id": "3", "media_type": "anime", "title": "Three"},
+                {"op": "update", "media_id": "2", "media_type": "movie", "status": "completed"},
+            ],
+        )
+        stored = self.assertCountersMatch(self.user_id)
+        self.assertEqual((stored["total"], stored["watching"], stored["completed"]), (2, 0, 1))
+
+    def test_row_created_concurrently_is_updated(self):
+        # Another write for the user inserts the stats row between this
+        # write's UPDATE, which found no row, and its INSERT
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            if not WatchlistStats.objects.filter(user_id=self.user_id).exists():
+                WatchlistStats.objects.create(user_id=self.user_id, total=1, anime=1, planned=1, change_seq=1)
+                return 0
+            return update(queryset, **kwargs)
+
+        with use_user(self.user_id, write=True), mock.patch.object(QuerySet, "update", racing_update):
+            seq = apply_delta(self.user_id, {"total": 1, "movie": 1, "planned": 1})
+            stored = WatchlistStats.objects.get(user_id=self.user_id)
+        self.assertEqual(seq, 2)
+        self.assertEqual((stored.total, stored.anime, stored.movie, stored.planned), (2, 1, 1, 2))
+
+    def test_rebuild_repairs_drift(self):
+        other = "stats-other"
+        for user_id in (self.user_id, other):
+            apply_batch(
+                user_id,
+                [{"op": "add", "media_id": str(i), "media_type": "anime", "title": f"Title {i}"} for i in range(3)],
+            )
+        with use_user(self.user_id, write=True):
+            WatchlistStats.objects.filter(user_id=self.user_id).update(total=99, anime=0)
+        with use_user(other, write=True):
+            WatchlistStats.objects.filter(user_id=other).delete()
+
+        out = StringIO()
+        call_command("rebuild_watchlist_stats", "--check", stdout=out)
+        self.assertIn("1 drifted", out.getvalue())
+        self.assertIn("1 missing stats rows", out.getvalue())
+        self.assertEqual(counters(self.user_id)[0]["total"], 99)
+
+        call_command("rebuild_watchlist_stats", stdout=StringIO())
+        for user_id in (self.user_id, other):
+            self.assertEqual(self.assertCountersMatch(user_id)["total"], 3)
+        with use_user(self.user_id):
+            # The feed sequence is not a counter and survives the rebuild
+            self.assertEqual(WatchlistStats.objects.get(user_id=self.user_id).change_seq, 3)
+
+
+@override_settings(JWT_KEYS=TEST_KEYS)
+class ChangeFeedTests(ShardedTestCase):
+    user_id = "feed-user"
+
+    def setUp(self):
+        # Sequence numbers 1-5, then 6 for the removal and 7 for the update
+        apply_batch(
+            self.user_id,
+            [{"op": "add", "media_id": str(i), "media_type": "anime", "title": f"Title {i}"} for i in range(5)],
+        )
+        with use_user(self.user_id):
+            entries = {entry.media_id: entry for entry in Watchlist.objects.filter(user_id=self.user_id)}
+        self.removed_id = entries["1"].id
+        delete_entry(entries["1"])
+        update_entry(entries["0"], {"status": "watching"})
+
+    def feed(self, since=None, limit=None, status_code=200):
+        params = {key: value for key, value in (("since", since), ("limit", limit)) if value is not None}
+        response = self.client.get("/api/watchlist/changes/", params, **auth_headers(self.user_id))
+        self.assertEqual(response.status_code, status_code)
+        return response.json()
+
+    def test_pages_follow_the_cursor(self):
+        pages = []
+        since = None
+        while True:
+            page = self.feed(since, limit=2)
+            pages.append(([entry["media_id"] for entry in page["changes"]], [d["media_id"] for d in page["deleted"]]))
+            since = page["cursor"]
+            if not page["has_more"]:
+                break
+        self.assertEqual(pages, [(["2", "3"], []), (["4"], ["1"]), (["0"], [])])
+        self.assertEqual(since, encode_cursor(7))
+
+    def test_removed_entries_are_tombstones(self):
+        page = self.feed(encode_cursor(5))
+        [deleted] = page["deleted"]
+        self.assertEqual((deleted["id"], deleted["media_id"], deleted["media_type"]), (str(self.removed_id), "1", "anime"))
+        self.assertEqual([entry["status"] for entry in page["changes"]], ["watching"])
+
+    def test_up_to_date_client_costs_one_query(self):
+        cursor = self.feed()["cursor"]
+        with self.assertNumQueries(1, using=shard_for(self.user_id)):
+            page = self.feed(cursor)
+        self.assertEqual(page, {"cursor": cursor, "has_more": False, "changes": [], "deleted": []})
+
+    def test_cursor_before_purged_tombstones_expires(self):
+        call_command("purge_watchlist_tombstones", "--days", "0", stdout=StringIO())
+        self.assertEqual(self.feed(encode_cursor(5), status_code=410)["detail"], CursorExpired.default_detail)
+        # A cursor at the purge horizon and a full resync still work
+        self.assertEqual(self.feed(encode_cursor(6))["deleted"], [])
+        self.assertEqual(len(self.feed()["changes"]), 4)
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ("not-a-cursor", encode_cursor(-1), encode_cursor("5")):
+            with self.subTest(cursor):
+                self.assertEqual(self.feed(cursor, status_code=404)["detail"], "Invalid cursor")
+
+
+@mock.patch.object(PlaybackProgressStore, "start_flusher")
+class PlaybackProgressTests(ShardedTestCase):
+    user_id = "progress-user"
+
+    def setUp(self):
+        self.store = PlaybackProgressStore(LocalProgressBuffer(), interval=60, batch_size=100)
+
+    def stored(self):
+        with use_user(self.user_id):
+            return {
+                (row.media_id, row.episode): row.position
+                for row in PlaybackProgress.objects.filter(user_id=self.user_id)
+            }
+
+    def positions(self, **filters):
+        with use_user(self.user_id):
+            records = self.store.get(self.user_id, **filters)
+        return [(record["media_id"], record["episode"], record["position"]) for record in records]
+
+    def test_heartbeats_coalesce_into_one_row_per_key(self, start_flusher):
+        for position in (10, 20, 30):
+            self.store.record(self.user_id, "1", "anime", "1", position)
+        self.store.record(self.user_id, "1", "anime", "2", 5)
+        self.assertEqual(self.stored(), {})
+
+        with mock.patch.object(self.store, "write", wraps=self.store.write) as write:
+            self.assertEqual(self.store.flush(), 2)
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(self.stored(), {("1", "1"): 30, ("1", "2"): 5})
+        self.assertEqual(self.store.buffer.get(self.user_id), {})
+        self.assertEqual(self.store.flush(), 0)
+
+    def test_reads_merge_the_buffer_over_the_table(self, start_flusher):
+        self.store.record(self.user_id, "1", "anime", "1", 10)
+        self.store.record(self.user_id, "2", "movie", "", 50)
+        self.store.flush()
+        self.store.record(self.user_id, "1", "anime", "1", 70)
+
+        self.assertEqual(self.stored(), {("1", "1"): 10, ("2", ""): 50})
+        self.assertEqual(self.positions(), [("1", "1", 70), ("2", "", 50)])
+        self.assertEqual(self.positions(limit=1), [("1", "1", 70)])
+        self.assertEqual(self.positions(media_id="2", media_type="movie"), [("2", "", 50)])
+
+    def test_older_heartbeat_does_not_overwrite_a_newer_row(self, start_flusher):
+        shard = shard_for(self.user_id, write=True)
+        record = {"media_id": "1", "media_type": "anime", "episode": "1", "duration": None}
+        self.store.write([(self.user_id, {**record, "position": 40, "updated_at": 2_000})], shard)
+        # Another worker flushing a heartbeat it took earlier
+        self.store.write([(self.user_id, {**record, "position": 20, "updated_at": 1_000})], shard)
+        self.assertEqual(self.stored(), {("1", "1"): 40})
+        self.store.write([(self.user_id, {**record, "position": 60, "updated_at": 3_000})], shard)
+        self.assertEqual(self.stored(), {("1", "1"): 60})
+
+    def test_failed_write_requeues_the_keys(self, start_flusher):
+        self.store.record(self.user_id, "1", "anime", "1", 10)
+        with mock.patch.object(self.store, "write", side_effect=OperationalError("connection lost")):
+            with self.assertRaises(OperationalError):
+                self.store.flush()
+        self.assertEqual(self.stored(), {})
+        self.assertEqual(self.positions(), [("1", "1", 10)])
+
+        self.assertEqual(self.store.flush(), 1)
+        self.assertEqual(self.stored(), {("1", "1"): 10})
+
+    def test_zero_interval_writes_through(self, start_flusher):
+        self.store.interval = 0
+        self.store.record(self.user_id, "1", "anime", "1", 10)
+        self.assertEqual(self.stored(), {("1", "1"): 10})
+        self.assertEqual(self.store.buffer.get(self.user_id), {})
+        start_flusher.assert_not_called()
+
+
+class TrendingTests(ShardedTestCase):
+    start = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+    def setUp(self):
+        trending.invalidate_top()
+        self.addCleanup(trending.invalidate_top)
+
+    @contextmanager
+    def at(self, hours):
+        """Run the block `hours` after `start`, with its on-commit callbacks."""
+        moment = self.start + timedelta(hours=hours)
+        with mock.patch("django.utils.timezone.now", return_value=moment), mock.patch(
+            "watchlist.trending.time.time", return_value=moment.timestamp()
+        ):
+            yield
+
+    def write(self, user_id, hours, write, *args):
+        with self.at(hours), self.captureOnCommitCallbacks(using=shard_for(user_id), execute=True):
+            return write(*args)
+
+    def scores(self):
+        return {(row.media_id, row.media_type): row.score for row in TrendingScore.objects.all()}
+
+    def test_activity_counts_once_committed(self):
+        user_id = "trending-user"
+        entry = self.write(user_id, 0, create_entry, user_id, {"media_id": "1", "media_type": "anime", "title": "One"})
+        self.assertEqual(self.scores(), {("1", "anime"): trending.growth(self.start.timestamp())})
+
+        moment = self.start.timestamp() + 3600
+        self.write(user_id, 1, update_entry, entry, {"status": "watching"})
+        expected = trending.growth(self.start.timestamp()) + 0.5 * trending.growth(moment)
+        self.assertAlmostEqual(self.scores()[("1", "anime")], expected)
+        # Moving back to planned is not activity
+        self.write(user_id, 2, update_entry, entry, {"status": "planned"})
+        self.assertAlmostEqual(self.scores()[("1", "anime")], expected)
+
+        with self.captureOnCommitCallbacks(using=shard_for(user_id), execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic(using=shard_for(user_id, write=True)):
+                create_entry(user_id, {"media_id": "2", "media_type": "anime", "title": "Two"})
+                raise RuntimeError("rolled back")
+        self.assertNotIn(("2", "anime"), self.scores())
+
+    def test_top_titles_rank_by_decayed_score(self):
+        now = time.time()
+        half_life = trending.HALF_LIFE
+        trending.add_scores({("old", "anime"): (4.0, 4, "Old", None)}, now - 10 * half_life)
+        trending.add_scores({("new", "anime"): (1.0, 1, "New", None)}, now)
+        trending.add_scores({("movie", "movie"): (3.0, 3, "Movie", None)}, now - half_life)
+
+        top = trending.get_top()
+        self.assertEqual([row["media_id"] for row in top], ["movie", "new", "old"])
+        self.assertEqual([round(row["score"], 3) for row in top], [1.5, 1.0, 0.004])
+        self.assertEqual([row["media_id"] for row in trending.get_top("anime")], ["new", "old"])
+        self.assertEqual([row["media_id"] for row in trending.get_top(limit=1)], ["movie"])
+
+    def test_rebuild_matches_incremental_scores(self):
+        entries = {}
+        for user_id in ("trending-a", "trending-b"):
+            for media_id, media_type in (("1", "anime"), ("2", "movie")):
+                data = {"media_id": media_id, "media_type": media_type, "title": f"Title {media_id}"}
+                entries[user_id, media_id] = self.write(user_id, 0, create_entry, user_id, data)
+        self.write("trending-a", 24, update_entry, entries["trending-a", "1"], {"status": "watching"})
+        self.write("trending-b", 48, update_entry, entries["trending-b", "1"], {"status": "completed"})
+        incremental = self.scores()
+
+        self.assertEqual(trending.rebuild(), 2)
+        rebuilt = self.scores()
+        self.assertEqual(rebuilt.keys(), incremental.keys())
+        for key, score in incremental.items():
+            self.assertAlmostEqual(rebuilt[key] / score, 1.0, places=6)
+        self.assertEqual(dict(TrendingScore.objects.values_list("media_id", "events")), {"1": 4, "2": 2})
+
+
+class UUID7Tests(SimpleTestCase):
+    def test_version_and_variant(self):
+        for pk in (uuid7(), uuid7(datetime(2026, 3, 1, tzinfo=timezone.utc))):
+            self.assertEqual(pk.version, 7)
+            self.assertEqual(pk.variant, uuid.RFC_4122)
+
+    def test_ids_sort_by_time(self):
+        start = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        moments = [start + timedelta(microseconds=250 * i) for i in range(20)]
+        ids = [uuid7(at) for at in moments]
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(ids[0].int >> 80, int(start.timestamp() * 1000))
+        for at, pk in zip(moments, ids):
+            self.assertLessEqual(first_uuid7(at), pk)
+            self.assertLess(pk, first_uuid7(at + timedelta(milliseconds=1)))
+
+    def test_new_ids_increase_when_the_clock_steps_back(self):
+        now = time.time_ns()
+        clock = [now, now, now - 5_000_000, now - 10_000_000]
+        with mock.patch("watchlist.ids.time.time_ns", side_effect=clock):
+            ids = [uuid7() for _ in clock]
+        self.assertEqual(sorted(set(ids)), ids)
+
+
+@override_settings(JWT_KEYS=TEST_KEYS)
+class RekeyTests(ShardedTestCase):
+    user_id = "rekey-user"
+    start = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+    def setUp(self):
+        # Entries from before time-ordered ids, a minute apart
+        with use_user(self.user_id, write=True):
+            for i in range(4):
+                Watchlist.objects.create(
+                    id=uuid.uuid4(), user_id=self.user_id, media_id=str(i), media_type="anime", title=f"Title {i}"
+                )
+                created_at = self.start + timedelta(minutes=i)
+                Watchlist.objects.filter(user_id=self.user_id, media_id=str(i)).update(created_at=created_at)
+            self.old = {entry.media_id: entry for entry in Watchlist.objects.filter(user_id=self.user_id)}
+        self.kept = create_entry(self.user_id, {"media_id": "new", "media_type": "movie", "title": "Already v7"})
+
+    def rekey(self):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(using=shard_for(self.user_id), execute=True):
+            call_command("rekey_watchlist", stdout=out)
+        return out.getvalue()
+
+    def test_entries_tombstones_and_events_follow_the_new_ids(self):
+        self.assertIn("Rekeyed 4 entries of 1 users", self.rekey())
+
+        with use_user(self.user_id):
+            entries = {entry.media_id: entry for entry in Watchlist.objects.filter(user_id=self.user_id)}
+            tombstones = {row.entry_id: row for row in WatchlistTombstone.objects.filter(user_id=self.user_id)}
+            rekeyed = WatchlistOutbox.objects.filter(user_id=self.user_id, event_type=ENTRY_REKEYED)
+            events = {row.payload["previous_entry_id"]: row.payload for row in rekeyed}
+            change_seq = WatchlistStats.objects.get(user_id=self.user_id).change_seq
+
+        self.assertEqual(entries["new"].id, self.kept.id)
+        self.assertEqual(set(tombstones), {entry.id for entry in self.old.values()})
+        self.assertEqual(set(events), {str(entry.id) for entry in self.old.values()})
+        for media_id, old in self.old.items():
+            entry = entries[media_id]
+            self.assertEqual(entry.id.version, 7)
+            self.assertEqual(entry.id.int >> 80, int(old.created_at.timestamp() * 1000))
+            self.assertEqual((entry.title, entry.created_at), (old.title, old.created_at))
+            # The tombstone of the old id comes right before the entry under its new one
+            self.assertEqual(tombstones[old.id].change_seq + 1, entry.change_seq)
+            event = events[str(old.id)]
+            self.assertEqual((event["entry_id"], event["change_seq"]), (str(entry.id), entry.change_seq))
+        self.assertEqual(change_seq, 1 + 2 * len(self.old))
+        self.assertIn("Rekeyed 0 entries of 0 users", self.rekey())
+
+    def test_old_cursor_continues_after_the_rekey(self):
+        headers = auth_headers(self.user_id)
+        first = self.client.get("/api/watchlist/?page_size=2", **headers).json()
+        self.assertEqual([entry["media_id"] for entry in first["results"]], ["new", "3"])
+
+        self.rekey()
+        # Listing by id once every entry is time ordered
+        with mock.patch("watchlist.pagination.LIST_ORDER", ("id",)):
+            rest = self.client.get(first["next"], **headers).json()
+        self.assertEqual([entry["media_id"] for entry in rest["results"]], ["2", "1"])
+
+
+@override_settings(JWT_KEYS=TEST_KEYS)
+class CursorPaginationTests(ShardedTestCase):
+    user_id = "paging-user"
+
+    def setUp(self):
+        add_entries(self.user_id, 7)
+        # All added in the same instant, so only the id orders them
+        created_at = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        with use_user(self.user_id, write=True):
+            Watchlist.objects.filter(user_id=self.user_id).update(created_at=created_at)
+            self.ordered = [str(pk) for pk in Watchlist.objects.for_user(self.user_id).values_list("id", flat=True)]
+
+    def get(self, url="/api/watchlist/?page_size=3", status_code=200):
+        response = self.client.get(url, **auth_headers(self.user_id))
+        self.assertEqual(response.status_code, status_code)
+        return response.json()
+
+    def ids(self, page):
+        return [entry["id"] for entry in page["results"]]
+
+    def walk(self, during=None):
+        seen, page = [], self.get()
+        while True:
+            seen += self.ids(page)
+            if during:
+                during()
+                during = None
+            if page["next"] is None:
+                return seen
+            page = self.get(page["next"])
+
+    def test_pages_with_equal_created_at_cover_every_entry_once(self):
+        self.assertEqual(self.walk(), self.ordered)
+
+    def test_entries_added_mid_walk_cause_no_duplicates_or_gaps(self):
+        def add():
+            create_entry(self.user_id, {"media_id": "late-1", "media_type": "anime", "title": "Late"})
+            create_entry(self.user_id, {"media_id": "late-2", "media_type": "anime", "title": "Late"})
+
+        # New entries sort before the cursor, so the walk goes on where it was
+        self.assertEqual(self.walk(during=add), self.ordered)
+
+    def test_previous_link_walks_back(self):
+        first = self.get()
+        second = self.get(first["next"])
+        self.assertIsNone(first["previous"])
+        self.assertEqual(self.ids(second), self.ordered[3:6])
+
+        back = self.get(second["previous"])
+        self.assertEqual(self.ids(back), self.ordered[:3])
+        self.assertIsNone(back["previous"])
+        self.assertEqual(self.ids(self.get(back["next"])), self.ordered[3:6])
+
+    def test_tampered_cursor_is_not_found(self):
+        def cursor(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+        tokens = ["garbage", cursor({"t": "yesterday", "id": self.ordered[0]}), cursor({"t": "2026-03-01T00:00:00Z"})]
+        for token in tokens:
+            with self.subTest(token):
+                page = self.get(f"/api/watchlist/?cursor={token}", status_code=404)
+                self.assertEqual(page["detail"], "Invalid cursor")
+
+
+@override_settings(JWT_KEYS=TEST_KEYS, CACHES=SHARED_CACHES)
+class MembershipTests(ShardedTestCase):
+    user_id = "member-user"
+    items = [
+        {"media_id": "1", "media_type": "anime"},
+        {"media_id": "1", "media_type": "movie"},
+        {"media_id": "2", "media_type": "anime"},
+        {"media_id": "3", "media_type": "movie"},
+    ]
+
+    def setUp(self):
+        caches["watchlist"].clear()
+        apply_batch(
+            self.user_id,
+            [
+                {"op": "add", "media_id": "1", "media_type": "anime", "title": "One"},
+                {"op": "add", "media_id": "1", "media_type": "movie", "title": "One", "status": "watching"},
+            ],
+        )
+        # Someone else's entries never show up
+        apply_batch("member-other", [{"op": "add", "media_id": "2", "media_type": "anime", "title": "Two"}])
+
+    def lookup(self, items, status_code=200):
+        response = self.client.post(
+            "/api/watchlist/membership/", {"items": items}, content_type="application/json", **auth_headers(self.user_id)
+        )
+        self.assertEqual(response.status_code, status_code)
+        return response.json()
+
+    def test_hits_and_misses(self):
+        expected = {"anime:1": "planned", "movie:1": "watching", "anime:2": None, "movie:3": None}
+        self.assertEqual(self.lookup(self.items)["results"], expected)
+        # Answered from the cached map
+        with self.assertNumQueries(0, using=shard_for(self.user_id)):
+            self.assertEqual(self.lookup(self.items)["results"], expected)
+
+    @override_settings(WATCHLIST_MEMBERSHIP_MAX_ENTRIES=1)
+    def test_large_watchlist_is_queried_per_batch(self):
+        expected = {"anime:1": "planned", "movie:1": "watching", "anime:2": None, "movie:3": None}
+        self.assertEqual(self.lookup(self.items)["results"], expected)
+        # Only the requested titles are read, once per request
+        with self.assertNumQueries(1, using=shard_for(self.user_id)):
+            self.assertEqual(self.lookup(self.items)["results"], expected)
+
+    def test_request_size_is_limited(self):
+        items = [{"media_id": str(i), "media_type": "anime"} for i in range(settings.WATCHLIST_MEMBERSHIP_MAX_ITEMS + 1)]
+        self.assertIn("items", self.lookup(items, status_code=400))
+        self.assertIn("items", self.lookup([], status_code=400))
+        self.assertEqual(len(self.lookup(items[:-1])["results"]), settings.WATCHLIST_MEMBERSHIP_MAX_ITEMS)
+
+
+@override_settings(JWT_KEYS=TEST_KEYS, SLOW_REQUEST_MS=0)
+class RequestMetricsTests(ShardedTestCase):
+    user_id = "metrics-user"
+    path = "/api/watchlist/stats/"
+
+    def setUp(self):
+        apply_batch(self.user_id, [{"op": "add", "media_id": "1", "media_type": "anime", "title": "One"}])
+
+    def histograms(self, route):
+        names = ["db_queries_per_request_sum", "db_queries_per_request_count", "db_query_duration_seconds_per_request_sum"]
+        return [REGISTRY.get_sample_value(name, {"route": route}) or 0 for name in names]
+
+    @contextmanager
+    def measure(self, path):
+        """Yields a dict that gets the queries the metrics recorded and those actually run."""
+        route = resolve(path).route
+        before = self.histograms(route)
+        measured = {}
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            logs = stack.enter_context(self.assertLogs("service_common.metrics", "WARNING"))
+            yield measured
+        queries, requests, duration = (after - start for after, start in zip(self.histograms(route), before))
+        measured.update(
+            queries=queries, requests=requests, duration=duration, run=sum(map(len, captured)), log=logs.output[-1]
+        )
+
+    def test_queries_and_time_are_recorded_per_request(self):
+        with self.measure(self.path) as measured:
+            self.assertEqual(self.client.get(self.path, **auth_headers(self.user_id)).status_code, 200)
+        self.assertEqual(measured["requests"], 1)
+        self.assertGreater(measured["run"], 0)
+        self.assertEqual(measured["queries"], measured["run"])
+        self.assertGreater(measured["duration"], 0)
+        self.assertIn(f"{measured['run']} queries", measured["log"])
+
+    def test_counts_do_not_leak_between_requests(self):
+        self.client.get(self.path, **auth_headers(self.user_id))
+        with self.measure(self.path) as measured:
+            # Outside any request
+            with use_user(self.user_id):
+                Watchlist.objects.filter(user_id=self.user_id).count()
+            self.assertEqual(self.client.get(self.path, HTTP_AUTHORIZATION="Bearer not-a-token").status_code, 403)
+        self.assertEqual((measured["requests"], measured["queries"]), (1, 0))
+        self.assertIn(" 0 queries", measured["log"])
+
+    @override_settings(WATCHLIST_ASYNC_VIEWS=True)
+    def test_async_view_queries_are_counted(self):
+        # Run in sync_to_async threads, which the request's context follows
+        headers = {"Authorization": f"Bearer {token_for(self.user_id)}"}
+        with self.measure(self.path) as measured:
+            response = async_to_sync(self.async_client.get)(self.path, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(measured["requests"], 1)
+        self.assertGreater(measured["run"], 0)
+        self.assertEqual(measured["queries"], measured["run"])
+
+
+@override_settings(JWT_KEYS=TEST_KEYS, PROFILING_SECRET="profiling-secret")
+class ProfilingTests(ShardedTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(profiling, "profile_store", ProfileStore(None, 3))
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def token(self, *args):
+        out = StringIO()
+        call_command("profile_token", *args, stdout=out)
+        return out.getvalue().strip()
+
+    def profiles(self, token):
+        return self.client.get("/profiles/", HTTP_X_PROFILE_TOKEN=token)
+
+    def test_signed_token_profiles_requests(self):
+        token = self.token("--ttl", "60")
+        response = self.client.get("/api/watchlist/stats/", HTTP_X_PROFILE_TOKEN=token, **auth_headers("profiled-user"))
+        self.assertEqual(response.status_code, 200)
+        profile_id = response["X-Profile-Id"]
+
+        listed = self.profiles(token)
+        self.assertEqual(listed.status_code, 200)
+        [info] = listed.json()["results"]
+        self.assertEqual((info["id"], info["path"], info["trigger"]), (profile_id, "/api/watchlist/stats/", "token"))
+        response = self.client.get(f"/profiles/{profile_id}/", HTTP_X_PROFILE_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        # Reading profiles is not profiled
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(len(self.store.list()), 1)
+
+    def test_unsigned_or_expired_tokens_are_rejected(self):
+        expires = int(time.time()) + 60
+        with override_settings(PROFILING_SECRET="another-secret"):
+            foreign = sign_token(expires)
+        tokens = [
+            None,
+            "",
+            str(expires),
+            f"{expires}.{'0' * 64}",
+            foreign,
+            sign_token(int(time.time()) - 1),
+            f"{expires + 1}.{sign_token(expires).partition('.')[2]}",
+        ]
+        for token in tokens:
+            with self.subTest(token):
+                headers = {} if token is None else {"HTTP_X_PROFILE_TOKEN": token}
+                self.assertEqual(self.client.get("/profiles/", **headers).status_code, 403)
+                response = self.client.get("/api/watchlist/stats/", **headers, **auth_headers("profiled-user"))
+                self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.store.list(), [])
+
+    @override_settings(PROFILING_SECRET=None)
+    def test_tokens_need_a_secret(self):
+        with self.assertRaises(CommandError):
+            self.token()
+        self.assertEqual(self.profiles(f"{int(time.time()) + 60}.").status_code, 403)
+
+    def test_store_keeps_the_newest_profiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for store in (self.store, ProfileStore(directory, 3)):
+                with self.subTest(directory=store.directory):
+                    ids = [f"20260301T0000000000{i:02d}-0000000{i}" for i in range(5)]
+                    for profile_id in ids:
+                        store.add({"id": profile_id}, f"stack {profile_id} 1\n")
+                    self.assertEqual([info["id"] for info in store.list()], ids[:1:-1])
+                    self.assertEqual(store.get(ids[-1]), f"stack {ids[-1]} 1\n")
+                    self.assertIsNone(store.get(ids[0]))
+                    self.assertIsNone(store.get(f"../{ids[-1]}"))
+
+    def test_sampler_collapses_stacks(self):
+        sampler = Sampler(threading.get_ident(), 1)
+        sampler.sample()
+        sampler.sample()
+        [line] = sampler.collapsed().splitlines()
+        stack, count = line.rsplit(" ", 1)
+        self.assertEqual(count, "2")
+        # Paths under the project are relative to it
+        frames = stack.split(";")
+        self.assertIn(f"ProfilingTests.test_sampler_collapses_stacks (watchlist{os.sep}tests.py:", frames[-2])
+        self.assertTrue(frames[-1].startswith("Sampler.sample ("))
@@ -0,0 +1,172 @@
+import codecs
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import exceptions
+
+from .batch import apply_batch
+from .models import LIST_ORDER
+
+EXPORT_FIELDS = ["id", "media_id", "media_type", "title", "poster_url", "status", "created_at", "updated_at"]
+IMPORT_FIELDS = ["media_id", "media_type", "title", "poster_url", "status"]
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "watchlist.ndjson"),
+    "csv": ("text/csv", "watchlist.csv"),
+}
+# Invalid rows reported back by an import; the rest are only counted.
+MAX_REPORTED_ERRORS = 100
+
+
+def get_format(request):
+    name = request.GET.get("type", "ndjson")
+    if name not in FORMATS:
+        raise exceptions.ValidationError({"type": [f"Must be one of: {', '.join(FORMATS)}."]})
+    return name
+
+
+def export_queryset(queryset, fields):
+    # Walks the (user_id, created_at, id) or (user_id, id) index, so no sort even for full dumps
+    return queryset.order_by("user_id", *LIST_ORDER).values_list(*fields)
+
+
+def export_record(row, fields):
+    # Same representation WatchlistSerializer gives these fields
+    record = dict(zip(fields, row))
+    record["id"] = str(record["id"])
+    for field in ("created_at", "updated_at"):
+        record[field] = record[field].isoformat().replace("+00:00", "Z")
+    return record
+
+
+class Line:
+    """Write target for csv.writer that hands back the formatted line."""
+
+    def write(self, value):
+        return value
+
+
+class Renderer:
+    """Encodes export rows as NDJSON or CSV lines."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.writer = csv.writer(Line())
+
+    def header(self):
+        return self.writer.writerow(self.fields).encode() if self.name == "csv" else b""
+
+    def row(self, row):
+        record = export_record(row, self.fields)
+        if self.name == "csv":
+            return self.writer.writerow(record.values()).encode()
+        return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+def export_entries(queryset, name, fields=EXPORT_FIELDS):
+    """Stream the export from a server-side cursor, `WATCHLIST_EXPORT_CHUNK_SIZE` rows at a time."""
+    renderer = Renderer(name, fields)
+    yield renderer.header()
+    for row in export_queryset(queryset, fields).iterator(chunk_size=settings.WATCHLIST_EXPORT_CHUNK_SIZE):
+        yield renderer.row(row)
+
+
+async def aexport_entries(queryset, name, fields=EXPORT_FIELDS):
+    # ASGI buffers a sync iterator completely before sending it, so async
+    # deployments need an async generator to actually stream. Django 4.2's
+    # aiterator() runs values_list() queries on the event loop, so slices of
+    # the sync iterator are fetched in the request's sync thread instead.
+    size = settings.WATCHLIST_EXPORT_CHUNK_SIZE
+    renderer = Renderer(name, fields)
+    rows = export_queryset(queryset, fields).iterator(chunk_size=size)
+    yield renderer.header()
+    while True:
+        chunk = await sync_to_async(list)(islice(rows, size))
+        for row in chunk:
+            yield renderer.row(row)
+        if len(chunk) < size:
+            break
+
+
+def export_response(queryset, name, asynchronous=False):
+    content_type, filename = FORMATS[name]
+    # Rows are read after the view returns, once the request's shard is no
+    # longer selected
+    queryset = queryset.using(queryset.db)
+    content = aexport_entries(queryset, name) if asynchronous else export_entries(queryset, name)
+    return StreamingHttpResponse(
+        content, content_type=content_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def parse_records(stream, content_type):
+    """Yield one dict per uploaded row, reading `stream` a line at a time."""
+    try:
+        yield from parse_lines(codecs.iterdecode(stream, "utf-8"), content_type)
+    except UnicodeDecodeError:
+        raise exceptions.ParseError("Upload must be UTF-8 encoded.")
+    except csv.Error as exc:
+        raise exceptions.ParseError(f"CSV parse error - {exc}")
+
+
+def parse_lines(lines, content_type):
+    if content_type == "text/csv":
+        for record in csv.DictReader(lines):
+            yield {field: value for field, value in record.items() if field in IMPORT_FIELDS and value != ""}
+    elif content_type in ("application/x-ndjson", "application/jsonl"):
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield {"error": f"JSON parse error - {exc}"}
+                continue
+            if not isinstance(record, dict):
+                yield {"error": "Expected a JSON object."}
+                continue
+            yield {field: value for field, value in record.items() if field in IMPORT_FIELDS and value is not None}
+    else:
+        raise exceptions.UnsupportedMediaType(content_type)
+
+
+def import_entries(user_id, stream, content_type):
+    """Add or update every uploaded row, `WATCHLIST_IMPORT_BATCH_SIZE` at a time.
+
+    Rows are upserted by `(media_id, media_type)` through `apply_batch`, so
+    each batch is its own transaction with stats, change feed and outbox
+    kept in step. Only the current batch is held in memory.
+    """
+    summary = {"created": 0, "updated": 0, "invalid": 0, "errors": []}
+    batch, rows = [], []
+
+    def report(row, errors):
+        summary["invalid"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append({"row": row, "errors": errors})
+
+    def flush():
+        for row, result in zip(rows, apply_batch(user_id, batch)):
+            if result["result"] == "invalid":
+                report(row, result["errors"])
+            else:
+                summary[result["result"]] += 1
+        batch.clear()
+        rows.clear()
+
+    for row, record in enumerate(parse_records(stream, content_type), start=1):
+        if "error" in record:
+            report(row, {"non_field_errors": [record["error"]]})
+            continue
+        batch.append({"op": "add", **record})
+        rows.append(row)
+        if len(batch) == settings.WATCHLIST_IMPORT_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    summary["errors"].sort(key=lambda error: error["row"])
+    return summary
@@ -0,0 +1,188 @@
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, FloatField, Func, Max, Q, Sum, Value, When
+from django.db.models.functions import Power
+
+from .cache import LocalLRUCache
+from .models import TrendingScore, Watchlist
+from .sharding import SHARDS
+
+ADD_WEIGHT = 1.0
+# Moving an entry to one of these statuses; moving it back to planned counts nothing
+STATUS_WEIGHTS = {Watchlist.Status.WATCHING: 0.5, Watchlist.Status.COMPLETED: 0.5}
+FIELDS = ["media_id", "media_type", "title", "poster_url", "score"]
+
+UPSERT = """
+    INSERT INTO {table} (media_id, media_type, title, poster_url, score, events, updated_at)
+    VALUES {values}
+    ON CONFLICT (media_id, media_type) DO UPDATE
+    SET score = {table}.score + EXCLUDED.score, events = {table}.events + EXCLUDED.events,
+        title = EXCLUDED.title, poster_url = EXCLUDED.poster_url, updated_at = EXCLUDED.updated_at
+"""
+
+
+def parse_epoch(value):
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+EPOCH = parse_epoch(settings.TRENDING_EPOCH)
+HALF_LIFE = settings.TRENDING_HALF_LIFE_HOURS * 3600
+
+
+def growth(at):
+    """Forward-decay multiplier of an event at `at` (epoch seconds)."""
+    return 2.0 ** ((at - EPOCH) / HALF_LIFE)
+
+
+def status_weight(previous, status):
+    return STATUS_WEIGHTS.get(status, 0.0) if status != previous else 0.0
+
+
+def record(activity, using=None):
+    """Add `(entry, weight)` pairs to the trending scores once the `using` transaction commits.
+
+    Applied after commit so a popular title's row is not locked for the
+    length of every write transaction that touches it. A failed update is
+    logged rather than failing the committed write; rebuild_trending repairs
+    the scores.
+    """
+    totals = {}
+    for entry, weight in activity:
+        if weight:
+            key = (entry.media_id, entry.media_type)
+            total, events = totals.get(key, (0.0, 0, None, None))[:2]
+            totals[key] = (total + weight, events + 1, entry.title, entry.poster_url)
+    if totals:
+        transaction.on_commit(partial(add_scores, totals, time.time()), using=using, robust=True)
+
+
+def add_scores(totals, at):
+    """One upsert adding `{(media_id, media_type): (weight, events, title, poster_url)}` at time `at`."""
+    factor = growth(at)
+    updated_at = connection.ops.adapt_datetimefield_value(datetime.fromtimestamp(at, timezone.utc))
+    params = []
+    # Sorted so that concurrent upserts lock rows in the same order
+    for (media_id, media_type), (weight, events, title, poster_url) in sorted(totals.items()):
+        params += [media_id, media_type, title, poster_url, weight * factor, events, updated_at]
+    table = connection.ops.quote_name(TrendingScore._meta.db_table)
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(totals))
+    with connection.cursor() as cursor:
+        cursor.execute(UPSERT.format(table=table, values=values), params)
+
+
+# Top lists are small and read on every home page, so each worker keeps them
+# briefly in front of the shared cache.
+local_top = LocalLRUCache(max_entries=8)
+
+
+def top_key(media_type):
+    return f"trending:{media_type or 'all'}"
+
+
+def get_top(media_type=None, limit=None):
+    """The `limit` top titles, overall or of one media type, with their current scores.
+
+    Reads at most TRENDING_MAX_PAGE_SIZE rows off the score index, cached
+    for TRENDING_CACHE_TIMEOUT seconds per tier, so the cost does not depend
+    on the size of the table.
+    """
+    key = top_key(media_type)
+    results = local_top.get(key)
+    if results is None:
+        shared = caches[settings.WATCHLIST_CACHE_ALIAS]
+        results = shared.get(key)
+        if results is None:
+            results = query_top(media_type)
+            shared.set(key, results, timeout=settings.TRENDING_CACHE_TIMEOUT)
+        local_top.set(key, results, expires_at=time.time() + settings.TRENDING_CACHE_TIMEOUT)
+    return results[:limit]
+
+
+def query_top(media_type=None):
+    rows = TrendingScore.objects.all()
+    if media_type:
+        rows = rows.filter(media_type=media_type)
+    rows = rows.order_by("-score").values_list(*FIELDS)[: settings.TRENDING_MAX_PAGE_SIZE]
+    # Stored scores are relative to TRENDING_EPOCH; report them as of now
+    now = growth(time.time())
+    return [{**dict(zip(FIELDS, row)), "score": row[-1] / now} for row in rows]
+
+
+def invalidate_top():
+    caches[settings.WATCHLIST_CACHE_ALIAS].delete_many([top_key(None), *map(top_key, Watchlist.MediaType.values)])
+    local_top.clear()
+
+
+class EpochSeconds(Func):
+    """Seconds since 1970 of a datetime column, as a float."""
+
+    output_field = FloatField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        template = "EXTRACT(EPOCH FROM %(expressions)s)::double precision"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Django stores UTC text timestamps; julianday() counts days from 4714 BC
+        template = "((julianday(%(expressions)s) - 2440587.5) * 86400.0)"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+
+def history_growth(field):
+    return Power(Value(2.0), (EpochSeconds(field) - Value(EPOCH)) / Value(HALF_LIFE))
+
+
+def compute_scores(queryset):
+    """Scores recomputed from `Watchlist` rows in one GROUP BY pass inside the database.
+
+    Each entry counts as an add at `created_at` and, if it changed later, as
+    a move to its current status at `updated_at`. Earlier status changes and
+    removed entries are no longer in the table and are not counted.
+    """
+    changed = Q(status__in=list(STATUS_WEIGHTS), updated_at__gt=F("created_at") + timedelta(seconds=1))
+    weight = Case(
+        *(When(status=status, then=Value(value)) for status, value in STATUS_WEIGHTS.items()),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return (
+        queryset.values("media_id", "media_type")
+        .annotate(
+            score=Sum(
+                Value(ADD_WEIGHT) * history_growth("created_at")
+                + Case(When(changed, then=weight * history_growth("updated_at")), default=Value(0.0))
+            ),
+            events=Count("id") + Count("id", filter=changed),
+            title=Max("title"),
+            poster_url=Max("poster_url"),
+            updated_at=Max("updated_at"),
+        )
+        .order_by()
+    )
+
+
+def rebuild(batch_size=1000):
+    """Replace every trending score with one recomputed from history; returns the row count."""
+    totals = {}
+    # One aggregate per shard, summed here
+    for shard in SHARDS:
+        for row in compute_scores(Watchlist.objects.using(shard)).iterator(chunk_size=batch_size):
+            total = totals.setdefault((row["media_id"], row["media_type"]), row)
+            if total is not row:
+                total["score"] += row["score"]
+                total["events"] += row["events"]
+                total["updated_at"] = max(total["updated_at"], row["updated_at"])
+    rows = [TrendingScore(**row) for row in totals.values()]
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingScore.objects.bulk_create(rows, batch_size=batch_size)
+    invalidate_top()
+    return len(rows)
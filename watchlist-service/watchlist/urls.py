@@ -1,10 +1,40 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import WatchlistViewSet
+from .views import PlaybackProgressViewSet, TrendingViewSet, WatchlistViewSet
+from .async_views import (
+    AsyncWatchlistBatchView,
+    AsyncWatchlistChangesView,
+    AsyncWatchlistDetailView,
+    AsyncWatchlistExportView,
+    AsyncWatchlistImportView,
+    AsyncWatchlistListView,
+    AsyncWatchlistMembershipView,
+    AsyncWatchlistStatsView,
+)
 
 router = DefaultRouter()
 router.register(r'watchlist', WatchlistViewSet, basename='watchlist')
+router.register(r'progress', PlaybackProgressViewSet, basename='progress')
+router.register(r'trending', TrendingViewSet, basename='trending')
 
-urlpatterns = [
-    path('', include(router.urls)),
-]
+if settings.WATCHLIST_ASYNC_VIEWS:
+    # Same URLs and names as the router, served by the native async views
+    urlpatterns = [
+        path('watchlist/', AsyncWatchlistListView.as_view(), name='watchlist-list'),
+        path('watchlist/batch/', AsyncWatchlistBatchView.as_view(), name='watchlist-batch'),
+        path('watchlist/membership/', AsyncWatchlistMembershipView.as_view(), name='watchlist-membership'),
+        path('watchlist/stats/', AsyncWatchlistStatsView.as_view(), name='watchlist-stats'),
+        path('watchlist/changes/', AsyncWatchlistChangesView.as_view(), name='watchlist-changes'),
+        path('watchlist/export/', AsyncWatchlistExportView.as_view(), name='watchlist-export'),
+        path('watchlist/import/', AsyncWatchlistImportView.as_view(), name='watchlist-import'),
+        path('watchlist/<str:pk>/', AsyncWatchlistDetailView.as_view(), name='watchlist-detail'),
+        # No async variant; heartbeats only touch the buffer
+        path('progress/', PlaybackProgressViewSet.as_view({'get': 'list'}), name='progress-list'),
+        path('progress/heartbeat/', PlaybackProgressViewSet.as_view({'post': 'heartbeat'}), name='progress-heartbeat'),
+        path('trending/', TrendingViewSet.as_view({'get': 'list'}), name='trending-list'),
+    ]
+else:
+    urlpatterns = [
+        path('', include(router.urls)),
+    ]
@@ -1,7 +1,36 @@
-from rest_framework import viewsets
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from service_common.renderers import FastJSONRenderer
+from service_common.replicas import read_only
+from service_common.rows import RowSerializer
+from .batch import apply_batch
+from .cache import watchlist_cache
+from .changes import get_changes
+from .membership import lookup_membership
 from .models import Watchlist
-from .serializers import WatchlistSerializer
-from .permissions import IsOwner
+from .progress import playback_progress
+from .serializers import (
+    PlaybackHeartbeatSerializer,
+    PlaybackProgressSerializer,
+    TrendingQuerySerializer,
+    TrendingScoreSerializer,
+    WatchlistBatchSerializer,
+    WatchlistMembershipItemSerializer,
+    WatchlistMembershipSerializer,
+    WatchlistSerializer,
+    WatchlistStatsSerializer,
+)
+from .services import delete_entry
+from .stats import get_stats
+from .trending import get_top
+from .transfer import export_response, get_format, import_entries
+from .pagination import WatchlistCursorPagination
+from .permissions import HasUserId, IsOwner
 
 
 class WatchlistViewSet(viewsets.ModelViewSet):
@@ -13,17 +42,52 @@ class WatchlistViewSet(viewsets.ModelViewSet):
 
     serializer_class = WatchlistSerializer
     permission_classes = [IsOwner]
+    pagination_class = WatchlistCursorPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    # List pages are built from values_list() rows; None uses serializer_class
+    row_serializer = RowSerializer(WatchlistSerializer)
 
     def get_queryset(self):
         user_id = getattr(self.request.user, "id", None)
+        return Watchlist.objects.for_user(user_id)
+
+    def list(self, request, *args, **kwargs):
+        # Served from the per-user cache; If-None-Match is answered without
+        # touching the database or the serializer.
+        user_id = getattr(request.user, "id", None)
         if not user_id:
-            return Watchlist.objects.none()
-        return Watchlist.objects.filter(user_id=str(user_id)).order_by("-created_at")
+            return super().list(request, *args, **kwargs)
+        url = request.build_absolute_uri()
+        version = watchlist_cache.get_version(user_id)
+        etag = watchlist_cache.etag(user_id, version, url)
+        if watchlist_cache.not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        key = watchlist_cache.page_key(user_id, version, url)
+        data = watchlist_cache.get(key)
+        if data is None:
+            data = self.list_data(request, *args, **kwargs)
+            watchlist_cache.set(key, data)
+        headers = {"Cache-Control": "private, no-cache"}
+        if etag is not None:
+            headers["ETag"] = etag
+        return Response(data, headers=headers)
+
+    def list_data(self, request, *args, **kwargs):
+        if self.row_serializer is None:
+            return super().list(request, *args, **kwargs).data
+        page = self.paginate_queryset(self.row_serializer.rows(self.filter_queryset(self.get_queryset())))
+        return self.paginator.get_paginated_data(self.row_serializer.many(page))
 
+    # Stats and cache invalidation are handled by watchlist.services, which
+    # the serializer's create/update go through.
     def perform_create(self, serializer):
         user_id = getattr(self.request.user, "id", None)
         serializer.save(user_id=str(user_id))
 
+    def perform_destroy(self, instance):
+        delete_entry(instance)
+
     def retrieve(self, request, *args, **kwargs):
         # Standard retrieve still enforces object permissions via IsOwner
         return super().retrieve(request, *args, **kwargs)
@@ -36,3 +100,86 @@ class WatchlistViewSet(viewsets.ModelViewSet):
 
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
+
+    @action(detail=False, methods=["post"], url_path="batch")
+    def batch(self, request):
+        """Apply many add/update/remove operations in one request and transaction."""
+        serializer = WatchlistBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = apply_batch(request.user.id, serializer.validated_data["operations"])
+        return Response({"results": results})
+
+    @action(detail=False, methods=["post"], url_path="membership")
+    @read_only
+    def membership(self, request):
+        """Watch status of each requested (media_id, media_type), or null if not listed."""
+        serializer = WatchlistMembershipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({"results": lookup_membership(request.user.id, serializer.validated_data["items"])})
+
+    @action(detail=False, methods=["get"], url_path="stats")
+    def stats(self, request):
+        """Entry counts for the user: total, by status and by media type."""
+        return Response(WatchlistStatsSerializer(get_stats(request.user.id)).data)
+
+    @action(detail=False, methods=["get"], url_path="changes")
+    def changes(self, request):
+        """Entries changed and deleted since `?since=<cursor>`, with the next cursor."""
+        return Response(get_changes(request.user.id, request))
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request):
+        """The whole watchlist as NDJSON (default) or CSV (`?type=csv`), streamed."""
+        # Under ASGI a sync iterator would be buffered whole before sending
+        asynchronous = isinstance(request._request, ASGIRequest)
+        return export_response(self.get_queryset(), get_format(request), asynchronous=asynchronous)
+
+    @action(detail=False, methods=["post"], url_path="import", url_name="import")
+    def bulk_import(self, request):
+        """Add or update entries from an NDJSON or CSV upload, read a line at a time."""
+        return Response(import_entries(request.user.id, request._request, request._request.content_type))
+
+
+class PlaybackProgressViewSet(viewsets.ViewSet):
+    """Playback heartbeats and "continue watching" for the authenticated user.
+
+    Heartbeats are buffered and written in bulk by watchlist.progress, so
+    the player can report every few seconds.
+    """
+
+    permission_classes = [HasUserId]
+
+    def list(self, request):
+        """Most recently played episodes, or every episode of `?media_id=&media_type=`."""
+        if "media_id" in request.query_params:
+            title = WatchlistMembershipItemSerializer(data=request.query_params)
+            title.is_valid(raise_exception=True)
+            progress = playback_progress.get(request.user.id, **title.validated_data)
+        else:
+            progress = playback_progress.get(request.user.id, limit=settings.PLAYBACK_CONTINUE_WATCHING_LIMIT)
+        return Response({"results": PlaybackProgressSerializer(progress, many=True).data})
+
+    @action(detail=False, methods=["post"], url_path="heartbeat")
+    def heartbeat(self, request):
+        """Record the current playback position of an episode or movie."""
+        serializer = PlaybackHeartbeatSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        playback_progress.record(str(request.user.id), **serializer.validated_data)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TrendingViewSet(viewsets.ViewSet):
+    """Most added and watched titles right now, across all users.
+
+    Public: the lists hold no per-user data and are cached by watchlist.trending.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        """Top `?limit=` titles by decayed score, optionally of one `?media_type=`."""
+        query = TrendingQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        top = get_top(query.validated_data.get("media_type"), query.validated_data["limit"])
+        return Response({"results": TrendingScoreSerializer(top, many=True).data})
@@ -19,17 +19,24 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "corsheaders",
     "rest_framework",
+    "service_common",
     "watchlist",
 ]
 
 MIDDLEWARE = [
+    "service_common.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    # After CorsMiddleware, so the browser can read a shed 503
+    "service_common.admission.LoadShedMiddleware",
+    "service_common.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "watchlist.sharding.ShardMiddleware",
+    "service_common.replicas.ReplicaMiddleware",
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -73,7 +80,79 @@ WSGI_APPLICATION = "watchlist_service.wsgi.application"
 # }
 
 DATABASE_URL = os.environ.get("DATABASE_URL", f'sqlite:///{BASE_DIR / "db.sqlite3"}')
-DATABASES = {"default": dj_database_url.parse(DATABASE_URL, conn_max_age=600)}
+DATABASES = {"default": dj_database_url.parse(DATABASE_URL, conn_max_age=600, conn_health_checks=True)}
+
+# Horizontal sharding (watchlist.sharding). WATCHLIST_SHARD_URLS adds one
+# database per whitespace-separated "alias=url". Per-user tables live on the
+# WATCHLIST_SHARDS databases ("default" may be one of them); new users are
+# hashed onto WATCHLIST_SHARD_RING. Unset, everything stays in "default".
+for spec in os.environ.get("WATCHLIST_SHARD_URLS", "").split():
+    alias, _, url = spec.partition("=")
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+SHARD_ALIASES = [alias for alias in DATABASES if alias != "default"] or ["default"]
+WATCHLIST_SHARDS = os.environ.get("WATCHLIST_SHARDS", ",".join(SHARD_ALIASES)).split(",")
+WATCHLIST_SHARD_RING = os.environ.get("WATCHLIST_SHARD_RING", ",".join(WATCHLIST_SHARDS)).split(",")
+# Seconds a worker trusts a cached user placement; rebalance_shards waits
+# this long (plus WATCHLIST_SHARD_MOVE_GRACE) before and after moving users
+WATCHLIST_SHARD_DIRECTORY_TTL = float(os.environ.get("WATCHLIST_SHARD_DIRECTORY_TTL", "5"))
+WATCHLIST_SHARD_DIRECTORY_ENTRIES = int(os.environ.get("WATCHLIST_SHARD_DIRECTORY_ENTRIES", "100000"))
+WATCHLIST_SHARD_MOVE_GRACE = float(os.environ.get("WATCHLIST_SHARD_MOVE_GRACE", "5"))
+DATABASE_ROUTERS = ["watchlist.sharding.ShardRouter"]
+
+# Read replicas (service_common.replicas). DATABASE_REPLICA_URLS lists
+# whitespace-separated "primary=url" pairs; "default" or a shard may have
+# several. Requests read from a replica unless they write, or their user
+# wrote within DATABASE_REPLICA_STICKY_SECONDS. A replica more than
+# DATABASE_REPLICA_MAX_LAG seconds behind, checked every
+# DATABASE_REPLICA_CHECK_INTERVAL, takes no reads; keep the lag limit below
+# the sticky window.
+DATABASE_REPLICAS = {}
+for spec in os.environ.get("DATABASE_REPLICA_URLS", "").split():
+    primary, _, url = spec.partition("=")
+    aliases = DATABASE_REPLICAS.setdefault(primary, [])
+    aliases.append(f"{primary}_replica{len(aliases) + 1}")
+    DATABASES[aliases[-1]] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+    DATABASES[aliases[-1]]["TEST"] = {"MIRROR": primary}
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get("DATABASE_REPLICA_STICKY_SECONDS", "10"))
+DATABASE_REPLICA_MAX_LAG = float(os.environ.get("DATABASE_REPLICA_MAX_LAG", "5"))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.environ.get("DATABASE_REPLICA_CHECK_INTERVAL", "2"))
+# Cache holding the recent-writer markers: the shared tier of the watchlist cache
+DATABASE_REPLICA_CACHE_ALIAS = "watchlist"
+
+# Connection pool (service_common.pooled_postgresql), used for PostgreSQL URLs:
+# each worker process keeps DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE connections per database,
+# and a request waits up to DB_POOL_TIMEOUT seconds for one. Idle connections
+# are closed after DB_POOL_MAX_IDLE seconds and all are replaced after
+# DB_POOL_MAX_LIFETIME; with DB_POOL_CHECK each checkout is tested first.
+DB_POOL_ENABLED = os.environ.get("DB_POOL_ENABLED", "True").lower() in ("1", "true", "yes")
+for database in DATABASES.values():
+    if DB_POOL_ENABLED and database["ENGINE"] == "django.db.backends.postgresql":
+        database.update(
+            ENGINE="service_common.pooled_postgresql",
+            CONN_MAX_AGE=0,
+            POOL={
+                "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", "2")),
+                "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", "10")),
+                "timeout": float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+                "max_idle": float(os.environ.get("DB_POOL_MAX_IDLE", "600")),
+                "max_lifetime": float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600")),
+                "check": os.environ.get("DB_POOL_CHECK", "True").lower() in ("1", "true", "yes"),
+            },
+        )
+
+# Shared tier of the watchlist read cache (watchlist.cache), which also holds
+# the trending top lists and the replicas' recent-writer markers: Redis at
+# REDIS_URL. Without it nothing is kept there, since per-process copies would
+# let other workers serve pages and 304s from before a write.
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "watchlist": (
+        {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL, "KEY_PREFIX": "watchlist"}
+        if REDIS_URL
+        else {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    ),
+}
 
 AUTH_PASSWORD_VALIDATORS = []
 
@@ -92,3 +171,117 @@ REST_FRAMEWORK = {
 
 # JWT secret used by the authentication class - provided via environment
 JWT_SECRET = os.environ.get("JWT_SECRET", "replace-me")
+
+# Extra verification keys by `kid` header, for rotating the secret without
+# downtime, e.g. JWT_KEYS="2026-01:old-secret,2026-02:new-secret". Tokens
+# without a `kid` are tried against JWT_SECRET and then every key here.
+JWT_KEYS = dict(item.split(":", 1) for item in os.environ.get("JWT_KEYS", "").split(",") if item)
+JWT_ALGORITHMS = os.environ.get("JWT_ALGORITHMS", "HS256").split(",")
+
+# Verified-token cache in watchlist.authentication: number of tokens kept and
+# the longest a verified token is trusted before it is checked again.
+JWT_CACHE_MAX_ENTRIES = int(os.environ.get("JWT_CACHE_MAX_ENTRIES", "10000"))
+JWT_CACHE_TTL = int(os.environ.get("JWT_CACHE_TTL", "300"))
+
+# Prometheus metrics (service_common.metrics): METRICS_TOKEN, if set, must be sent
+# as a bearer token to read /metrics. Requests slower than SLOW_REQUEST_MS are
+# logged with their slowest queries.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", "500"))
+
+# On-demand profiling (service_common.profiling): requests with an X-Profile-Token
+# signed with PROFILING_SECRET (see `manage.py profile_token`), plus a random
+# PROFILING_SAMPLE_RATE share, are sampled every PROFILING_INTERVAL_MS. The
+# last PROFILING_MAX_PROFILES are kept in PROFILING_DIR, or in memory.
+PROFILING_SECRET = os.environ.get("PROFILING_SECRET")
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = int(os.environ.get("PROFILING_INTERVAL_MS", "5"))
+PROFILING_DIR = os.environ.get("PROFILING_DIR")
+PROFILING_MAX_PROFILES = int(os.environ.get("PROFILING_MAX_PROFILES", "50"))
+
+# Load shedding (service_common.admission): each worker process serves at most an
+# adaptive number of requests at once, between LOAD_SHED_MIN_LIMIT and
+# LOAD_SHED_MAX_LIMIT. Every LOAD_SHED_INTERVAL_MS the limit is cut when the
+# median latency is over LOAD_SHED_LATENCY_TOLERANCE times the unloaded one,
+# or when requests keep waiting longer than LOAD_SHED_QUEUE_TARGET_MS before
+# reaching the worker (from the proxy's X-Request-Start). It grows by one
+# while it is reached. Writes may use LOAD_SHED_WRITE_SHARE of it. Shed
+# requests get 503 with Retry-After: LOAD_SHED_RETRY_AFTER.
+LOAD_SHED_ENABLED = os.environ.get("LOAD_SHED_ENABLED", "True").lower() in ("1", "true", "yes")
+LOAD_SHED_INITIAL_LIMIT = int(os.environ.get("LOAD_SHED_INITIAL_LIMIT", "20"))
+LOAD_SHED_MIN_LIMIT = int(os.environ.get("LOAD_SHED_MIN_LIMIT", "2"))
+LOAD_SHED_MAX_LIMIT = int(os.environ.get("LOAD_SHED_MAX_LIMIT", "200"))
+LOAD_SHED_LATENCY_TOLERANCE = float(os.environ.get("LOAD_SHED_LATENCY_TOLERANCE", "2"))
+LOAD_SHED_QUEUE_TARGET_MS = int(os.environ.get("LOAD_SHED_QUEUE_TARGET_MS", "100"))
+LOAD_SHED_INTERVAL_MS = int(os.environ.get("LOAD_SHED_INTERVAL_MS", "500"))
+LOAD_SHED_WRITE_SHARE = float(os.environ.get("LOAD_SHED_WRITE_SHARE", "0.75"))
+LOAD_SHED_RETRY_AFTER = int(os.environ.get("LOAD_SHED_RETRY_AFTER", "2"))
+
+# Serve /api/watchlist/ from the native async views (watchlist.async_views)
+# instead of the DRF viewset. Only useful under an ASGI server.
+WATCHLIST_ASYNC_VIEWS = os.environ.get("WATCHLIST_ASYNC_VIEWS", "False").lower() in ("1", "true", "yes")
+
+# Default and maximum number of entries per page of GET /api/watchlist/
+WATCHLIST_PAGE_SIZE = int(os.environ.get("WATCHLIST_PAGE_SIZE", "50"))
+WATCHLIST_MAX_PAGE_SIZE = int(os.environ.get("WATCHLIST_MAX_PAGE_SIZE", "200"))
+# Page, list and export by the time-ordered id alone, on the (user_id, id)
+# index. Enable once rekey_watchlist reports no entries left to re-key.
+WATCHLIST_KEYSET_BY_ID = os.environ.get("WATCHLIST_KEYSET_BY_ID", "False").lower() in ("1", "true", "yes")
+
+# Per-user list cache: Django cache alias of the shared tier, size of the
+# in-process LRU tier and lifetime of a cached page in the shared tier.
+WATCHLIST_CACHE_ALIAS = "watchlist"
+WATCHLIST_CACHE_LOCAL_ENTRIES = int(os.environ.get("WATCHLIST_CACHE_LOCAL_ENTRIES", "1024"))
+WATCHLIST_CACHE_TIMEOUT = int(os.environ.get("WATCHLIST_CACHE_TIMEOUT", "300"))
+
+# Membership lookups: most pairs per request, and the largest list whose
+# full membership map is cached (bigger lists get one query per lookup).
+WATCHLIST_MEMBERSHIP_MAX_ITEMS = int(os.environ.get("WATCHLIST_MEMBERSHIP_MAX_ITEMS", "200"))
+WATCHLIST_MEMBERSHIP_MAX_ENTRIES = int(os.environ.get("WATCHLIST_MEMBERSHIP_MAX_ENTRIES", "20000"))
+
+# Change feed: most changes returned per GET /api/watchlist/changes/, and
+# how long tombstones of deleted entries are kept (purge_watchlist_tombstones).
+WATCHLIST_CHANGES_PAGE_SIZE = int(os.environ.get("WATCHLIST_CHANGES_PAGE_SIZE", "500"))
+WATCHLIST_TOMBSTONE_RETENTION_DAYS = int(os.environ.get("WATCHLIST_TOMBSTONE_RETENTION_DAYS", "30"))
+
+# Transactional outbox: every write queues an event that
+# `manage.py relay_watchlist_outbox` publishes to Kafka.
+KAFKA_BROKERS = os.environ.get("KAFKA_BROKERS", "")
+KAFKA_TOPIC_WATCHLIST_CHANGED = os.environ.get("KAFKA_TOPIC_WATCHLIST_CHANGED", "watchlist.changed")
+WATCHLIST_OUTBOX_PUBLISHER = os.environ.get("WATCHLIST_OUTBOX_PUBLISHER", "watchlist.publishers.KafkaPublisher")
+WATCHLIST_OUTBOX_FILE = os.environ.get("WATCHLIST_OUTBOX_FILE", str(BASE_DIR / "outbox.ndjson"))
+WATCHLIST_OUTBOX_BATCH_SIZE = int(os.environ.get("WATCHLIST_OUTBOX_BATCH_SIZE", "500"))
+WATCHLIST_OUTBOX_POLL_INTERVAL = float(os.environ.get("WATCHLIST_OUTBOX_POLL_INTERVAL", "1"))
+WATCHLIST_OUTBOX_PUBLISH_TIMEOUT = float(os.environ.get("WATCHLIST_OUTBOX_PUBLISH_TIMEOUT", "30"))
+
+# Streaming export/import: rows fetched per server-side cursor round trip,
+# and rows written per import transaction (at most WATCHLIST_BATCH_MAX_OPERATIONS).
+WATCHLIST_EXPORT_CHUNK_SIZE = int(os.environ.get("WATCHLIST_EXPORT_CHUNK_SIZE", "2000"))
+WATCHLIST_IMPORT_BATCH_SIZE = int(os.environ.get("WATCHLIST_IMPORT_BATCH_SIZE", "500"))
+
+# Playback progress (watchlist.progress): heartbeats are buffered, in Redis
+# when REDIS_URL is set and per process otherwise, and the newest position
+# per episode is upserted every PLAYBACK_FLUSH_INTERVAL seconds, at most
+# PLAYBACK_FLUSH_BATCH_SIZE rows per statement; 0 writes each heartbeat
+# straight through. Redis keeps a user's positions for reads until
+# PLAYBACK_BUFFER_TTL seconds after their last heartbeat.
+PLAYBACK_FLUSH_INTERVAL = float(os.environ.get("PLAYBACK_FLUSH_INTERVAL", "5"))
+PLAYBACK_FLUSH_BATCH_SIZE = int(os.environ.get("PLAYBACK_FLUSH_BATCH_SIZE", "1000"))
+PLAYBACK_BUFFER_TTL = int(os.environ.get("PLAYBACK_BUFFER_TTL", "3600"))
+# Entries returned by GET /api/progress/ ("continue watching")
+PLAYBACK_CONTINUE_WATCHING_LIMIT = int(os.environ.get("PLAYBACK_CONTINUE_WATCHING_LIMIT", "20"))
+
+# Trending shelves (watchlist.trending): adds and status changes count with
+# a weight that halves every TRENDING_HALF_LIFE_HOURS. Stored scores grow
+# from TRENDING_EPOCH; move it forward and run rebuild_trending well before
+# 1000 half-lives have passed. Top lists are cached TRENDING_CACHE_TIMEOUT seconds.
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", "72"))
+TRENDING_EPOCH = os.environ.get("TRENDING_EPOCH", "2026-01-01")
+TRENDING_CACHE_TIMEOUT = int(os.environ.get("TRENDING_CACHE_TIMEOUT", "60"))
+# Default and maximum number of titles per GET /api/trending/
+TRENDING_PAGE_SIZE = int(os.environ.get("TRENDING_PAGE_SIZE", "20"))
+TRENDING_MAX_PAGE_SIZE = int(os.environ.get("TRENDING_MAX_PAGE_SIZE", "100"))
+
+# Upper bound on the number of operations in one POST /api/watchlist/batch/
+WATCHLIST_BATCH_MAX_OPERATIONS = int(os.environ.get("WATCHLIST_BATCH_MAX_OPERATIONS", "500"))
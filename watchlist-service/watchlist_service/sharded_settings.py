@@ -0,0 +1,9 @@
+"""Settings for running the tests against two shards, each a local SQLite database.
+
+    python manage.py test watchlist --settings=watchlist_service.sharded_settings
+"""
+import os
+
+os.environ.setdefault("WATCHLIST_SHARD_URLS", "shard1=sqlite:///shard1.sqlite3 shard2=sqlite:///shard2.sqlite3")
+
+from .settings import *
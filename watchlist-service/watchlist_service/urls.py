@@ -1,7 +1,13 @@
 from django.urls import path, include
 
+from service_common.metrics import metrics_view
+from service_common.profiling import profile_view, profiles_view
+
 urlpatterns = [
     path('api/', include('watchlist.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', profiles_view, name='profiles'),
+    path('profiles/<str:profile_id>/', profile_view, name='profile'),
 ]
 
 # Integration note: